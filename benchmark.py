@@ -0,0 +1,459 @@
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import argparse
+import contextlib
+import functools
+import http.server
+import io
+import json
+import os
+import platform
+import sqlite3
+import tarfile
+import tempfile
+import threading
+import time
+import final_proj
+import supermovie_flask
+
+# saved calendar, movie and cast pages, in the markup final_proj.py parses, with the data of
+# super_movie.sqlite. Served from a local HTTP server, so the benchmark needs no network
+CORPUS_FILENAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_corpus.tar.xz')
+RESULTS_FILENAME = 'benchmark_results.json'
+# requests timed for every route of the flask app
+FLASK_REQUESTS = 200
+# the builds of the tables are short, the fastest of a few runs is kept
+BUILD_REPEAT = 5
+# numbers of parse processes timed against parsing in the crawl threads
+PARSE_POOL_SIZES = [1, 2, 4]
+
+class CorpusHandler(http.server.SimpleHTTPRequestHandler):
+    '''Serves the pages of the corpus, and counts them
+
+    Class Attributes
+    ----------------
+    pages: int
+        number of pages served so far
+    lock: threading.Lock
+        guards pages
+    '''
+    pages = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with CorpusHandler.lock:
+            CorpusHandler.pages += 1
+        super().do_GET()
+
+    def log_message(self, format, *args):
+        pass
+
+def serve_corpus(corpus_dir):
+    '''Start a local HTTP server serving the corpus, in a background thread
+
+    Parameters
+    ----------
+    corpus_dir: string
+        the directory the corpus was unpacked into
+
+    Returns
+    -------
+    http.server.ThreadingHTTPServer
+        the server, listening on a free port of 127.0.0.1
+    '''
+    handler = functools.partial(CorpusHandler, directory=corpus_dir)
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def summarize(durations):
+    '''Summarize timings
+
+    Parameters
+    ----------
+    durations: list
+        durations in seconds
+
+    Returns
+    -------
+    dict
+        count, mean, p50 and p99 of the durations, in milliseconds
+    '''
+    durations = sorted(durations)
+    def percentile(fraction):
+        return durations[min(int(fraction * len(durations)), len(durations) - 1)] * 1000
+    return {
+        'count': len(durations),
+        'mean_ms': round(sum(durations) / len(durations) * 1000, 4),
+        'p50_ms': round(percentile(0.50), 4),
+        'p99_ms': round(percentile(0.99), 4),
+    }
+
+def bench_crawl(base_url, workers):
+    '''Time scrape_info against the local server, once with an empty cache and once more
+    with every page cached. Must run in an empty directory, where the cache is written
+
+    Parameters
+    ----------
+    base_url: string
+        url of the local server
+    workers: int
+        number of pages fetched at the same time
+
+    Returns
+    -------
+    tuple
+        in the form of (results, movie_list, cast_list), the results of each run with the
+        pipeline metrics of the crawl
+    '''
+    final_proj.base_url = base_url
+    final_proj.url = base_url + '/calendar/'
+    final_proj.cache_store = None
+    results = {'workers': workers}
+    for run in ['cold', 'cached']:
+        pages_before = CorpusHandler.pages
+        final_proj.pipeline_metrics.reset()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            movie_list, cast_list = final_proj.scrape_info(workers, progress_interval=0)
+        elapsed = time.perf_counter() - start
+        if run == 'cold':
+            pages = CorpusHandler.pages - pages_before
+        results[run] = {
+            'pages': pages,
+            'fetched': CorpusHandler.pages - pages_before,
+            'seconds': round(elapsed, 4),
+            'pages_per_sec': round(pages / elapsed, 2),
+            'metrics': final_proj.pipeline_metrics.snapshot(),
+        }
+    results['movies'] = len(movie_list)
+    results['casts'] = len(cast_list)
+    final_proj.get_cache_store().close()
+    final_proj.cache_store = None
+    return results, movie_list, cast_list
+
+def bench_parse(corpus_dir, backends):
+    '''Time the extraction of every movie and cast page of the corpus, the parsing done by
+    get_movie_instance and get_cast_instance for a page that is not cached
+
+    Parameters
+    ----------
+    corpus_dir: string
+        the directory the corpus was unpacked into
+    backends: list
+        the parser backends to time
+
+    Returns
+    -------
+    dict
+        in the form of {backend: {'movie': summary, 'cast': summary}}, see summarize
+    '''
+    pages = {'movie': [], 'cast': []}
+    for page_type, sub_dir in [('movie', 'title'), ('cast', 'name')]:
+        for page_id in sorted(os.listdir(os.path.join(corpus_dir, sub_dir))):
+            with open(os.path.join(corpus_dir, sub_dir, page_id, 'index.html'), 'r') as page_file:
+                pages[page_type].append(page_file.read())
+    extractors = {'movie': final_proj.extract_movie, 'cast': final_proj.extract_cast}
+    results = {}
+    for backend in backends:
+        results[backend] = {}
+        for page_type, extract in extractors.items():
+            durations = []
+            for html in pages[page_type]:
+                start = time.perf_counter()
+                extract(html, backend=backend)
+                durations.append(time.perf_counter() - start)
+            results[backend][page_type] = summarize(durations)
+    return results
+
+def bench_parse_pool(corpus_dir, pool_sizes, threads):
+    '''Time the extraction of every movie and cast page of the corpus by threads crawl threads,
+    parsing in the threads themselves, then handing the pages to pools of parse processes
+
+    Parameters
+    ----------
+    corpus_dir: string
+        the directory the corpus was unpacked into
+    pool_sizes: list
+        the numbers of parse processes to time
+    threads: int
+        number of threads handing the pages to parse_page, like the crawl threads
+
+    Returns
+    -------
+    dict
+        in the form of {processes: {'pages', 'seconds', 'pages_per_sec', 'speedup'}}, 0 processes
+        being the parsing in the threads, speedup relative to it
+    '''
+    pages = []
+    for extract, sub_dir in [(final_proj.extract_movie, 'title'), (final_proj.extract_cast, 'name')]:
+        for page_id in sorted(os.listdir(os.path.join(corpus_dir, sub_dir))):
+            with open(os.path.join(corpus_dir, sub_dir, page_id, 'index.html'), 'r') as page_file:
+                pages.append((extract, page_file.read()))
+    results = {}
+    for processes in [0] + pool_sizes:
+        final_proj.start_parse_pool(processes)
+        try:
+            # the processes start on the first pages, which are not timed
+            with ThreadPoolExecutor(max_workers=max(processes, 1)) as executor:
+                list(executor.map(lambda page: final_proj.parse_page(*page), pages[:max(processes, 1)]))
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                start = time.perf_counter()
+                list(executor.map(lambda page: final_proj.parse_page(*page), pages))
+                seconds = time.perf_counter() - start
+        finally:
+            final_proj.stop_parse_pool()
+        results[str(processes)] = {'pages': len(pages), 'seconds': round(seconds, 6),
+                                   'pages_per_sec': round(len(pages) / seconds, 2)}
+    for result in results.values():
+        result['speedup'] = round(results['0']['seconds'] / result['seconds'], 3)
+    return results
+
+def bench_build(movie_list, cast_list, workdir):
+    '''Time build_movies_table and build_casts_table into an empty in-memory database, and a
+    whole build_database
+
+    Parameters
+    ----------
+    movie_list: list
+        a list of movie instances
+    cast_list: list
+        a list of cast instances
+    workdir: string
+        directory of the database written by build_database
+
+    Returns
+    -------
+    dict
+        rows/sec of every table, and of the whole database
+    '''
+    # the posters and photos of the corpus are on IMDb, the build runs without them
+    final_proj.FETCH_IMAGES = False
+    results = {}
+    for table, build_table, rows in [('movies', final_proj.build_movies_table, movie_list),
+                                     ('casts', final_proj.build_casts_table, cast_list)]:
+        best = None
+        for i in range(BUILD_REPEAT):
+            conn = sqlite3.connect(':memory:', isolation_level=None)
+            cur = conn.cursor()
+            cur.execute('BEGIN')
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                build_table(rows, cur)
+            elapsed = time.perf_counter() - start
+            conn.close()
+            best = elapsed if best is None else min(best, elapsed)
+        results[table] = {'rows': len(rows), 'seconds': round(best, 6), 'rows_per_sec': round(len(rows) / best, 2)}
+
+    db_filename = os.path.join(workdir, final_proj.DB_FILENAME)
+    best = None
+    for i in range(BUILD_REPEAT):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            counts = final_proj.build_database(movie_list, cast_list, db_filename=db_filename)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    num_of_rows = sum(table_counts['inserted'] for table_counts in counts.values())
+    results['database'] = {'rows': num_of_rows, 'seconds': round(best, 6), 'rows_per_sec': round(num_of_rows / best, 2)}
+    return results
+
+def flask_requests(db_filename):
+    '''The requests sent to every route of the flask app, cycling through the movies and casts
+    of the database
+
+    Parameters
+    ----------
+    db_filename: string
+        the database served
+
+    Returns
+    -------
+    dict
+        in the form of {route: function}, the function giving the i-th request of the route in
+        the form of (method, path, parameters)
+    '''
+    conn = sqlite3.connect(db_filename)
+    movies = [row[0] for row in conn.execute('SELECT name FROM movies ORDER BY Id')]
+    people = [row[0] for row in conn.execute('SELECT name FROM person ORDER BY Id')]
+    movie_ids = [row[0] for row in conn.execute('SELECT Id FROM movies ORDER BY Id')]
+    cast_ids = [row[0] for row in conn.execute('SELECT Id FROM person ORDER BY Id')]
+    conn.close()
+    words = [name.split()[0] for name in movies + people]
+    return {
+        '/': lambda i: ('GET', '/', None),
+        '/movie_list': lambda i: ('GET', '/movie_list', {'sort': ['score', 'date'][i % 2],
+                                                         'classification': ['All', 'Drama', 'Action'][i % 3]}),
+        '/movie_info': lambda i: ('POST', '/movie_info', {'name': movies[i % len(movies)]}),
+        '/cast_info': lambda i: ('POST', '/cast_info', {'name': people[i % len(people)]}),
+        '/search': lambda i: ('GET', '/search', {'q': words[i % len(words)]}),
+        '/autocomplete': lambda i: ('GET', '/autocomplete', {'q': words[i % len(words)][:3]}),
+        '/api/movies': lambda i: ('GET', '/api/movies', {'sort': ['score', 'date'][i % 2]}),
+        '/api/movies/<id>': lambda i: ('GET', '/api/movies/%d' % movie_ids[i % len(movie_ids)], None),
+        '/api/casts': lambda i: ('GET', '/api/casts', {'after_id': cast_ids[i % len(cast_ids)]}),
+        '/api/casts/<id>/filmography': lambda i: ('GET', '/api/casts/%d/filmography' % cast_ids[i % len(cast_ids)], None),
+        '/stats': lambda i: ('GET', '/stats', None),
+        '/api/stats': lambda i: ('GET', '/api/stats', None),
+    }
+
+def bench_flask(db_filename, num_of_requests):
+    '''Time every route of the flask app over the given database, with the test client. The
+    response cache is emptied before each request, so the pages are rendered every time
+
+    Parameters
+    ----------
+    db_filename: string
+        the database served
+    num_of_requests: int
+        number of requests timed per route, cycling through the movies and casts
+
+    Returns
+    -------
+    dict
+        in the form of {route: summary}, see summarize
+    '''
+    supermovie_flask.pool.filename = db_filename
+    routes = flask_requests(db_filename)
+    client = supermovie_flask.app.test_client()
+    results = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for route, make_request in routes.items():
+            # the first request loads the name indexes and opens the connections
+            method, path, values = make_request(0)
+            client.open(path, method=method, query_string=values if method == 'GET' else None,
+                        data=values if method == 'POST' else None)
+            durations = []
+            for i in range(num_of_requests):
+                method, path, values = make_request(i)
+                supermovie_flask.response_cache.clear()
+                start = time.perf_counter()
+                response = client.open(path, method=method, query_string=values if method == 'GET' else None,
+                                       data=values if method == 'POST' else None)
+                response.get_data()
+                durations.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    raise RuntimeError('%s %s answered %d' % (method, path, response.status_code))
+            results[route] = summarize(durations)
+    return results
+
+def flatten(results, prefix=''):
+    '''Flatten the nested results into {'path.to.value': number}, for comparing two runs
+
+    Parameters
+    ----------
+    results: dict
+        the results of a run
+    prefix: string
+        path of results in the whole results
+
+    Returns
+    -------
+    dict
+        the numbers of the results, keyed by their path
+    '''
+    values = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            values.update(flatten(value, prefix + key + '.'))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            values[prefix + key] = value
+    return values
+
+def compare(old_results, new_results):
+    '''Print the change of every timing between two runs
+
+    Parameters
+    ----------
+    old_results: dict
+        results of the earlier run
+    new_results: dict
+        results of the later run
+
+    Returns
+    -------
+    None
+    '''
+    old_values = flatten(old_results)
+    new_values = flatten(new_results)
+    for key in sorted(new_values):
+        if key in old_values and old_values[key] and not key.startswith('environment.'):
+            change = (new_values[key] - old_values[key]) / old_values[key] * 100
+            print ('%-60s %14s %14s %+8.1f%%' % (key, old_values[key], new_values[key], change))
+
+def run_benchmark(workers=final_proj.MAX_WORKERS, num_of_requests=FLASK_REQUESTS, corpus_filename=CORPUS_FILENAME,
+                  parse_pool_sizes=PARSE_POOL_SIZES):
+    '''Run every benchmark in a temporary directory
+
+    Parameters
+    ----------
+    workers: int
+        number of pages fetched at the same time by the crawl
+    num_of_requests: int
+        number of requests timed per route of the flask app
+    corpus_filename: string
+        the archive of the saved pages
+    parse_pool_sizes: list
+        the numbers of parse processes timed against parsing in the crawl threads
+
+    Returns
+    -------
+    dict
+        the results, with 'environment', 'crawl', 'parse', 'parse_pool', 'build' and 'flask'
+    '''
+    results = {
+        'environment': {
+            'time': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'parser': final_proj.PARSER,
+        }
+    }
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        corpus_dir = os.path.join(tmp_dir, 'corpus')
+        workdir = os.path.join(tmp_dir, 'work')
+        os.mkdir(workdir)
+        with tarfile.open(corpus_filename) as corpus:
+            corpus.extractall(corpus_dir)
+        server = serve_corpus(corpus_dir)
+        try:
+            os.chdir(workdir)
+            print ('Timing the crawl')
+            base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+            results['crawl'], movie_list, cast_list = bench_crawl(base_url, workers)
+            print ('Timing the parsers')
+            results['parse'] = bench_parse(corpus_dir, final_proj.PARSER_BACKENDS)
+            print ('Timing the parse processes')
+            results['parse_pool'] = bench_parse_pool(corpus_dir, parse_pool_sizes, workers)
+            print ('Timing the build')
+            results['build'] = bench_build(movie_list, cast_list, workdir)
+            print ('Timing the flask app')
+            results['flask'] = bench_flask(os.path.join(workdir, final_proj.DB_FILENAME), num_of_requests)
+        finally:
+            os.chdir(cwd)
+            server.shutdown()
+            server.server_close()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Time the crawl, the parsers, the database build and the flask app, offline')
+    parser.add_argument('--workers', type=int, default=final_proj.MAX_WORKERS,
+                        help='number of pages fetched at the same time by the crawl (default: %(default)s)')
+    parser.add_argument('--requests', type=int, default=FLASK_REQUESTS,
+                        help='number of requests timed per route of the flask app (default: %(default)s)')
+    parser.add_argument('--output', default=RESULTS_FILENAME,
+                        help='JSON file the results are written to (default: %(default)s)')
+    parser.add_argument('--compare', metavar='RESULTS',
+                        help='JSON results of an earlier run to compare with')
+    parser.add_argument('--parse-workers', type=int, nargs='+', default=PARSE_POOL_SIZES, metavar='N',
+                        help='numbers of parse processes timed against parsing in the crawl threads (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = run_benchmark(args.workers, args.requests, parse_pool_sizes=args.parse_workers)
+    with open(args.output, 'w') as results_file:
+        json.dump(results, results_file, indent=2)
+    print ('Results written to', args.output)
+    if args.compare:
+        with open(args.compare, 'r') as old_file:
+            compare(json.load(old_file), results)
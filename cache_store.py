@@ -0,0 +1,291 @@
+import json
+import os
+import sqlite3
+import threading
+
+create_cache = '''
+    CREATE TABLE IF NOT EXISTS "cache" (
+        "namespace"             TEXT,
+        "key"                   TEXT,
+        "value"                 TEXT,
+        UNIQUE ("namespace", "key")
+    );
+'''
+
+select_entry = '''
+    SELECT value FROM cache WHERE namespace = ? AND key = ?
+'''
+
+# the entries of a namespace in the order they were first written, a chunk at a time
+select_entries = '''
+    SELECT rowid, key, value FROM cache WHERE namespace = ? AND rowid > ? ORDER BY rowid LIMIT ?
+'''
+
+# entries read from disk at a time while iterating over a namespace
+SCAN_CHUNK_SIZE = 1000
+
+upsert_cache = '''
+    INSERT INTO cache (namespace, key, value) VALUES (?,?,?)
+    ON CONFLICT (namespace, key) DO UPDATE SET value = excluded.value
+'''
+
+class CacheNamespace:
+    '''instance is the view of one namespace of a CacheStore, used like a read-only dict.
+    Every lookup reads the entry from the cache file, so the memory used does not grow with
+    the number of entries
+
+    Instance Attributes
+    -------------------
+    store: CacheStore
+        the cache holding the entries
+    namespace: string
+        name of the cache
+    '''
+    def __init__(self, store, namespace):
+        self.store = store
+        self.namespace = namespace
+
+    def get(self, key, default=None):
+        value = self.store.get(self.namespace, key)
+        return default if value is None else value
+
+    def __getitem__(self, key):
+        value = self.store.get(self.namespace, key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.store.get(self.namespace, key) is not None
+
+    def __bool__(self):
+        return self.store.has_entries(self.namespace)
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        return self.store.scan(self.namespace)
+
+    def keys(self):
+        return (key for key, value in self.store.scan(self.namespace))
+
+    def values(self):
+        return (value for key, value in self.store.scan(self.namespace))
+
+class CacheStore:
+    '''instance is the persistent cache of the crawl, kept in a single SQLite file
+
+    The entries of a namespace (the old JSON cache file names, eg: 'movie.json') are
+    read from disk when they are looked up, never all at once. Each new entry is written
+    as its own row in its own transaction, so a crash can lose at most the entry being
+    written and never corrupts the cache.
+
+    Instance Attributes
+    -------------------
+    filename: str
+        path of the SQLite file holding the cache
+    conn: sqlite3.Connection
+        connection to the cache file, shared by all crawl threads
+    lock: threading.Lock
+        serializes the use of the connection
+    namespaces: dict
+        in the format of {'namespace': CacheNamespace}, the namespaces already opened
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.conn = sqlite3.connect(filename, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute(create_cache)
+        self.lock = threading.Lock()
+        self.namespaces = {}
+
+    def open(self, namespace):
+        '''Returns the entries of a namespace. A namespace that is still empty the first
+        time it is opened is migrated from the JSON file of the same name
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache, the same as the JSON file it replaces
+
+        Returns
+        -------
+        CacheNamespace
+            the cached entries, keyed by url
+        '''
+        with self.lock:
+            if namespace not in self.namespaces:
+                if not self.has_entries(namespace, locked=True):
+                    self.migrate_json(namespace)
+                self.namespaces[namespace] = CacheNamespace(self, namespace)
+            return self.namespaces[namespace]
+
+    def get(self, namespace, key):
+        '''Reads a single entry from disk
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache
+        key: string
+            the url the entry belongs to
+
+        Returns
+        -------
+        dict or list
+            the entry, None if there is none
+        '''
+        with self.lock:
+            row = self.conn.execute(select_entry, (namespace, key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def has_entries(self, namespace, locked=False):
+        '''Whether a namespace has any entry
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache
+        locked: bool
+            the caller already holds the lock
+
+        Returns
+        -------
+        bool
+            True if the namespace is not empty
+        '''
+        query = 'SELECT 1 FROM cache WHERE namespace = ? LIMIT 1'
+        if locked:
+            return self.conn.execute(query, (namespace,)).fetchone() is not None
+        with self.lock:
+            return self.conn.execute(query, (namespace,)).fetchone() is not None
+
+    def scan(self, namespace):
+        '''Iterates over the entries of a namespace in the order they were first written,
+        reading SCAN_CHUNK_SIZE entries from disk at a time. Entries written during the
+        scan may or may not be seen
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache
+
+        Returns
+        -------
+        generator
+            of (key, value) tuples
+        '''
+        last_rowid = 0
+        while True:
+            with self.lock:
+                rows = self.conn.execute(select_entries, (namespace, last_rowid, SCAN_CHUNK_SIZE)).fetchall()
+            for rowid, key, value in rows:
+                yield key, json.loads(value)
+            if len(rows) < SCAN_CHUNK_SIZE:
+                return
+            last_rowid = rows[-1][0]
+
+    def migrate_json(self, namespace):
+        '''Imports the JSON cache file named after the namespace, if there is one
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache, the same as the JSON file it replaces
+
+        Returns
+        -------
+        None
+        '''
+        if not os.path.isfile(namespace):
+            # no file, or a directory or other file of the same name
+            return
+        try:
+            with open(namespace, 'r') as cache_file:
+                entries = json.load(cache_file)
+        except ValueError:
+            print ('Ignoring unreadable cache file', namespace)
+            return
+        rows = [(namespace, key, json.dumps(value)) for key, value in entries.items()]
+        self.conn.execute('BEGIN')
+        self.conn.executemany(upsert_cache, rows)
+        self.conn.execute('COMMIT')
+        print ('Migrated', len(rows), 'entries from', namespace)
+
+    def set(self, namespace, key, value):
+        '''Records a single entry
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache
+        key: string
+            the url the entry belongs to
+        value: dict or list
+            the information scraped from the url
+
+        Returns
+        -------
+        None
+        '''
+        self.open(namespace)
+        with self.lock:
+            self.conn.execute(upsert_cache, (namespace, key, json.dumps(value)))
+
+    def update(self, namespace, entries):
+        '''Records several entries in a single transaction, keeping the other entries
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache
+        entries: dict
+            in the format of {'url': value}
+
+        Returns
+        -------
+        None
+        '''
+        self.open(namespace)
+        rows = [(namespace, key, json.dumps(value)) for key, value in entries.items()]
+        with self.lock:
+            self.conn.execute('BEGIN')
+            self.conn.executemany(upsert_cache, rows)
+            self.conn.execute('COMMIT')
+
+    def replace(self, namespace, entries):
+        '''Replaces all the entries of a namespace in a single transaction
+
+        Parameters
+        ----------
+        namespace: string
+            name of the cache
+        entries: dict
+            in the format of {'url': value}
+
+        Returns
+        -------
+        None
+        '''
+        self.open(namespace)
+        rows = [(namespace, key, json.dumps(value)) for key, value in entries.items()]
+        with self.lock:
+            self.conn.execute('BEGIN')
+            self.conn.execute('DELETE FROM cache WHERE namespace = ?', (namespace,))
+            self.conn.executemany(upsert_cache, rows)
+            self.conn.execute('COMMIT')
+
+    def close(self):
+        '''Closes the connection to the cache file
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.conn.close()
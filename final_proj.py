@@ -3,11 +3,24 @@
 ##### Uniqname: shhjiang   ###### 
 #################################
 
-from bs4 import BeautifulSoup
-import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from cache_store import CacheStore
+from image_store import ImageStore
+from page_archive import PageArchive
+from metrics import Metrics, ProgressReporter
+from datetime import datetime
+import argparse
+import collections
+import hashlib
 import json
+import multiprocessing
+import os
+import requests
 import sqlite3
 import re
+import threading
+import time
 
 url = "https://www.imdb.com/calendar/?ref_=nv_mv_cal"
 base_url = "https://www.imdb.com"
@@ -16,9 +29,86 @@ CACHE_URL_FILENAME = "movie_url.json"
 CACHE_MOVIE_FILENAME = "movie.json"
 CACHE_CAST_FILENAME = "cast.json"
 CACHE_CAST_MOVIE_URL_FILENAME = 'cast_movie.json'
+CACHE_DB_FILENAME = 'crawl_cache.sqlite'
+DB_FILENAME = 'super_movie.sqlite'
+# ETag/Last-Modified of every fetched page, keyed by url, for revalidating the cache
+CACHE_VALIDATOR_NAMESPACE = 'validators'
+# status of every page of the crawl, one namespace per stage, eg: 'frontier.movie', and the
+# number of the last crawl and whether it completed
+CACHE_FRONTIER_NAMESPACE = 'frontier'
+FRONTIER_STAGES = ['movie', 'cast', 'movie_score']
+CACHE_CRAWL_NAMESPACE = 'crawl'
+# every page fetched, compressed, so the pages can be parsed again without fetching them
+ARCHIVE_DATA_FILENAME = 'page_archive.dat'
+ARCHIVE_INDEX_FILENAME = 'page_archive.idx'
+# read the pages from the archive instead of fetching them
+FROM_ARCHIVE = False
+# local copies of the posters and photos of the database, see ImageStore, and what was
+# downloaded from every image url: {'sha256', 'content_type', 'thumbnail'}. The namespace is
+# not named after the directory, CacheStore imports the file named after a new namespace
+IMAGE_DIRECTORY = 'images'
+CACHE_IMAGE_NAMESPACE = 'image_cache'
+# download the posters and photos missing from IMAGE_DIRECTORY while building the database,
+# otherwise only the images downloaded by earlier builds are served locally
+FETCH_IMAGES = True
+
+MAX_WORKERS = 8
+# processes parsing the pages, 0 to parse them in the crawl threads. Parsing holds the GIL,
+# so the crawl threads can only parse one page at a time
+PARSE_WORKERS = 0
+# a page failing this many times, over one or several crawls, is skipped until --retry-failed
+MAX_ATTEMPTS = 3
+# pages scraped ahead of what is written to the database, and rows written per transaction:
+# together they bound the memory used by the crawl, whatever the number of pages
+QUEUE_SIZE = 64
+BATCH_SIZE = 500
+# scores of the movies casts are known for remembered by the crawl, see UrlRegistry
+REGISTRY_SIZE = 10000
+REQUEST_TIMEOUT = 30
+# seconds between two progress lines of the crawl, 0 for none
+PROGRESS_INTERVAL = 5
+
+try:
+    import brotli
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    # requests can only decode br responses with the brotli package installed
+    ACCEPT_ENCODING = 'gzip, deflate'
 
-conn = sqlite3.connect("super_movie.sqlite")
-cur = conn.cursor()
+# fastest first, html.parser ships with python and is always available
+PARSER_BACKENDS = ['html.parser']
+try:
+    import lxml
+    PARSER_BACKENDS.insert(0, 'lxml')
+except ImportError:
+    pass
+try:
+    import html5_parser
+    PARSER_BACKENDS.insert(0, 'html5-parser')
+except (ImportError, RuntimeError):
+    # html5-parser refuses to import when it was built against another libxml2 than lxml
+    pass
+PARSER = PARSER_BACKENDS[0]
+
+# the extractors only read these parts of the pages, everything else is skipped while parsing.
+# While parsing, a class attribute is still the raw string, eg: 'inline canwrap', so the
+# classes are matched one word at a time
+CALENDAR_STRAINER = SoupStrainer('div', id='main')
+MOVIE_STRAINER = SoupStrainer('div', class_=re.compile(r'(^|\s)(title_wrapper|ratingValue|credit_summary_item|inline|poster)(\s|$)'))
+CAST_STRAINER = SoupStrainer('div', class_=re.compile(r'(^|\s)(name-overview-widget|inline|knownfor-title-role)(\s|$)'))
+MOVIE_SCORE_STRAINER = SoupStrainer('div', class_=re.compile(r'(^|\s)(title_wrapper|ratingValue)(\s|$)'))
+
+cache_store = None
+cache_store_lock = threading.Lock()
+session = None
+session_lock = threading.Lock()
+page_archive = None
+page_archive_lock = threading.Lock()
+image_store = ImageStore(IMAGE_DIRECTORY)
+# the processes parsing the pages during a crawl, None to parse them in the calling thread
+parse_pool = None
+# counters and latencies of the fetches, parses, cache lookups and database writes
+pipeline_metrics = Metrics()
 
 create_movies = '''
     CREATE TABLE "movies" (
@@ -29,21 +119,144 @@ create_movies = '''
         "star2"                 TEXT,
         "star3"                 TEXT,
         "releasing_date"        TEXT,
-        "score"                 TEXT,
+        "score"                 REAL,
         "classification"        TEXT,
         "description"           TEXT,
-        "poster_url"            TEXT
+        "poster_url"            TEXT,
+        "imdb_id"               TEXT UNIQUE,
+        "row_hash"              TEXT
     );
 '''
 
+# version 2: numeric scores, ISO (yyyy-mm-dd) dates and indexes for the lookups of the flask app
+# version 3: indexes for sorting /movie_list by score or date, movies without one last
+# version 4: full-text search indexes over the names, descriptions and bios
+# version 5: person, credit and filmography tables, one row per person and per relation
+# version 6: summary tables of the movies by classification, release month and director
+# version 7: image table, the local copies of the posters and photos
+# version 8: the full-text search index of the casts is over the person table, one row per person
+SCHEMA_VERSION = 8
+
+create_indexes = [
+    'CREATE INDEX IF NOT EXISTS "movies_name" ON "movies" ("name")',
+    'CREATE INDEX IF NOT EXISTS "movies_classification" ON "movies" ("classification")',
+    'CREATE INDEX IF NOT EXISTS "movies_score" ON "movies" (IFNULL("score", -1))',
+    'CREATE INDEX IF NOT EXISTS "movies_classification_score" ON "movies" ("classification", IFNULL("score", -1))',
+    'CREATE INDEX IF NOT EXISTS "movies_date" ON "movies" (IFNULL("releasing_date", \'9999\'))',
+    'CREATE INDEX IF NOT EXISTS "movies_classification_date" ON "movies" ("classification", IFNULL("releasing_date", \'9999\'))',
+    'CREATE INDEX IF NOT EXISTS "casts_name" ON "casts" ("name")',
+    'CREATE INDEX IF NOT EXISTS "person_name" ON "person" ("name")',
+    'CREATE INDEX IF NOT EXISTS "credit_movie" ON "credit" ("movie_id", "billing")',
+    'CREATE INDEX IF NOT EXISTS "credit_person" ON "credit" ("person_id", "role")',
+    'CREATE INDEX IF NOT EXISTS "filmography_person" ON "filmography" ("person_id", "position")',
+    'CREATE INDEX IF NOT EXISTS "image_sha256" ON "image" ("sha256")',
+]
+
+# the search indexes only hold the tokens, the text is read from the movies and person tables.
+# The triggers keep them in sync with the rows written by an incremental build
+def search_index_statements(table, columns):
+    '''Statements creating the full-text search index of a table and its triggers
+
+    Parameters
+    ----------
+    table: string
+        name of the table
+    columns: list
+        the text columns that are searched
+
+    Returns
+    -------
+    list
+        the CREATE statements
+    '''
+    names = ', '.join(columns)
+    new_values = ', '.join('new."%s"' % column for column in columns)
+    old_values = ', '.join('old."%s"' % column for column in columns)
+    return [
+        '''CREATE VIRTUAL TABLE IF NOT EXISTS "{0}_fts" USING fts5({1}, content='{0}', content_rowid='Id',
+           tokenize='unicode61 remove_diacritics 2')'''.format(table, names),
+        '''CREATE TRIGGER IF NOT EXISTS "{0}_fts_insert" AFTER INSERT ON "{0}" BEGIN
+           INSERT INTO "{0}_fts" (rowid, {1}) VALUES (new."Id", {2}); END'''.format(table, names, new_values),
+        '''CREATE TRIGGER IF NOT EXISTS "{0}_fts_delete" AFTER DELETE ON "{0}" BEGIN
+           INSERT INTO "{0}_fts" ("{0}_fts", rowid, {1}) VALUES ('delete', old."Id", {2}); END'''.format(table, names, old_values),
+        '''CREATE TRIGGER IF NOT EXISTS "{0}_fts_update" AFTER UPDATE ON "{0}" BEGIN
+           INSERT INTO "{0}_fts" ("{0}_fts", rowid, {1}) VALUES ('delete', old."Id", {2});
+           INSERT INTO "{0}_fts" (rowid, {1}) VALUES (new."Id", {3}); END'''.format(table, names, old_values, new_values),
+    ]
+
+create_search_indexes = (search_index_statements('movies', ['name', 'description']) +
+                         search_index_statements('person', ['name', 'bio']))
+# the search index of the casts table, before version 8
+drop_casts_search_index = ['DROP TRIGGER IF EXISTS "casts_fts_%s"' % event for event in ['insert', 'delete', 'update']] + [
+    'DROP TABLE IF EXISTS "casts_fts"']
+
+# the summary tables count the movies and sum their scores per group, so the statistics are
+# read without scanning the movies. Like the search indexes, triggers keep them in sync with
+# the rows written by an incremental build. The scores are summed in tenths, as integers, so
+# the sums stay exact however many times a movie is added and taken away. A movie not rated
+# yet has a score of 0, it is counted in "movies" but not in "scored"
+AGGREGATE_TABLES = [
+    ('classification_stats', 'classification', '{0}."classification"'),
+    ('release_month_stats', 'month', 'CASE WHEN length({0}."releasing_date") >= 7 THEN substr({0}."releasing_date", 1, 7) END'),
+    ('director_stats', 'director', '{0}."director"'),
+]
+
+def aggregate_statements(table, key, expression):
+    '''Statements creating a summary table of the movies and its triggers
+
+    Parameters
+    ----------
+    table: string
+        name of the summary table
+    key: string
+        name of the column the movies are grouped by
+    expression: string
+        the group of a movie, with {0} standing for the movie row, eg: '{0}."director"'.
+        The movies whose group is NULL are left out
+
+    Returns
+    -------
+    list
+        the CREATE statements
+    '''
+    def add(row):
+        return '''INSERT INTO "{0}" SELECT {1}, 1, IFNULL({2}."score", 0) > 0, CAST(ROUND(IFNULL({2}."score", 0) * 10) AS INTEGER)
+           WHERE {1} IS NOT NULL
+           ON CONFLICT ("{3}") DO UPDATE SET "movies" = "movies" + 1, "scored" = "scored" + excluded."scored",
+           "score_tenths" = "score_tenths" + excluded."score_tenths";'''.format(table, expression.format(row), row, key)
+
+    def take_away(row):
+        return '''UPDATE "{0}" SET "movies" = "movies" - 1, "scored" = "scored" - (IFNULL({2}."score", 0) > 0),
+           "score_tenths" = "score_tenths" - CAST(ROUND(IFNULL({2}."score", 0) * 10) AS INTEGER) WHERE "{3}" = {1};
+           DELETE FROM "{0}" WHERE "{3}" = {1} AND "movies" = 0;'''.format(table, expression.format(row), row, key)
+
+    return [
+        '''CREATE TABLE IF NOT EXISTS "{0}" ("{1}" TEXT PRIMARY KEY, "movies" INTEGER, "scored" INTEGER,
+           "score_tenths" INTEGER)'''.format(table, key),
+        'CREATE TRIGGER IF NOT EXISTS "{0}_insert" AFTER INSERT ON "movies" BEGIN {1} END'.format(table, add('new')),
+        'CREATE TRIGGER IF NOT EXISTS "{0}_delete" AFTER DELETE ON "movies" BEGIN {1} END'.format(table, take_away('old')),
+        '''CREATE TRIGGER IF NOT EXISTS "{0}_update" AFTER UPDATE OF "score", "releasing_date", "classification", "director"
+           ON "movies" BEGIN {1} {2} END'''.format(table, take_away('old'), add('new')),
+    ]
+
+create_aggregate_tables = [statement for aggregate in AGGREGATE_TABLES for statement in aggregate_statements(*aggregate)] + [
+    # the directors are listed best average score first
+    'CREATE INDEX IF NOT EXISTS "director_stats_average" ON "director_stats" ("score_tenths" * 1.0 / "scored")',
+]
+
 drop_movies = '''
     DROP TABLE IF EXISTS "movies";
 '''
 
-insert_movies = '''
+upsert_movies = '''
     INSERT INTO movies 
-    ("name","director","star1","star2","star3","releasing_date","score","classification","description","poster_url")
-    VALUES (?,?,?,?,?,?,?,?,?,?)
+    ("name","director","star1","star2","star3","releasing_date","score","classification","description","poster_url","imdb_id","row_hash")
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT ("imdb_id") DO UPDATE SET
+    "name"=excluded."name","director"=excluded."director","star1"=excluded."star1","star2"=excluded."star2",
+    "star3"=excluded."star3","releasing_date"=excluded."releasing_date","score"=excluded."score",
+    "classification"=excluded."classification","description"=excluded."description",
+    "poster_url"=excluded."poster_url","row_hash"=excluded."row_hash"
 '''
 
 drop_casts = '''
@@ -57,25 +270,84 @@ create_casts = '''
         "position"              TEXT,
         "bio"                   TEXT,
         "film1"                 TEXT,
-        "score1"                TEXT,
+        "score1"                REAL,
         "date1"                 TEXT,
         "film2"                 TEXT,
-        "score2"                TEXT,
+        "score2"                REAL,
         "date2"                 TEXT,
         "film3"                 TEXT,
-        "score3"                TEXT,
+        "score3"                REAL,
         "date3"                 TEXT,
         "film4"                 TEXT,
-        "score4"                TEXT,
+        "score4"                REAL,
         "date4"                 TEXT,
-        "photo"                 TEXT
+        "photo"                 TEXT,
+        "imdb_id"               TEXT UNIQUE,
+        "row_hash"              TEXT
     );
 '''
 
-insert_casts = '''
+upsert_casts = '''
     INSERT INTO casts 
-    ("name","position","bio","film1","score1","date1","film2","score2","date2","film3","score3","date3","film4","score4","date4","photo")
-    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)  
+    ("name","position","bio","film1","score1","date1","film2","score2","date2","film3","score3","date3","film4","score4","date4","photo","imdb_id","row_hash")
+    VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)
+    ON CONFLICT ("imdb_id") DO UPDATE SET
+    "name"=excluded."name","position"=excluded."position","bio"=excluded."bio",
+    "film1"=excluded."film1","score1"=excluded."score1","date1"=excluded."date1",
+    "film2"=excluded."film2","score2"=excluded."score2","date2"=excluded."date2",
+    "film3"=excluded."film3","score3"=excluded."score3","date3"=excluded."date3",
+    "film4"=excluded."film4","score4"=excluded."score4","date4"=excluded."date4",
+    "photo"=excluded."photo","row_hash"=excluded."row_hash"
+'''
+
+# one row per director or actor/actress, whatever the number of movies they are in
+create_person = '''
+    CREATE TABLE "person" (
+        "Id"                    INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE,
+        "name"                  TEXT,
+        "bio"                   TEXT,
+        "photo"                 TEXT,
+        "imdb_id"               TEXT UNIQUE,
+        "row_hash"              TEXT
+    );
+'''
+
+upsert_person = '''
+    INSERT INTO person ("name","bio","photo","imdb_id","row_hash") VALUES (?,?,?,?,?)
+    ON CONFLICT ("imdb_id") DO UPDATE SET
+    "name"=excluded."name","bio"=excluded."bio","photo"=excluded."photo","row_hash"=excluded."row_hash"
+'''
+
+# a person directing (billing 0) or starring in (billing 1 to 3) a movie of the calendar
+create_credit = '''
+    CREATE TABLE "credit" (
+        "movie_id"              INTEGER NOT NULL REFERENCES "movies" ("Id"),
+        "person_id"             INTEGER NOT NULL REFERENCES "person" ("Id"),
+        "role"                  TEXT,
+        "billing"               INTEGER
+    );
+'''
+
+# the films a person is known for, in the order of their IMDb page
+create_filmography = '''
+    CREATE TABLE "filmography" (
+        "person_id"             INTEGER NOT NULL REFERENCES "person" ("Id"),
+        "position"              INTEGER,
+        "film"                  TEXT,
+        "score"                 REAL,
+        "release_date"          TEXT,
+        "film_imdb_id"          TEXT
+    );
+'''
+
+# the posters and photos downloaded into the image store, keyed by their IMDb url
+create_image = '''
+    CREATE TABLE IF NOT EXISTS "image" (
+        "url"                   TEXT PRIMARY KEY,
+        "sha256"                TEXT NOT NULL,
+        "content_type"          TEXT,
+        "thumbnail"             INTEGER
+    );
 '''
 
 class Movies:
@@ -101,8 +373,10 @@ class Movies:
         type of the movie, eg: action, drama, documentary etc.
     description: str
         story line of the movie
+    url: str
+        web link to the movie page, identifies the movie in the database
     '''
-    def __init__(self, name, director, director_url, stars, stars_url_dict, releasing_date, score, classification, description, poster_url):
+    def __init__(self, name, director, director_url, stars, stars_url_dict, releasing_date, score, classification, description, poster_url, url=None):
         self.name = name
         self.director = director
         self.director_url = director_url
@@ -113,6 +387,7 @@ class Movies:
         self.classification = classification
         self.description = description
         self.poster_url = poster_url
+        self.url = url
 
 
     def info(self):
@@ -153,15 +428,18 @@ class Cast:
         in the form of {'film_name': film_url}
     score: dict 
         in the form of {'film_name': score of the film}
+    url: str
+        web link to the cast's homepage, identifies the cast in the database
     '''
 
-    def __init__(self,position,name,bio,films,score,photo):
+    def __init__(self,position,name,bio,films,score,photo,url=None):
         self.position = position
         self.name = name
         self.bio = bio
         self.films = films
         self.score = score
         self.photo = photo
+        self.url = url
 
     def info (self):
         '''Displays the information of the instance
@@ -179,439 +457,2291 @@ class Cast:
         print (self.bio)
         print (self.films)
         print (self.score)
-   
 
-def build_movie_url_dict():
-    ''' Make a dictionary that maps movie name to movie page url, properly cached
+class UrlRegistry:
+    '''instance resolves every url at most once during a crawl, as long as it remembers it
+
+    The query string is ignored, so '/name/nm0001/?ref_=tt_ov_dr' and '/name/nm0001/?ref_=tt_ov_st'
+    are the same page. A thread asking for a url that another thread is still resolving
+    waits for that result instead of fetching the page again. Past max_size urls, the
+    results resolved the longest ago are forgotten, a url looked up again is then resolved
+    again (from the cache, since it was scraped in this crawl).
+
+    Instance Attributes
+    -------------------
+    results: collections.OrderedDict
+        in the format of {'canonical_url': Future}, oldest first
+    max_size: int
+        number of results remembered
+    hits: int
+        number of lookups answered without resolving the url again
+    lock: threading.Lock
+        guards results and hits
+    '''
+    def __init__(self, max_size=REGISTRY_SIZE):
+        self.results = collections.OrderedDict()
+        self.max_size = max_size
+        self.hits = 0
+        self.lock = threading.Lock()
+
+    def forget(self):
+        '''Forgets the oldest results resolved, past max_size urls. The caller holds the lock
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        while len(self.results) > self.max_size:
+            oldest = next(iter(self.results))
+            if not self.results[oldest].done():
+                break
+            del self.results[oldest]
+
+    def seed(self, url, value):
+        '''Records the result of a url that is already known
+
+        Parameters
+        ----------
+        url: string
+            the url the value belongs to
+        value:
+            what resolving the url would return
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            if canonical_url(url) not in self.results:
+                future = Future()
+                future.set_result(value)
+                self.results[canonical_url(url)] = future
+                self.forget()
+
+    def resolve(self, url, function):
+        '''Returns function(url), calling the function only for the first lookup of the url
+
+        Parameters
+        ----------
+        url: string
+            the url to resolve
+        function: function
+            takes the url and returns its result, eg: get_movie_score
+
+        Returns
+        -------
+        the result of function(url) for the first lookup of the url
+        '''
+        key = canonical_url(url)
+        with self.lock:
+            future = self.results.get(key)
+            if future is None:
+                future = Future()
+                self.results[key] = future
+                self.forget()
+                owner = True
+            else:
+                self.hits += 1
+                owner = False
+        if owner:
+            try:
+                future.set_result(function(url))
+            except BaseException as error:
+                future.set_exception(error)
+        return future.result()
+
+class Frontier:
+    '''instance is the status of every page of the crawl, kept in the cache database so an
+    interrupted crawl resumes where it stopped, and so the pages found by the crawl never all
+    sit in memory
+
+    Every crawl has a number. A page is 'pending' until it is scraped, then 'done' for the
+    rest of the crawl. A page whose scraping raises is left out of the crawl and tried again
+    by the next crawl, until it has failed max_attempts times and becomes 'failed': it is then
+    skipped until the failures are retried. A crawl started after an interrupted one takes
+    its number, so the pages it had done are not revalidated again.
+
+    The pages of each stage are kept in their own namespace, keyed by canonical_url, with
+    the entries in the format of {'url': url, 'position': 'star', 'status': 'pending',
+    'attempts': 0, 'error': None, 'crawl': 1}
+
+    Instance Attributes
+    -------------------
+    store: CacheStore
+        the cache database holding the status
+    max_attempts: int
+        number of failures after which a page is skipped
+    crawl: int
+        number of the current crawl
+    '''
+    def __init__(self, store, max_attempts=MAX_ATTEMPTS):
+        self.store = store
+        self.max_attempts = max_attempts
+        self.crawl = None
+
+    def namespace(self, stage):
+        '''Name of the cache namespace holding the pages of a stage
+
+        Parameters
+        ----------
+        stage: string
+            the kind of the pages, one of FRONTIER_STAGES
+
+        Returns
+        -------
+        string
+            eg: 'frontier.movie'
+        '''
+        return CACHE_FRONTIER_NAMESPACE + '.' + stage
+
+    def start(self, retry_failed=False):
+        '''Starts a crawl, resuming the last one if it was interrupted
+
+        Parameters
+        ----------
+        retry_failed: bool
+            set the failed pages back to 'pending' with no attempts
+
+        Returns
+        -------
+        bool
+            True if the last crawl is resumed
+        '''
+        state = self.store.open(CACHE_CRAWL_NAMESPACE).get('state', {})
+        resumed = not state.get('complete', True)
+        self.crawl = state.get('crawl', 0) + (0 if resumed else 1)
+        self.store.set(CACHE_CRAWL_NAMESPACE, 'state', {'crawl': self.crawl, 'complete': False})
+        if retry_failed:
+            for stage in FRONTIER_STAGES:
+                reset = {}
+                for key, entry in self.store.open(self.namespace(stage)).items():
+                    if entry['status'] == 'failed':
+                        reset[key] = dict(entry, status='pending', attempts=0, error=None)
+                self.store.update(self.namespace(stage), reset)
+        if resumed:
+            print ('Resuming crawl', self.crawl)
+        return resumed
+
+    def add(self, stage, pages):
+        '''Records the pages found by the crawl, in a single transaction
+
+        Parameters
+        ----------
+        stage: string
+            the kind of the pages, one of FRONTIER_STAGES
+        pages: list
+            of (url, position) tuples, position being what the page is scraped for if any
+
+        Returns
+        -------
+        list
+            the (url, position) tuples of the pages that were not found yet in this crawl
+        '''
+        entries = self.store.open(self.namespace(stage))
+        new = {}
+        found = []
+        for page_url, position in pages:
+            key = canonical_url(page_url)
+            entry = entries.get(key)
+            if key in new or (entry is not None and entry['crawl'] == self.crawl):
+                continue
+            if entry is not None and entry['status'] == 'failed':
+                new[key] = dict(entry, crawl=self.crawl)
+            else:
+                attempts = 0 if entry is None else entry['attempts']
+                new[key] = {'url': page_url, 'position': position, 'status': 'pending',
+                            'attempts': attempts, 'error': None, 'crawl': self.crawl}
+            found.append((page_url, position))
+        self.store.update(self.namespace(stage), new)
+        return found
+
+    def pages(self, stage):
+        '''The pages of a stage found in this crawl, in the order they were first found
+
+        Parameters
+        ----------
+        stage: string
+            the kind of the pages, one of FRONTIER_STAGES
+
+        Returns
+        -------
+        generator
+            of (url, position) tuples, read from the cache database a chunk at a time
+        '''
+        for key, entry in self.store.open(self.namespace(stage)).items():
+            if entry['crawl'] == self.crawl:
+                yield entry['url'], entry['position']
+
+    def run(self, stage, page_url, function, refresh=False):
+        '''Scrapes a page, recording whether it succeeded
+
+        Parameters
+        ----------
+        stage: string
+            the kind of the page, one of FRONTIER_STAGES
+        page_url: string
+            the url of the page
+        function: function
+            takes whether to revalidate the cached page and returns what was scraped from it
+        refresh: bool
+            revalidate the page, unless it is already done in this crawl
+
+        Returns
+        -------
+        what function returned, None if the page failed or is skipped
+        '''
+        key = canonical_url(page_url)
+        entry = self.store.get(self.namespace(stage), key)
+        if entry is None:
+            entry = {'url': page_url, 'position': None, 'status': 'pending', 'attempts': 0,
+                     'error': None, 'crawl': self.crawl}
+        if entry['status'] == 'failed':
+            pipeline_metrics.incr('frontier.skipped')
+            if entry['crawl'] != self.crawl:
+                self.store.set(self.namespace(stage), key, dict(entry, crawl=self.crawl))
+            return None
+        done = entry['status'] == 'done' and entry['crawl'] == self.crawl
+        try:
+            result = function(refresh and not done)
+        except Exception as error:
+            attempts = entry['attempts'] + 1
+            status = 'failed' if attempts >= self.max_attempts else 'pending'
+            message = '%s: %s' % (type(error).__name__, error)
+            self.store.set(self.namespace(stage), key,
+                           dict(entry, status=status, attempts=attempts, error=message, crawl=self.crawl))
+            pipeline_metrics.incr('frontier.errors')
+            print ('Failed to scrape', page_url, '(attempt', attempts, 'of', str(self.max_attempts) + '):', message)
+            return None
+        if not done:
+            self.store.set(self.namespace(stage), key,
+                           dict(entry, status='done', attempts=0, error=None, crawl=self.crawl))
+        return result
+
+    def finish(self):
+        '''Marks the crawl as complete, so the next one starts over
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.store.set(CACHE_CRAWL_NAMESPACE, 'state', {'crawl': self.crawl, 'complete': True})
+
+    def failures(self):
+        '''The pages whose last attempt in this crawl failed
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            of (stage, entry) tuples, sorted by url
+        '''
+        failures = []
+        for stage in FRONTIER_STAGES:
+            for key, entry in self.store.open(self.namespace(stage)).items():
+                if entry['crawl'] == self.crawl and entry['error'] is not None:
+                    failures.append((stage, entry))
+        return sorted(failures, key=lambda failure: failure[1]['url'])
+
+def imdb_id(page_url):
+    ''' Finds the IMDb id (tt... for a movie, nm... for a person) in an IMDb url
 
     Parameters
     ----------
-    None
+    page_url: string
+        an IMDb url, or None
 
     Returns
     -------
-    dict
-        key is a movie name and value is the movie url
-        e.g. {'Nomadland':'https://www.imdb.com/title/tt9770150/?ref_=rlm', ...}
+    string
+        the IMDb id, the url without its query string if it has none, None if there is no url
     '''
-    movie_url_dict = open_cache(CACHE_URL_FILENAME)
-    if bool(movie_url_dict) is True:
-        # dict not empty, cache exists
-        print ("Using cache")
-        return movie_url_dict
-    else:
-        # dict empty, need to fetch
-        print ("Fetching")
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        main_block = soup.find('div', id='main')
-        parent_list = main_block.find_all('ul')
-        for item in parent_list:
-            movie_list = item.find_all('li')
-            for movie in movie_list:
-                movie_name = movie.find('a').text
-                movie_url = movie.find('a')['href']
-                movie_url_dict[movie_name.lower()] = base_url + movie_url
-
-        save_cache(movie_url_dict, CACHE_URL_FILENAME)
-        return movie_url_dict
-       
+    if page_url is None:
+        return None
+    match = re.search(r'/((tt|nm)\d+)', page_url)
+    if match is None:
+        return canonical_url(page_url)
+    return match.group(1)
+
+def canonical_url(page_url):
+    ''' Strips the query string (the '?ref_=' tracking part) from an IMDb url
 
-def get_movie_instance(movie_url):
-    '''Make a 'Movies' instance from a movie URL.
-    
     Parameters
     ----------
-    movie_url: string
-        The URL for a movie page
-    
+    page_url: string
+        an IMDb url
+
     Returns
     -------
-    instance
-        a movie instance
+    string
+        the url without its query string
     '''
-    movie_dict = open_cache(CACHE_MOVIE_FILENAME)
-    if movie_url in movie_dict:
-        print ("Using cache")
-        name = movie_dict[movie_url]['name']
-        director = movie_dict[movie_url]['director']
-        director_url = movie_dict[movie_url]['director_url']
-        stars = movie_dict[movie_url]['stars']
-        stars_url_dict = movie_dict[movie_url]['stars_url_dict']
-        releasing_date = movie_dict[movie_url]['releasing_date']
-        score = movie_dict[movie_url]['score']
-        classification = movie_dict[movie_url]['classification']
-        description = movie_dict[movie_url]['description']
-        poster_url = movie_dict[movie_url]['poster_url']
+    return page_url.split('?')[0]
+   
 
-    else:
-        print ("Fetching")
-        response = requests.get(movie_url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        title_wrapper = soup.find('div', class_='title_wrapper')
-        if title_wrapper is None:
-            name = None
-            releasing_date = None
-            classification = None
-        else:
-            name = title_wrapper.find('h1').text.strip()
-            index = name.find('(')
-            name = name[0:index-1]
-            classification = title_wrapper.find('div', class_='subtext').find_all('a')[0].text.strip()
-            releasing_date = title_wrapper.find('div', class_='subtext').find_all('a')[-1].text.strip()
-            index = releasing_date.find('(')
-            releasing_date = releasing_date[0:index-1]
-        
-        score_wrapper = soup.find('div', class_='ratingValue')
-        if score_wrapper is None:
-            score = 0
-        else:
-            score = score_wrapper.text.strip()[:-3]
-        
-        director_wrapper = soup.find_all('div', class_='credit_summary_item')[0].find('a')
-        if director_wrapper is None:
-            director = None
-            director_url = None
-        else:
-            director = director_wrapper.text.strip()
-            director_url = base_url + director_wrapper['href']
-        if len(soup.find_all('div', class_='credit_summary_item')) == 3:
-            stars_wrapper = soup.find_all('div', class_='credit_summary_item')[2].find_all('a')
-        else:
-            stars_wrapper = soup.find_all('div', class_='credit_summary_item')[1].find_all('a')
-        if stars_wrapper is None:
-            stars = None
-            stars_url_dict = None
-        else:
-            stars = []
-            stars_url_dict = {}
-            for star in stars_wrapper[0:-1]:
-                stars.append(star.text)
-                stars_url_dict[star.text] = base_url + star['href']
-        
-        description_wrapper = soup.find('div', class_='inline canwrap').find('p').find('span')
-        if description_wrapper is None:
-            description = None
-        else:
-            description = description_wrapper.text.strip()
-        
-        poster_wrapper = soup.find('div', class_='poster')
-        if poster_wrapper is None:
-            poster_url = None
-        else:
-            poster_url = poster_wrapper.find('img')['src']
-        
-        
-        movie_dict[movie_url] = {}
-        movie_dict[movie_url]['name'] = name
-        movie_dict[movie_url]['director'] = director
-        movie_dict[movie_url]['director_url'] =  director_url
-        movie_dict[movie_url]['stars'] = stars
-        movie_dict[movie_url]['stars_url_dict'] = stars_url_dict
-        movie_dict[movie_url]['releasing_date'] = releasing_date
-        movie_dict[movie_url]['score'] = score
-        movie_dict[movie_url]['classification'] = classification
-        movie_dict[movie_url]['description'] = description
-        movie_dict[movie_url]['poster_url'] = poster_url
-        save_cache(movie_dict, CACHE_MOVIE_FILENAME)
-        
-    movie_instance = Movies(name, director, director_url, stars, stars_url_dict, releasing_date, score, classification, description, poster_url)
+def build_movie_url_dict(refresh=False):
+    ''' Make a dictionary that maps movie name to movie page url, properly cached
 
-    return movie_instance
-    
-def get_cast_instance(position, cast_url):
-    '''Make a 'Casts' instance from a cast URL.
-    
     Parameters
     ----------
-    position: string
-        position of the person, director/star
-    cast_url: string
-        The URL for a director/star page
-    
+    refresh: bool
+        revalidate the cached calendar with a conditional request
+
     Returns
     -------
-    instance
-        a cast instance
+    dict
+        key is a movie name and value is the movie url
+        e.g. {'Nomadland':'https://www.imdb.com/title/tt9770150/?ref_=rlm', ...}
     '''
-    cast_dict = open_cache(CACHE_CAST_FILENAME)
-    if cast_url in cast_dict:
-        print ("Using cache")
-        name = cast_dict[cast_url]['name']
-        bio = cast_dict[cast_url]['bio']
-        films = cast_dict[cast_url]['films']
-        photo = cast_dict[cast_url]['photo']
-
+    movie_url_dict = open_cache(CACHE_URL_FILENAME)
+    response = None
+    if bool(movie_url_dict) is False or refresh:
+        # dict empty, need to fetch, or the cached calendar may be out of date
+        response = fetch_page(url, revalidate=bool(movie_url_dict))
+    if response is None:
+        # cache exists and is up to date
+        pipeline_metrics.incr('cache.calendar.hit')
+        return dict(movie_url_dict.items())
     else:
-        print ("Fetching")
-        response = requests.get(cast_url)
-        soup = BeautifulSoup(response.text, 'html.parser')
-        name_bio_wrapper = soup.find('div', id='name-overview-widget', class_='name-overview-widget')
-        if name_bio_wrapper is None:
-            name_wrapper = soup.find('div', id='name-overview-widget')
-            if name_wrapper is None:
-                name = None
-            else:
-                name =  name_wrapper.find('table').find('tbody').find('h1', recursive=True).find('span').text.strip()
-        else:
-            name = name_bio_wrapper.find('table').find('tbody').find('tr').find('td').find('h1').find('span').text
-        bio_wrapper = soup.find('div',class_='inline')
-        if bio_wrapper is None:
-            bio = None
-        else:
-            bio = bio_wrapper.text.strip()[0:-15]
-        if name_bio_wrapper is None:
-            photo = None
-        else:
-            photo_1 = name_bio_wrapper.find('div', class_='poster-hero-container')
-            if photo_1 is None:
-                photo = None
-            else:
-                photo_2 = photo_1.find('div',class_='image')
-                if photo_2 is None:
-                    photo = None
-                else:
-                    photo = photo_2.find('img')['src']
-
-        film_wrapper = soup.find_all('div', class_ = 'knownfor-title-role')
-        if film_wrapper is None:
-            films = None
-        else:
-            films = {}
-            for film in film_wrapper:
-                key = film.find('a').text.strip()
-                value = base_url + film.find('a')['href']
-                films[key] = value
-        cast_dict[cast_url] = {}
-        cast_dict[cast_url]['name'] = name
-        cast_dict[cast_url]['bio'] = bio
-        cast_dict[cast_url]['films'] = films
-        cast_dict[cast_url]['photo'] = photo
-        save_cache(cast_dict, CACHE_CAST_FILENAME)
-    
-    score = {} 
-
-        
-    cast_instance = Cast(position, name, bio, films, score, photo)
+        pipeline_metrics.incr('cache.calendar.miss')
+        with pipeline_metrics.timer('parse.calendar'):
+            movie_url_dict = parse_page(extract_calendar, response.text)
 
-    return cast_instance
+        get_cache_store().replace(CACHE_URL_FILENAME, movie_url_dict)
+        return movie_url_dict
+       
 
-def get_score_attribute(cast_instance):
-    '''Get the score attribute of the cast_instance
+def configure_parse_worker(parser_backend, site_url):
+    '''Runs first in every parse process, which starts from a fresh import of this module:
+    gives it the parser backend and the site the extracted links point to
 
     Parameters
     ----------
-    cast_instance:
-        a instance of the class 'Casts'
+    parser_backend: string
+        one of PARSER_BACKENDS
+    site_url: string
+        the base_url of the crawl
 
     Returns
     -------
-    cast_instance:
-        a instance of the class 'Casts', with the score attribute given
-
+    None
     '''
-    movie_url_dict = open_cache(CACHE_CAST_MOVIE_URL_FILENAME)
-    movie_url_input_dict = cast_instance.films
-    scores = {}
-    for movie_name in movie_url_input_dict.keys():
-        if movie_url_input_dict[movie_name] in movie_url_dict:
-            print ("Using cache")
-            scores[movie_name] = movie_url_dict[movie_url_input_dict[movie_name]]
-        else:
-            print ("Fetching")
-            response = requests.get(movie_url_input_dict[movie_name])
-            soup = BeautifulSoup(response.text, 'html.parser')
-            score_wrapper = soup.find('div', class_='ratingValue')
-            if score_wrapper is None:
-                score = 0
-            else:
-                score = score_wrapper.text.strip()[0:-3]
-            title_wrapper = soup.find('div', class_='title_wrapper')
-            if title_wrapper is None:
-                releasing_date = None
-            else:
-                releasing_date = title_wrapper.find('div', class_='subtext').find_all('a')[-1].text.strip()
-                index = releasing_date.find('(')
-                releasing_date = releasing_date[0:index-1]
-                
-                if (re.fullmatch('\d{2}\s{1}[a-zA-Z]+\s{1}\d{4}',releasing_date)) is None:
-                    releasing_date = None
-   
-            scores[movie_name] = []
-            scores[movie_name] = [score,releasing_date]
-            movie_url_dict[movie_url_input_dict[movie_name]] = []
-            movie_url_dict[movie_url_input_dict[movie_name]] = [score,releasing_date]
+    global PARSER, base_url
+    PARSER = parser_backend
+    base_url = site_url
 
-    cast_instance.score = scores
-    save_cache(movie_url_dict, CACHE_CAST_MOVIE_URL_FILENAME)
+def start_parse_pool(workers=PARSE_WORKERS):
+    '''Starts the processes parsing the pages, used by parse_page until stop_parse_pool
 
-    return cast_instance
+    The processes are spawned rather than forked, since the crawl threads may hold locks
+    at the time of a fork.
 
-def open_cache(cache_filename):
-    ''' Opens the cache file if it exists and loads the JSON into dictionary.
-    if the cache file doesn't exist, creates a new cache dictionary
-    
     Parameters
     ----------
-    cache_filename: string
-        the json file name for the dictionary we are generating
+    workers: int
+        number of processes, 0 to keep parsing in the calling thread
 
     Returns
     -------
-    The opened cache: dict
+    ProcessPoolExecutor
+        the processes, None if workers is 0
     '''
-    try:
-        cache_file = open(cache_filename, 'r')
-        cache_contents = cache_file.read()
-        cache_dict = json.loads(cache_contents)
-        cache_file.close()
-    except:
-        cache_dict = {}
-    return cache_dict
+    global parse_pool
+    if workers > 0:
+        parse_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                         initializer=configure_parse_worker, initargs=(PARSER, base_url))
+    return parse_pool
 
+def stop_parse_pool():
+    '''Stops the processes started by start_parse_pool, if any
 
-def save_cache(cache_dict, cache_filename):
-    ''' Saves the current state of the cache to disk
-    
     Parameters
     ----------
-    cache_dict: dict
-        The dictionary to save
-    cache_filename: string
-        The file the dictionary is going to save to
-    
+    None
+
     Returns
     -------
     None
     '''
-    dumped_json_cache = json.dumps(cache_dict)
-    fw = open(cache_filename,"w")
-    fw.write(dumped_json_cache)
-    fw.close() 
+    global parse_pool
+    if parse_pool is not None:
+        parse_pool.shutdown()
+        parse_pool = None
 
-def scrape_info ():
-    '''This is the function that is used to scrape all the information needed for this project
+def parse_page(extract, html):
+    '''Extract the information of a page, in one of the parse processes if they are started.
+    The page is sent to the process and the record, a dict or a list of strings, comes back,
+    so the calling thread releases the GIL while the page is parsed
 
     Parameters
     ----------
-    None
+    extract: function
+        one of extract_calendar, extract_movie, extract_cast and extract_movie_score
+    html: string
+        the page
 
     Returns
     -------
-    movie_list: list
-        a list of 'Movies' instance
-    cast_list: list
-        a list of 'Casts' instance
+    what extract returns for the page, with the module-level PARSER
     '''
-    movie_list = []
-    cast_list = []
-    movie_url_dict = build_movie_url_dict()
-    for key in movie_url_dict.keys():
-        movie_url = movie_url_dict[key]
-        movie_instance = get_movie_instance(movie_url)
-        movie_list.append(movie_instance)
-        print (movie_instance.name)
-        cast_director = get_cast_instance('director',movie_instance.director_url)
-        cast_director = get_score_attribute(cast_director)
-        cast_list.append(cast_director)
-        stars_url = movie_instance.stars_url_dict
-        for star_url in stars_url.values():
-            cast_star = get_cast_instance('star',star_url)
-            cast_star = get_score_attribute(cast_star)
-            cast_list.append(cast_star)
-        
-
-    return movie_list, cast_list
+    if parse_pool is None:
+        return extract(html)
+    return parse_pool.submit(extract, html).result()
 
-def build_movies_table(movie_list):
-    '''Accept a list of movie instance and generate the movies table in the super_movie.sqlite
+def make_soup(html, parse_only=None, backend=None):
+    '''Parse a page with the chosen parser backend
 
     Parameters
     ----------
-    movie_list: list
-        a list of movie instances
+    html: string
+        the page to parse
+    parse_only: SoupStrainer
+        only the tags it matches (and everything inside them) are parsed, None to parse
+        the whole page. html5-parser always parses the whole page
+    backend: string
+        one of PARSER_BACKENDS, None to use the module-level PARSER
 
     Returns
     -------
+    BeautifulSoup
+        the parsed page
+    '''
+    if backend is None:
+        backend = PARSER
+    if backend == 'html5-parser':
+        return html5_parser.parse(html, treebuilder='soup')
+    return BeautifulSoup(html, backend, parse_only=parse_only)
+
+def extract_calendar(html, backend=None, strain=True):
+    '''Extract the upcoming movies from the calendar page
+
+    Parameters
+    ----------
+    html: string
+        the calendar page
+    backend: string
+        one of PARSER_BACKENDS, None to use the module-level PARSER
+    strain: bool
+        only parse the parts of the page that are read, False to parse the whole page
+
+    Returns
+    -------
+    dict
+        key is a movie name and value is the movie url
+    '''
+    movie_url_dict = {}
+    soup = make_soup(html, CALENDAR_STRAINER if strain else None, backend)
+    main_block = soup.find('div', id='main')
+    parent_list = main_block.find_all('ul')
+    for item in parent_list:
+        movie_list = item.find_all('li')
+        for movie in movie_list:
+            movie_name = movie.find('a').text
+            movie_url = movie.find('a')['href']
+            movie_url_dict[movie_name.lower()] = base_url + movie_url
+    return movie_url_dict
+
+def extract_movie(html, backend=None, strain=True):
+    '''Extract the information of a movie from its page
+
+    Parameters
+    ----------
+    html: string
+        the movie page
+    backend: string
+        one of PARSER_BACKENDS, None to use the module-level PARSER
+    strain: bool
+        only parse the parts of the page that are read, False to parse the whole page
+
+    Returns
+    -------
+    dict
+        the fields of a 'Movies' instance, as saved in the movie cache
+    '''
+    soup = make_soup(html, MOVIE_STRAINER if strain else None, backend)
+    title_wrapper = soup.find('div', class_='title_wrapper')
+    if title_wrapper is None:
+        name = None
+        releasing_date = None
+        classification = None
+    else:
+        name = title_wrapper.find('h1').text.strip()
+        index = name.find('(')
+        name = name[0:index-1]
+        classification = title_wrapper.find('div', class_='subtext').find_all('a')[0].text.strip()
+        releasing_date = title_wrapper.find('div', class_='subtext').find_all('a')[-1].text.strip()
+        index = releasing_date.find('(')
+        releasing_date = releasing_date[0:index-1]
+
+    score_wrapper = soup.find('div', class_='ratingValue')
+    if score_wrapper is None:
+        score = 0
+    else:
+        score = score_wrapper.text.strip()[:-3]
+
+    director_wrapper = soup.find_all('div', class_='credit_summary_item')[0].find('a')
+    if director_wrapper is None:
+        director = None
+        director_url = None
+    else:
+        director = director_wrapper.text.strip()
+        director_url = base_url + director_wrapper['href']
+    if len(soup.find_all('div', class_='credit_summary_item')) == 3:
+        stars_wrapper = soup.find_all('div', class_='credit_summary_item')[2].find_all('a')
+    else:
+        stars_wrapper = soup.find_all('div', class_='credit_summary_item')[1].find_all('a')
+    if stars_wrapper is None:
+        stars = None
+        stars_url_dict = None
+    else:
+        stars = []
+        stars_url_dict = {}
+        for star in stars_wrapper[0:-1]:
+            stars.append(star.text)
+            stars_url_dict[star.text] = base_url + star['href']
+
+    description_wrapper = soup.find('div', class_='inline canwrap').find('p').find('span')
+    if description_wrapper is None:
+        description = None
+    else:
+        description = description_wrapper.text.strip()
+
+    poster_wrapper = soup.find('div', class_='poster')
+    if poster_wrapper is None:
+        poster_url = None
+    else:
+        poster_url = poster_wrapper.find('img')['src']
+
+    movie_cache = {}
+    movie_cache['name'] = name
+    movie_cache['director'] = director
+    movie_cache['director_url'] =  director_url
+    movie_cache['stars'] = stars
+    movie_cache['stars_url_dict'] = stars_url_dict
+    movie_cache['releasing_date'] = releasing_date
+    movie_cache['score'] = score
+    movie_cache['classification'] = classification
+    movie_cache['description'] = description
+    movie_cache['poster_url'] = poster_url
+    return movie_cache
+
+def extract_cast(html, backend=None, strain=True):
+    '''Extract the information of a director/star from their page
+
+    Parameters
+    ----------
+    html: string
+        the director/star page
+    backend: string
+        one of PARSER_BACKENDS, None to use the module-level PARSER
+    strain: bool
+        only parse the parts of the page that are read, False to parse the whole page
+
+    Returns
+    -------
+    dict
+        the name, bio, films and photo of the cast, as saved in the cast cache
+    '''
+    soup = make_soup(html, CAST_STRAINER if strain else None, backend)
+    if strain and soup.find('div', id='name-overview-widget', class_='name-overview-widget') is None:
+        # the strainer only keeps the overview widget by its class, parse the whole page to find it by its id
+        soup = make_soup(html, None, backend)
+    name_bio_wrapper = soup.find('div', id='name-overview-widget', class_='name-overview-widget')
+    if name_bio_wrapper is None:
+        name_wrapper = soup.find('div', id='name-overview-widget')
+        if name_wrapper is None:
+            name = None
+        else:
+            name =  name_wrapper.find('table').find('tbody').find('h1', recursive=True).find('span').text.strip()
+    else:
+        name = name_bio_wrapper.find('table').find('tbody').find('tr').find('td').find('h1').find('span').text
+    bio_wrapper = soup.find('div',class_='inline')
+    if bio_wrapper is None:
+        bio = None
+    else:
+        bio = bio_wrapper.text.strip()[0:-15]
+    if name_bio_wrapper is None:
+        photo = None
+    else:
+        photo_1 = name_bio_wrapper.find('div', class_='poster-hero-container')
+        if photo_1 is None:
+            photo = None
+        else:
+            photo_2 = photo_1.find('div',class_='image')
+            if photo_2 is None:
+                photo = None
+            else:
+                photo = photo_2.find('img')['src']
+
+    film_wrapper = soup.find_all('div', class_ = 'knownfor-title-role')
+    if film_wrapper is None:
+        films = None
+    else:
+        films = {}
+        for film in film_wrapper:
+            key = film.find('a').text.strip()
+            value = base_url + film.find('a')['href']
+            films[key] = value
+    cast_cache = {}
+    cast_cache['name'] = name
+    cast_cache['bio'] = bio
+    cast_cache['films'] = films
+    cast_cache['photo'] = photo
+    return cast_cache
+
+def extract_movie_score(html, backend=None, strain=True):
+    '''Extract the score and the releasing date from a movie page
+
+    Parameters
+    ----------
+    html: string
+        the movie page
+    backend: string
+        one of PARSER_BACKENDS, None to use the module-level PARSER
+    strain: bool
+        only parse the parts of the page that are read, False to parse the whole page
+
+    Returns
+    -------
+    list
+        in the form of [score, releasing_date]
+    '''
+    soup = make_soup(html, MOVIE_SCORE_STRAINER if strain else None, backend)
+    score_wrapper = soup.find('div', class_='ratingValue')
+    if score_wrapper is None:
+        score = 0
+    else:
+        score = score_wrapper.text.strip()[0:-3]
+    title_wrapper = soup.find('div', class_='title_wrapper')
+    if title_wrapper is None:
+        releasing_date = None
+    else:
+        releasing_date = title_wrapper.find('div', class_='subtext').find_all('a')[-1].text.strip()
+        index = releasing_date.find('(')
+        releasing_date = releasing_date[0:index-1]
+
+        if (re.fullmatch(r'\d{2}\s{1}[a-zA-Z]+\s{1}\d{4}',releasing_date)) is None:
+            releasing_date = None
+
+    return [score,releasing_date]
+
+def get_movie_instance(movie_url, refresh=False):
+    '''Make a 'Movies' instance from a movie URL.
+    
+    Parameters
+    ----------
+    movie_url: string
+        The URL for a movie page
+    refresh: bool
+        revalidate a cached movie with a conditional request
+    
+    Returns
+    -------
+    instance
+        a movie instance
+    '''
+    movie_cache = lookup_cache(movie_url, CACHE_MOVIE_FILENAME)
+    response = None
+    if movie_cache is None or refresh:
+        response = fetch_page(movie_url, revalidate=movie_cache is not None)
+    if response is None:
+        pipeline_metrics.incr('cache.movie.hit')
+        name = movie_cache['name']
+        director = movie_cache['director']
+        director_url = movie_cache['director_url']
+        stars = movie_cache['stars']
+        stars_url_dict = movie_cache['stars_url_dict']
+        releasing_date = movie_cache['releasing_date']
+        score = movie_cache['score']
+        classification = movie_cache['classification']
+        description = movie_cache['description']
+        poster_url = movie_cache['poster_url']
+
+    else:
+        pipeline_metrics.incr('cache.movie.miss')
+        with pipeline_metrics.timer('parse.movie'):
+            movie_cache = parse_page(extract_movie, response.text)
+        name = movie_cache['name']
+        director = movie_cache['director']
+        director_url = movie_cache['director_url']
+        stars = movie_cache['stars']
+        stars_url_dict = movie_cache['stars_url_dict']
+        releasing_date = movie_cache['releasing_date']
+        score = movie_cache['score']
+        classification = movie_cache['classification']
+        description = movie_cache['description']
+        poster_url = movie_cache['poster_url']
+        update_cache(movie_url, movie_cache, CACHE_MOVIE_FILENAME)
+        
+    movie_instance = Movies(name, director, director_url, stars, stars_url_dict, releasing_date, score, classification, description, poster_url, movie_url)
+
+    return movie_instance
+    
+def get_cast_instance(position, cast_url, refresh=False):
+    '''Make a 'Casts' instance from a cast URL.
+    
+    Parameters
+    ----------
+    position: string
+        position of the person, director/star
+    cast_url: string
+        The URL for a director/star page
+    refresh: bool
+        revalidate a cached cast with a conditional request
+    
+    Returns
+    -------
+    instance
+        a cast instance
+    '''
+    cast_cache = lookup_cache(cast_url, CACHE_CAST_FILENAME)
+    response = None
+    if cast_cache is None or refresh:
+        response = fetch_page(cast_url, revalidate=cast_cache is not None)
+    if response is None:
+        pipeline_metrics.incr('cache.cast.hit')
+        name = cast_cache['name']
+        bio = cast_cache['bio']
+        films = cast_cache['films']
+        photo = cast_cache['photo']
+
+    else:
+        pipeline_metrics.incr('cache.cast.miss')
+        with pipeline_metrics.timer('parse.cast'):
+            cast_cache = parse_page(extract_cast, response.text)
+        name = cast_cache['name']
+        bio = cast_cache['bio']
+        films = cast_cache['films']
+        photo = cast_cache['photo']
+        update_cache(cast_url, cast_cache, CACHE_CAST_FILENAME)
+    
+    score = {} 
+
+        
+    cast_instance = Cast(position, name, bio, films, score, photo, cast_url)
+
+    return cast_instance
+
+def get_movie_score(movie_url, refresh=False):
+    '''Get the score and the releasing date of a movie the cast is known for, properly cached
+
+    Parameters
+    ----------
+    movie_url: string
+        The URL for a movie page
+    refresh: bool
+        revalidate a cached score with a conditional request
+
+    Returns
+    -------
+    list
+        in the form of [score, releasing_date]
+    '''
+    # the known-for links of the casts reach the same movie with different query strings
+    movie_key = canonical_url(movie_url)
+    movie_score = lookup_cache(movie_key, CACHE_CAST_MOVIE_URL_FILENAME)
+    response = None
+    if movie_score is None or refresh:
+        response = fetch_page(movie_url, revalidate=movie_score is not None)
+    if response is None:
+        pipeline_metrics.incr('cache.movie_score.hit')
+        return movie_score
+
+    pipeline_metrics.incr('cache.movie_score.miss')
+    with pipeline_metrics.timer('parse.movie_score'):
+        movie_score = parse_page(extract_movie_score, response.text)
+    update_cache(movie_key, movie_score, CACHE_CAST_MOVIE_URL_FILENAME)
+    return movie_score
+
+def get_score_attribute(cast_instance, registry=None, refresh=False, frontier=None):
+    '''Get the score attribute of the cast_instance
+
+    Parameters
+    ----------
+    cast_instance:
+        a instance of the class 'Casts'
+    registry: UrlRegistry
+        shared by the whole crawl so a movie several casts are known for is looked up once,
+        None to look up every movie
+    refresh: bool
+        revalidate the cached scores with conditional requests
+    frontier: Frontier
+        records the status of the movie pages, None to let a failing page raise
+
+    Returns
+    -------
+    cast_instance:
+        a instance of the class 'Casts', with the score attribute given, without the
+        movies whose page failed
+
+    '''
+    def lookup(movie_url):
+        if frontier is None:
+            return get_movie_score(movie_url, refresh)
+        return frontier.run('movie_score', movie_url,
+                            lambda refresh_page: get_movie_score(movie_url, refresh_page), refresh)
+
+    movie_url_input_dict = cast_instance.films
+    scores = {}
+    for movie_name in movie_url_input_dict.keys():
+        if registry is None:
+            score = lookup(movie_url_input_dict[movie_name])
+        else:
+            score = registry.resolve(movie_url_input_dict[movie_name], lookup)
+        if score is not None:
+            scores[movie_name] = score
+
+    cast_instance.score = scores
+
+    return cast_instance
+
+def get_session(pool_size=MAX_WORKERS):
+    ''' Opens the HTTP session the first time it is needed. The session is shared by all
+    crawl threads, so the connections to IMDb are kept alive and reused across pages
+    
+    Parameters
+    ----------
+    pool_size: int
+        the number of connections kept open, at least the number of crawl threads
+
+    Returns
+    -------
+    requests.Session
+        the session of this process
+    '''
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers['Accept-Encoding'] = ACCEPT_ENCODING
+            session.headers['Connection'] = 'keep-alive'
+    return session
+
+def fetch_page(page_url, revalidate=False):
+    ''' Fetches a page through the shared session and records its ETag/Last-Modified.
+    When revalidating, the recorded validators are sent along, and a page that did not
+    change since it was cached comes back as 304 Not Modified without a body
+    
+    Parameters
+    ----------
+    page_url: string
+        the url to fetch
+    revalidate: bool
+        whether the page is already cached and only has to be fetched if it changed
+
+    Returns
+    -------
+    requests.Response
+        the response, or None if the cached page is still up to date. An error status
+        raises requests.HTTPError. With FROM_ARCHIVE, the ArchivedPage instead, whether
+        the page is cached or not, and a page that was never archived raises LookupError
+    '''
+    # the page is the same whatever the query string of the link it was reached from, and the
+    # crawl passes on the url of whichever link reached it first
+    page_key = canonical_url(page_url)
+    if FROM_ARCHIVE:
+        with pipeline_metrics.timer('archive.read'):
+            page = get_page_archive().get(page_key)
+            if page is None and page_key != page_url:
+                # archived under its full url, before the archive was keyed on canonical urls
+                page = get_page_archive().get(page_url)
+        if page is None:
+            pipeline_metrics.incr('archive.missing')
+            raise LookupError(page_url + ' is not in the page archive')
+        pipeline_metrics.incr('archive.pages')
+        return page
+    headers = {}
+    if revalidate:
+        validators = lookup_cache(page_key, CACHE_VALIDATOR_NAMESPACE) or {}
+        if validators.get('etag') is not None:
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified') is not None:
+            headers['If-Modified-Since'] = validators['last_modified']
+    try:
+        with pipeline_metrics.timer('fetch'):
+            response = get_session().get(page_url, headers=headers, timeout=REQUEST_TIMEOUT)
+    except requests.RequestException:
+        pipeline_metrics.incr('fetch.errors')
+        raise
+    if response.status_code == 304:
+        pipeline_metrics.incr('fetch.not_modified')
+        return None
+    pipeline_metrics.incr('fetch.pages')
+    pipeline_metrics.incr('fetch.bytes', len(response.content))
+    if response.status_code >= 400:
+        # an error page is never parsed nor cached, the frontier records the failure
+        pipeline_metrics.incr('fetch.errors')
+        response.raise_for_status()
+    validators = {
+        'etag': response.headers.get('ETag'),
+        'last_modified': response.headers.get('Last-Modified'),
+    }
+    if validators['etag'] is not None or validators['last_modified'] is not None:
+        update_cache(page_key, validators, CACHE_VALIDATOR_NAMESPACE)
+    with pipeline_metrics.timer('archive.write'):
+        get_page_archive().append(page_key, response.text)
+    return response
+
+def get_image(image_url):
+    ''' Gets the local copy of a poster or photo, downloading it unless an earlier build did.
+    A failed download is printed and left out, the page then shows the image of IMDb
+
+    Parameters
+    ----------
+    image_url: string
+        the url of the image on IMDb
+
+    Returns
+    -------
+    dict
+        in the form of {'sha256', 'content_type', 'thumbnail'}, None if the image could
+        not be downloaded, or is not downloaded yet without FETCH_IMAGES
+    '''
+    entry = lookup_cache(image_url, CACHE_IMAGE_NAMESPACE)
+    if entry is not None and image_store.has(entry['sha256']):
+        pipeline_metrics.incr('images.cached')
+        if not entry['thumbnail'] and image_store.make_thumbnail(entry['sha256']):
+            # Pillow was installed since
+            entry['thumbnail'] = True
+            update_cache(image_url, entry, CACHE_IMAGE_NAMESPACE)
+        return entry
+    if not FETCH_IMAGES:
+        return None
+    try:
+        with pipeline_metrics.timer('images.fetch'):
+            response = get_session().get(image_url, timeout=REQUEST_TIMEOUT)
+            response.raise_for_status()
+    except requests.RequestException as e:
+        pipeline_metrics.incr('images.errors')
+        print ('Failed to download image', image_url + ':', e)
+        return None
+    pipeline_metrics.incr('images.fetched')
+    pipeline_metrics.incr('images.bytes', len(response.content))
+    digest = image_store.add(response.content)
+    entry = {
+        'sha256': digest,
+        'content_type': response.headers.get('Content-Type'),
+        'thumbnail': os.path.exists(image_store.thumbnail_path(digest)),
+    }
+    update_cache(image_url, entry, CACHE_IMAGE_NAMESPACE)
+    return entry
+
+def get_cache_store():
+    ''' Opens the cache database the first time it is needed, shared by all crawl threads
+
+    Parameters
+    ----------
     None
+
+    Returns
+    -------
+    CacheStore
+        the cache of this process
+    '''
+    global cache_store
+    with cache_store_lock:
+        if cache_store is None:
+            cache_store = CacheStore(CACHE_DB_FILENAME)
+    return cache_store
+
+def get_page_archive():
+    ''' Opens the page archive the first time it is needed, shared by all crawl threads
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    PageArchive
+        the archive of this process
+    '''
+    global page_archive
+    with page_archive_lock:
+        if page_archive is None:
+            page_archive = PageArchive(ARCHIVE_DATA_FILENAME, ARCHIVE_INDEX_FILENAME)
+    return page_archive
+
+def open_cache(cache_filename):
+    ''' Returns the cache that used to be saved in the JSON file cache_filename.
+    The entries are read from the cache database when they are looked up, and the old
+    JSON file is migrated into the database the first time it is opened
+    
+    Parameters
+    ----------
+    cache_filename: string
+        the json file name for the dictionary we are generating
+
+    Returns
+    -------
+    The opened cache: CacheNamespace
+        used like a dict, every lookup reads the cache database
+    '''
+    return get_cache_store().open(cache_filename)
+
+def lookup_cache(key, cache_filename):
+    ''' Reads a single entry of the cache
+
+    Parameters
+    ----------
+    key: string
+        the url the entry belongs to
+    cache_filename: string
+        the json file name of the cache the entry belongs to
+
+    Returns
+    -------
+    dict or list
+        the information scraped from the url, None if it is not cached
+    '''
+    with pipeline_metrics.timer('cache.lookup'):
+        return open_cache(cache_filename).get(key)
+
+def update_cache(key, value, cache_filename):
+    ''' Records a single entry of the cache, without rewriting the other entries
+    
+    Parameters
+    ----------
+    key: string
+        the url the entry belongs to
+    value: dict or list
+        the information scraped from the url
+    cache_filename: string
+        the json file name of the cache the entry belongs to
+    
+    Returns
+    -------
+    None
+    '''
+    with pipeline_metrics.timer('cache.write'):
+        get_cache_store().set(cache_filename, key, value)
+
+def crawl_progress(metrics):
+    '''One line summarizing the crawl so far, printed every PROGRESS_INTERVAL seconds
+
+    Parameters
+    ----------
+    metrics: Metrics
+        the metrics of the crawl
+
+    Returns
+    -------
+    string
+        the summary, eg: '[  10.0s] 420 pages fetched (3.1 MB, 42.0 pages/sec), 17 cached, 0 errors'
+    '''
+    snapshot = metrics.snapshot()
+    counters = snapshot['counters']
+    fetched = counters.get('fetch.pages', 0)
+    cached = sum(value for name, value in counters.items() if name.startswith('cache.') and name.endswith('.hit'))
+    return '[%7.1fs] %d pages fetched (%.1f MB, %.1f pages/sec), %d cached, %d errors' % (
+        snapshot['elapsed_s'], fetched, counters.get('fetch.bytes', 0) / 1e6,
+        fetched / max(snapshot['elapsed_s'], 1e-9), cached, counters.get('fetch.errors', 0))
+
+def bounded_map(executor, function, items, window=QUEUE_SIZE):
+    '''Like executor.map, but takes the items only as they are needed and keeps at most
+    window of them submitted ahead of the results consumed, so the items and the results
+    never all sit in memory
+
+    Parameters
+    ----------
+    executor: concurrent.futures.Executor
+        runs function
+    function: function
+        takes an item
+    items: iterable
+        the items, read lazily
+    window: int
+        the maximum number of items submitted and not consumed yet
+
+    Returns
+    -------
+    generator
+        of function(item) for every item, in the order of the items
+    '''
+    pending = collections.deque()
+    for item in items:
+        pending.append(executor.submit(function, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+def crawl(max_workers=MAX_WORKERS, refresh=False, progress_interval=PROGRESS_INTERVAL,
+          max_attempts=MAX_ATTEMPTS, retry_failed=False, queue_size=QUEUE_SIZE, parse_workers=PARSE_WORKERS):
+    '''Scrape all the information needed for this project, giving every movie and cast as
+    soon as it is scraped, so they can be written to the database while the crawl goes on
+
+    The pages are discovered, then fetched and parsed by a pool of at most max_workers
+    threads, each stage at most queue_size pages ahead of the next one, so the memory used
+    does not grow with the number of pages. With parse_workers, the threads hand the pages
+    they fetch to that many processes to parse, see parse_page. The movies of the calendar come first, in the
+    order of the calendar, then the casts in the order they were found.
+    Every page is resolved once: a cast appearing in several movies is a single 'Cast'
+    instance, positioned by their first appearance, and a movie several casts are
+    known for is looked up once.
+
+    The pages found and their status are kept in a Frontier, in the cache database: a page
+    that can't be scraped is left out and reported at the end instead of stopping the crawl,
+    and a crawl that was interrupted resumes from the pages already done.
+
+    Parameters
+    ----------
+    max_workers: int
+        the maximum number of pages fetched at the same time, 1 crawls sequentially
+    refresh: bool
+        revalidate the cached pages with conditional requests, only the pages that
+        changed since they were cached are downloaded and parsed again
+    progress_interval: float
+        seconds between two progress lines, 0 for none. The counters and latencies of the
+        crawl are kept in pipeline_metrics
+    max_attempts: int
+        number of failures after which a page is skipped
+    retry_failed: bool
+        try again the pages skipped after too many failures
+    queue_size: int
+        the maximum number of pages scraped ahead of the movies and casts consumed
+    parse_workers: int
+        number of processes parsing the pages, 0 to parse them in the crawl threads
+
+    Returns
+    -------
+    generator
+        of 'Movies' instances, then of 'Cast' instances with the score attribute given,
+        each cast appears once
+    '''
+    get_session(max_workers)
+    film_registry = UrlRegistry()
+    frontier = Frontier(get_cache_store(), max_attempts)
+    frontier.start(retry_failed)
+
+    def scrape_movie(movie_url):
+        return frontier.run('movie', movie_url,
+                            lambda refresh_page: get_movie_instance(movie_url, refresh_page), refresh)
+
+    def scrape_cast(page):
+        cast_url, position = page
+        cast = frontier.run('cast', cast_url,
+                            lambda refresh_page: get_cast_instance(position, cast_url, refresh_page), refresh)
+        if cast is None:
+            return None
+        return get_score_attribute(cast, film_registry, refresh, frontier)
+
+    start_parse_pool(parse_workers)
+    try:
+        with ProgressReporter(pipeline_metrics, crawl_progress, progress_interval), \
+             ThreadPoolExecutor(max_workers=max_workers) as executor:
+            movie_urls = list(build_movie_url_dict(refresh).values())
+            frontier.add('movie', [(movie_url, None) for movie_url in movie_urls])
+            for movie_url, movie_instance in zip(movie_urls, bounded_map(executor, scrape_movie, movie_urls, queue_size)):
+                if movie_instance is None:
+                    continue
+                # the score of an upcoming movie a cast is known for is already on its movie page
+                releasing_date = movie_instance.releasing_date
+                if releasing_date is not None and re.fullmatch(r'\d{2}\s{1}[a-zA-Z]+\s{1}\d{4}',releasing_date) is None:
+                    releasing_date = None
+                film_registry.seed(movie_url, [movie_instance.score, releasing_date])
+                yield movie_instance
+
+                movie_casts = [(movie_instance.director_url, 'director')]
+                for star_url in movie_instance.stars_url_dict.values():
+                    movie_casts.append((star_url, 'star'))
+                # a movie page may have no director or star link
+                frontier.add('cast', [(cast_url, position) for cast_url, position in movie_casts if cast_url])
+
+            for cast in bounded_map(executor, scrape_cast, frontier.pages('cast'), queue_size):
+                if cast is not None:
+                    yield cast
+    finally:
+        stop_parse_pool()
+
+    frontier.finish()
+    pipeline_metrics.incr('known_for.repeated_lookups', film_registry.hits)
+    failures = frontier.failures()
+    if failures:
+        print (len(failures), 'pages could not be scraped and are left out:')
+        for stage, entry in failures:
+            retry = 'skipped until --retry-failed' if entry['status'] == 'failed' else 'tried again next crawl'
+            print ('  %s [%s] failed %d times, %s: %s' % (entry['url'], stage, entry['attempts'], retry, entry['error']))
+
+def scrape_info (max_workers=MAX_WORKERS, refresh=False, progress_interval=PROGRESS_INTERVAL,
+                 max_attempts=MAX_ATTEMPTS, retry_failed=False, parse_workers=PARSE_WORKERS):
+    '''This is the function that is used to scrape all the information needed for this project,
+    into lists. See crawl, which gives them one at a time
+
+    Parameters
+    ----------
+    max_workers: int
+        the maximum number of pages fetched at the same time, 1 crawls sequentially
+    refresh: bool
+        revalidate the cached pages with conditional requests, only the pages that
+        changed since they were cached are downloaded and parsed again
+    progress_interval: float
+        seconds between two progress lines, 0 for none
+    max_attempts: int
+        number of failures after which a page is skipped
+    retry_failed: bool
+        try again the pages skipped after too many failures
+    parse_workers: int
+        number of processes parsing the pages, 0 to parse them in the crawl threads
+
+    Returns
+    -------
+    movie_list: list
+        a list of 'Movies' instance
+    cast_list: list
+        a list of 'Casts' instance, each cast appears once
+    '''
+    movie_list = []
+    cast_list = []
+    for item in crawl(max_workers, refresh, progress_interval, max_attempts, retry_failed,
+                      parse_workers=parse_workers):
+        if isinstance(item, Movies):
+            movie_list.append(item)
+        else:
+            cast_list.append(item)
+    return movie_list, cast_list
+
+def check_parser_parity(page_dir, backend=None):
+    '''Check that the fast path extracts exactly what a full html.parser parse extracts,
+    over every page saved in page_dir (and its sub-directories)
+
+    Parameters
+    ----------
+    page_dir: string
+        directory of saved calendar, movie and cast pages
+    backend: string
+        one of PARSER_BACKENDS to check, None to use the module-level PARSER
+
+    Returns
+    -------
+    list
+        the (page, extractor) pairs whose results differ, empty if all pages match
+    '''
+    extractors = [extract_calendar, extract_movie, extract_cast, extract_movie_score]
+    mismatches = []
+    num_of_pages = 0
+    for root, dirs, files in os.walk(page_dir):
+        for filename in sorted(files):
+            if not filename.endswith('.html'):
+                continue
+            num_of_pages += 1
+            page = os.path.join(root, filename)
+            with open(page, encoding='utf-8') as page_file:
+                html = page_file.read()
+            for extractor in extractors:
+                results = []
+                # the reference is the whole page parsed by html.parser, as the extractors used to
+                for page_backend, strain in [('html.parser', False), (backend, True)]:
+                    try:
+                        results.append(extractor(html, page_backend, strain))
+                    except Exception as error:
+                        results.append(type(error).__name__)
+                if results[0] != results[1]:
+                    mismatches.append((page, extractor.__name__))
+    print ('Checked', num_of_pages, 'pages with', backend or PARSER, '-', len(mismatches), 'mismatches')
+    for page, extractor_name in mismatches:
+        print ('  ', extractor_name, page)
+    return mismatches
+
+def load_rows(cur, table, create_table, upsert_rows, rows, incremental=False):
+    '''Write rows into a table of the super_movie.sqlite, keyed by their IMDb id
+
+    A full build recreates the table. An incremental build keeps the table and compares
+    a hash of every row with the stored one: only the new and changed rows are written,
+    and only the rows whose IMDb id is no longer scraped are deleted.
+
+    The rows are written with executemany, inside the transaction of the caller. See
+    prepare_rows, write_rows and finish_rows to write them a batch at a time.
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    table: string
+        name of the table
+    create_table: string
+        statement creating the table
+    upsert_rows: string
+        statement inserting a row, or updating the row with the same IMDb id
+    rows: list
+        in the form of [(imdb_id, value_list)], value_list without the imdb_id and row_hash columns
+    incremental: bool
+        only write what changed instead of rebuilding the table
+
+    Returns
+    -------
+    dict
+        number of rows 'inserted', 'updated', 'unchanged' and 'deleted'
+    '''
+    counts = prepare_rows(cur, table, create_table, incremental)
+    write_rows(cur, table, upsert_rows, rows, counts)
+    return finish_rows(cur, table, counts)
+
+def prepare_rows(cur, table, create_table, incremental=False):
+    '''Get a table ready for write_rows: a full build recreates it, an incremental build
+    keeps it. The IMDb ids written are recorded in a '<table>_written' table of the database
+    being built, so they do not have to be kept in memory
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    table: string
+        name of the table
+    create_table: string
+        statement creating the table
+    incremental: bool
+        only write what changed instead of rebuilding the table
+
+    Returns
+    -------
+    dict
+        number of rows 'inserted', 'updated', 'unchanged' and 'deleted', updated by write_rows
+    '''
+    columns = [column[1] for column in cur.execute('PRAGMA table_info("%s")' % table)]
+    if incremental and 'row_hash' not in columns:
+        print (table, 'was built by an older version, rebuilding it')
+        incremental = False
+    if not incremental:
+        cur.execute('DROP TABLE IF EXISTS "%s"' % table)
+        cur.execute(create_table)
+
+    counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'deleted': 0}
+    # rows without an IMDb id can't be matched with a scraped row
+    counts['deleted'] += cur.execute('DELETE FROM "%s" WHERE imdb_id IS NULL' % table).rowcount
+    cur.execute('DROP TABLE IF EXISTS "%s_written"' % table)
+    cur.execute('CREATE TABLE "%s_written" ("imdb_id" TEXT PRIMARY KEY)' % table)
+    return counts
+
+def write_rows(cur, table, upsert_rows, rows, counts):
+    '''Write a batch of rows into a table prepared by prepare_rows. A row whose IMDb id was
+    already written is skipped, a row whose hash is the stored one is left as it is
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    table: string
+        name of the table
+    upsert_rows: string
+        statement inserting a row, or updating the row with the same IMDb id
+    rows: list
+        in the form of [(imdb_id, value_list)], value_list without the imdb_id and row_hash columns
+    counts: dict
+        returned by prepare_rows, updated with the rows of the batch
+
+    Returns
+    -------
+    None
+    '''
+    changed_rows = []
+    for key, value_list in rows:
+        if key is not None:
+            if cur.execute('INSERT OR IGNORE INTO "%s_written" VALUES (?)' % table, (key,)).rowcount == 0:
+                continue
+        row_hash = hashlib.sha1(json.dumps(value_list).encode('utf-8')).hexdigest()
+        stored = cur.execute('SELECT row_hash FROM "%s" WHERE imdb_id = ?' % table, (key,)).fetchone()
+        if stored is not None and stored[0] == row_hash:
+            counts['unchanged'] += 1
+        else:
+            changed_rows.append(value_list + [key, row_hash])
+            if stored is not None:
+                counts['updated'] += 1
+            else:
+                counts['inserted'] += 1
+    cur.executemany(upsert_rows, changed_rows)
+
+def finish_rows(cur, table, counts):
+    '''Delete the rows of a table whose IMDb id was not written since prepare_rows
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    table: string
+        name of the table
+    counts: dict
+        returned by prepare_rows and updated by write_rows
+
+    Returns
+    -------
+    dict
+        number of rows 'inserted', 'updated', 'unchanged' and 'deleted'
+    '''
+    counts['deleted'] += cur.execute('''
+        DELETE FROM "{0}" WHERE imdb_id IS NOT NULL
+        AND imdb_id NOT IN (SELECT imdb_id FROM "{0}_written" WHERE imdb_id IS NOT NULL)
+    '''.format(table)).rowcount
+    cur.execute('DROP TABLE "%s_written"' % table)
+    print (table + ':', counts['inserted'], 'inserted,', counts['updated'], 'updated,',
+           counts['unchanged'], 'unchanged,', counts['deleted'], 'deleted')
+    return counts
+
+def parse_date(date):
+    '''Convert a date scraped from IMDb into an ISO date
+
+    Parameters
+    ----------
+    date: string
+        date in the format of <dd> <month in text> <yyyy>, <month in text> <yyyy> or <yyyy>,
+        or already an ISO date
+
+    Returns
+    -------
+    string
+        the date in the format of yyyy-mm-dd (yyyy-mm or yyyy when only those are known),
+        None if there is no date
+    '''
+    if date is None:
+        return None
+    for date_format, iso_format in [('%d %B %Y', '%Y-%m-%d'), ('%B %Y', '%Y-%m'), ('%Y', '%Y'),
+                                    ('%Y-%m-%d', '%Y-%m-%d'), ('%Y-%m', '%Y-%m')]:
+        try:
+            return datetime.strptime(date.strip(), date_format).strftime(iso_format)
+        except ValueError:
+            pass
+    return None
+
+def parse_score(score):
+    '''Convert a score scraped from IMDb into a number
+
+    Parameters
+    ----------
+    score: string or int
+        score of a movie, eg: '7.8', 0 when the movie has no score yet
+
+    Returns
+    -------
+    float
+        the score, None if there is no score
+    '''
+    try:
+        return float(score)
+    except (TypeError, ValueError):
+        return None
+
+def movie_row(movie):
+    '''The row of the movies table of a movie instance
+
+    Parameters
+    ----------
+    movie:
+        a movie instance
+
+    Returns
+    -------
+    tuple
+        in the form of (imdb_id, value_list), see load_rows
     '''
-    cur.execute(drop_movies)
-    cur.execute(create_movies)
-    for movie in movie_list:
-        value_list = []
-        value_list.append(movie.name)
-        value_list.append(movie.director)
-        num_of_stars = len(movie.stars)
-        if num_of_stars == 0:
-            for i in range(3):
-                value_list.append('-')
-        elif num_of_stars == 1:
-            value_list.append(movie.stars[0])
-            for i in range(2):
-                value_list.append('-')
-        elif num_of_stars == 2:
-            for i in range (2):
-                value_list.append(movie.stars[i])
+    value_list = []
+    value_list.append(movie.name)
+    value_list.append(movie.director)
+    num_of_stars = len(movie.stars)
+    if num_of_stars == 0:
+        for i in range(3):
+            value_list.append('-')
+    elif num_of_stars == 1:
+        value_list.append(movie.stars[0])
+        for i in range(2):
             value_list.append('-')
-        elif num_of_stars == 3:
-            for i in range(3):
-                value_list.append(movie.stars[i])
-        value_list.append(movie.releasing_date)
-        value_list.append(movie.score)
-        value_list.append(movie.classification)
-        value_list.append(movie.description)
-        value_list.append(movie.poster_url)
-        cur.execute(insert_movies, value_list)
-    conn.commit()
-
-def build_casts_table(cast_list):
+    elif num_of_stars == 2:
+        for i in range (2):
+            value_list.append(movie.stars[i])
+        value_list.append('-')
+    elif num_of_stars == 3:
+        for i in range(3):
+            value_list.append(movie.stars[i])
+    value_list.append(parse_date(movie.releasing_date))
+    value_list.append(parse_score(movie.score))
+    value_list.append(movie.classification)
+    value_list.append(movie.description)
+    value_list.append(movie.poster_url)
+    return (imdb_id(movie.url), value_list)
+
+def cast_row(cast):
+    '''The row of the casts table of a cast instance
+
+    Parameters
+    ----------
+    cast:
+        a cast instance, with the score attribute given
+
+    Returns
+    -------
+    tuple
+        in the form of (imdb_id, value_list), see load_rows
+    '''
+    value_list = []
+    value_list.append(cast.name)
+    value_list.append(cast.position)
+    value_list.append(cast.bio)
+
+    num_of_films = len(cast.score.keys())
+    key_list = cast.score.keys()
+    for key in key_list:
+        value_list.append(key)
+        value_list.append(parse_score(cast.score[key][0]))
+        value_list.append(parse_date(cast.score[key][1]))
+
+    # a missing film is '-', its score and date are NULL
+    for i in range(4 - num_of_films):
+        value_list += ['-', None, None]
+    value_list.append(cast.photo)
+    return (imdb_id(cast.url), value_list)
+
+def person_row(cast):
+    '''The row of the person table of a cast instance
+
+    Parameters
+    ----------
+    cast:
+        a cast instance
+
+    Returns
+    -------
+    tuple
+        in the form of (imdb_id, value_list), see load_rows
+    '''
+    return (imdb_id(cast.url), [cast.name, cast.bio, cast.photo])
+
+def movie_credits(movie):
+    '''The rows of the credit table of a movie instance, with the IMDb ids of the movie and
+    the people instead of their Id, see finish_credit_tables
+
+    Parameters
+    ----------
+    movie:
+        a movie instance
+
+    Returns
+    -------
+    list
+        in the form of [(movie_imdb_id, person_imdb_id, role, billing)]
+    '''
+    people = [('director', 0, movie.director_url)]
+    for billing, star in enumerate(movie.stars, 1):
+        people.append(('star', billing, (movie.stars_url_dict or {}).get(star)))
+    return [(imdb_id(movie.url), imdb_id(person_url), role, billing) for role, billing, person_url in people]
+
+def cast_films(cast):
+    '''The rows of the filmography table of a cast instance, with the IMDb id of the person
+    instead of their Id, see finish_credit_tables
+
+    Parameters
+    ----------
+    cast:
+        a cast instance, with the score attribute given
+
+    Returns
+    -------
+    list
+        in the form of [(person_imdb_id, position, film, score, release_date, film_imdb_id)]
+    '''
+    films = []
+    for position, film in enumerate(cast.score, 1):
+        film_url = (cast.films or {}).get(film)
+        films.append((imdb_id(cast.url), position, film, parse_score(cast.score[film][0]),
+                      parse_date(cast.score[film][1]), imdb_id(film_url)))
+    return films
+
+def build_movies_table(movie_list, cur, incremental=False):
+    '''Accept a list of movie instance and generate the movies table in the super_movie.sqlite
+
+    Parameters
+    ----------
+    movie_list: list
+        a list of movie instances
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    incremental: bool
+        only write the new and changed movies, and delete the ones that left the calendar
+
+    Returns
+    -------
+    dict
+        number of rows 'inserted', 'updated', 'unchanged' and 'deleted'
+    '''
+    rows = [movie_row(movie) for movie in movie_list]
+    return load_rows(cur, 'movies', create_movies, upsert_movies, rows, incremental)
+
+def build_casts_table(cast_list, cur, incremental=False):
     '''Accept a list of cast instance and generate the casts table in the super_movie.sqlite
 
     Parameters
     ----------
     cast_list: list
         a list of cast instances
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    incremental: bool
+        only write the new and changed casts, and delete the ones no longer in any movie
+
+    Returns
+    -------
+    dict
+        number of rows 'inserted', 'updated', 'unchanged' and 'deleted'
+    '''
+    rows = [cast_row(cast) for cast in cast_list]
+    return load_rows(cur, 'casts', create_casts, upsert_casts, rows, incremental)
+
+def build_person_table(cast_list, cur, incremental=False):
+    '''Accept a list of cast instance and generate the person table in the super_movie.sqlite,
+    one row per person
+
+    Parameters
+    ----------
+    cast_list: list
+        a list of cast instances
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    incremental: bool
+        only write the new and changed people, and delete the ones no longer in any movie
+
+    Returns
+    -------
+    dict
+        number of rows 'inserted', 'updated', 'unchanged' and 'deleted'
+    '''
+    rows = [person_row(cast) for cast in cast_list]
+    return load_rows(cur, 'person', create_person, upsert_person, rows, incremental)
+
+def build_credit_tables(movie_list, cast_list, cur):
+    '''Accept the lists of movie and cast instances and generate the credit and filmography
+    tables in the super_movie.sqlite. The tables link the rows of movies and person by their
+    Id, so they are generated again after every build of those tables
+
+    Parameters
+    ----------
+    movie_list: list
+        a list of movie instances
+    cast_list: list
+        a list of cast instances, with the score attribute given
+    cur: sqlite3.Cursor
+        cursor on the database being built, after the movies and person tables
+
+    Returns
+    -------
+    dict
+        number of rows of 'credit' and 'filmography'
+    '''
+    prepare_credit_tables(cur)
+    credits = [credit for movie in movie_list for credit in movie_credits(movie)]
+    films = [film for cast in cast_list for film in cast_films(cast)]
+    write_credit_rows(cur, credits, films)
+    return finish_credit_tables(cur)
+
+def prepare_credit_tables(cur):
+    '''Create the tables of the database being built holding the rows of the credit and
+    filmography tables until the movies and people they link have an Id
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
 
     Returns
     -------
     None
     '''
-    cur.execute(drop_casts)
-    cur.execute(create_casts)
-    for cast in cast_list:
-        value_list = []
-        value_list.append(cast.name)
-        value_list.append(cast.position)
-        value_list.append(cast.bio)
-
-        num_of_films = len(cast.score.keys())
-        key_list = cast.score.keys()
-        for key in key_list:
-            value_list.append(key)
-            value_list.append(cast.score[key][0]) 
-            value_list.append(cast.score[key][1]) 
-        
-        if num_of_films == 0:
-            for i in range(12):
-                value_list.append('-')
-        elif num_of_films == 1:
-            for i in range(9):
-                value_list.append('-')
-        elif num_of_films == 2:             
-            for i in range (6):
-                value_list.append('-')
-        elif num_of_films == 3:
-            for i in range(3):
-                value_list.append('-')
-        value_list.append(cast.photo)
-        cur.execute(insert_casts, value_list)
-
-    conn.commit()
+    cur.execute('DROP TABLE IF EXISTS "credit_written"')
+    cur.execute('''CREATE TABLE "credit_written" ("movie_imdb_id" TEXT, "person_imdb_id" TEXT,
+                   "role" TEXT, "billing" INTEGER)''')
+    cur.execute('DROP TABLE IF EXISTS "filmography_written"')
+    cur.execute('''CREATE TABLE "filmography_written" ("person_imdb_id" TEXT, "position" INTEGER,
+                   "film" TEXT, "score" REAL, "release_date" TEXT, "film_imdb_id" TEXT)''')
 
-if __name__ == "__main__":
-    movie_list, cast_list = scrape_info()
-    build_movies_table(movie_list)
-    build_casts_table(cast_list)
+def write_credit_rows(cur, credits, films):
+    '''Write a batch of rows of the credit and filmography tables, see prepare_credit_tables
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    credits: list
+        in the form of [(movie_imdb_id, person_imdb_id, role, billing)], see movie_credits
+    films: list
+        in the form of [(person_imdb_id, position, film, score, release_date, film_imdb_id)], see cast_films
+
+    Returns
+    -------
+    None
+    '''
+    cur.executemany('INSERT INTO credit_written VALUES (?,?,?,?)', credits)
+    cur.executemany('INSERT INTO filmography_written VALUES (?,?,?,?,?,?)', films)
+
+def finish_credit_tables(cur):
+    '''Generate the credit and filmography tables from the rows written since
+    prepare_credit_tables, once the movies and person tables are complete. The rows
+    whose movie or person is not in those tables are left out
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+
+    Returns
+    -------
+    dict
+        number of rows of 'credit' and 'filmography'
+    '''
+    cur.execute('DROP TABLE IF EXISTS "credit"')
+    cur.execute(create_credit)
+    cur.execute('DROP TABLE IF EXISTS "filmography"')
+    cur.execute(create_filmography)
+    counts = {}
+    counts['credit'] = cur.execute('''
+        INSERT INTO credit ("movie_id","person_id","role","billing")
+        SELECT movies.Id, person.Id, credit_written.role, credit_written.billing FROM credit_written
+        JOIN movies ON movies.imdb_id = credit_written.movie_imdb_id
+        JOIN person ON person.imdb_id = credit_written.person_imdb_id
+        ORDER BY credit_written.rowid
+    ''').rowcount
+    counts['filmography'] = cur.execute('''
+        INSERT INTO filmography ("person_id","position","film","score","release_date","film_imdb_id")
+        SELECT person.Id, position, film, score, release_date, film_imdb_id FROM filmography_written
+        JOIN person ON person.imdb_id = filmography_written.person_imdb_id
+        ORDER BY filmography_written.rowid
+    ''').rowcount
+    cur.execute('DROP TABLE "credit_written"')
+    cur.execute('DROP TABLE "filmography_written"')
+    print ('credit:', counts['credit'], 'rows, filmography:', counts['filmography'], 'rows')
+    return counts
+
+def load_credit_tables(cur, credits, films):
+    '''Recreate the credit and filmography tables with the given rows
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    credits: list
+        in the form of [(movie_id, person_id, role, billing)]
+    films: list
+        in the form of [(person_id, position, film, score, release_date, film_imdb_id)]
+
+    Returns
+    -------
+    None
+    '''
+    cur.execute('DROP TABLE IF EXISTS "credit"')
+    cur.execute(create_credit)
+    cur.execute('DROP TABLE IF EXISTS "filmography"')
+    cur.execute(create_filmography)
+    cur.executemany('INSERT INTO credit ("movie_id","person_id","role","billing") VALUES (?,?,?,?)', credits)
+    cur.executemany('''INSERT INTO filmography ("person_id","position","film","score","release_date","film_imdb_id")
+                       VALUES (?,?,?,?,?,?)''', films)
+    print ('credit:', len(credits), 'rows, filmography:', len(films), 'rows')
+
+def migrate_credit_tables(cur):
+    '''Generate the person, credit and filmography tables of a database built before they
+    existed, from its movies and casts tables. Those only link movies and casts by name, so
+    the people are told apart by name
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being migrated
+
+    Returns
+    -------
+    None
+    '''
+    cur.execute('DROP TABLE IF EXISTS "person"')
+    cur.execute(create_person)
+    # the last row of every name, the one the flask app used to show
+    cur.execute('''
+        INSERT INTO person ("name","bio","photo","imdb_id")
+        SELECT name, bio, photo, imdb_id FROM casts WHERE Id IN (SELECT MAX(Id) FROM casts GROUP BY name)
+        ORDER BY Id
+    ''')
+    person_ids = dict(cur.execute('SELECT name, Id FROM person'))
+
+    credits = []
+    for row in cur.execute('SELECT Id, director, star1, star2, star3 FROM movies').fetchall():
+        for billing, name in enumerate(row[1:]):
+            if name in person_ids:
+                credits.append((row[0], person_ids[name], 'director' if billing == 0 else 'star', billing))
+
+    films = []
+    for row in cur.execute('''
+            SELECT name, film1, score1, date1, film2, score2, date2, film3, score3, date3, film4, score4, date4
+            FROM casts WHERE Id IN (SELECT MAX(Id) FROM casts GROUP BY name)''').fetchall():
+        position = 0
+        for i in range(1, len(row), 3):
+            if row[i] is not None and row[i] != '-':
+                position += 1
+                films.append((person_ids[row[0]], position, row[i], row[i + 1], row[i + 2], None))
+    load_credit_tables(cur, credits, films)
+
+def build_search_indexes(cur, rebuild=True):
+    '''Create the full-text search indexes of the movies and person tables and their triggers
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    rebuild: bool
+        index all the rows again, needed after the tables were recreated. Otherwise the
+        triggers have kept the indexes up to date
+
+    Returns
+    -------
+    None
+    '''
+    for drop_statement in drop_casts_search_index:
+        cur.execute(drop_statement)
+    if rebuild:
+        cur.execute('DROP TABLE IF EXISTS "movies_fts"')
+        cur.execute('DROP TABLE IF EXISTS "person_fts"')
+    for create_search_index in create_search_indexes:
+        cur.execute(create_search_index)
+    if rebuild:
+        cur.execute('INSERT INTO "movies_fts" ("movies_fts") VALUES (\'rebuild\')')
+        cur.execute('INSERT INTO "person_fts" ("person_fts") VALUES (\'rebuild\')')
+
+def build_aggregate_tables(cur, rebuild=True):
+    '''Create the summary tables of the movies and their triggers, see AGGREGATE_TABLES
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    rebuild: bool
+        summarize all the movies again, needed after the movies table was recreated.
+        Otherwise the triggers have kept the tables up to date
+
+    Returns
+    -------
+    None
+    '''
+    if rebuild:
+        for table, key, expression in AGGREGATE_TABLES:
+            cur.execute('DROP TABLE IF EXISTS "%s"' % table)
+            for change in ['insert', 'delete', 'update']:
+                cur.execute('DROP TRIGGER IF EXISTS "%s_%s"' % (table, change))
+    for create_aggregate_table in create_aggregate_tables:
+        cur.execute(create_aggregate_table)
+    if rebuild:
+        for table, key, expression in AGGREGATE_TABLES:
+            cur.execute('''
+                INSERT INTO "{0}" SELECT {1} AS "group", COUNT(*), SUM(IFNULL("score", 0) > 0),
+                SUM(CAST(ROUND(IFNULL("score", 0) * 10) AS INTEGER))
+                FROM "movies" WHERE "group" IS NOT NULL GROUP BY "group"
+            '''.format(table, expression.format('"movies"')))
+
+def build_image_table(cur, max_workers=MAX_WORKERS):
+    '''Create the image table, the local copies of the posters of the movies and the photos
+    of the people, see get_image. The images are downloaded by max_workers threads
+
+    Parameters
+    ----------
+    cur: sqlite3.Cursor
+        cursor on the database being built
+    max_workers: int
+        the maximum number of images downloaded at the same time
+
+    Returns
+    -------
+    None
+    '''
+    cur.execute('DROP TABLE IF EXISTS "image"')
+    cur.execute(create_image)
+    image_urls = [row[0] for row in cur.execute('''
+        SELECT poster_url FROM movies WHERE poster_url IS NOT NULL
+        UNION SELECT photo FROM person WHERE photo IS NOT NULL
+    ''').fetchall()]
+    rows = []
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for image_url, entry in zip(image_urls, executor.map(get_image, image_urls)):
+            if entry is not None:
+                rows.append((image_url, entry['sha256'], entry['content_type'], entry['thumbnail']))
+    cur.executemany('INSERT INTO "image" VALUES (?,?,?,?)', rows)
+    print ('image:', len(rows), 'of', len(image_urls), 'posters and photos stored in', IMAGE_DIRECTORY)
+
+class DatabaseWriter:
+    '''instance builds the movies, casts, person, credit and filmography tables, the search
+    indexes, the summary tables and the image table in a staging copy of the database, from
+    movies and casts given one at a time, then swaps the staging file into place. Readers of
+    db_filename see either the old or the new database, never a half-built or empty one
+
+    The rows are written and committed to the staging file every batch_size movies and casts,
+    so the memory used does not grow with the number of rows. The credit and filmography
+    tables are generated last, once every movie and person has an Id, and the posters and
+    photos are downloaded once the movies and people are known.
+
+    Instance Attributes
+    -------------------
+    db_filename: string
+        the database to replace
+    staging_filename: string
+        the database being built
+    conn: sqlite3.Connection
+        connection to the staging file
+    cur: sqlite3.Cursor
+        cursor on the staging file
+    incremental: bool
+        only write the rows that changed, into a copy of the current database
+    batch_size: int
+        number of movies and casts written per transaction
+    max_workers: int
+        the maximum number of images downloaded at the same time
+    counts: dict
+        in the form of {'movies': counts, 'casts': counts, 'person': counts}, see load_rows
+    rows: dict
+        in the form of {'movies': [row], 'casts': [row], 'person': [row], 'credit': [row],
+        'filmography': [row]}, the rows of the batch not written yet
+    batch: int
+        number of movies and casts in the batch not written yet
+    write_seconds: float
+        time spent writing to the staging file so far, the load time reported. It leaves out
+        the time spent waiting for the movies and casts, eg: crawling, and downloading the images
+    '''
+    def __init__(self, incremental=False, db_filename=DB_FILENAME, batch_size=BATCH_SIZE, max_workers=MAX_WORKERS):
+        self.db_filename = db_filename
+        self.staging_filename = db_filename + '.staging'
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        if os.path.exists(self.staging_filename):
+            # left over by a build that did not finish
+            os.remove(self.staging_filename)
+        start = time.perf_counter()
+        self.conn = sqlite3.connect(self.staging_filename, isolation_level=None)
+        if incremental and os.path.exists(db_filename):
+            live = sqlite3.connect(db_filename)
+            live.backup(self.conn)
+            live.close()
+        # nothing reads the staging file until it is complete, and a failed build just throws
+        # it away, so the build does not need a journal or a sync after every write
+        self.conn.execute('PRAGMA journal_mode=OFF')
+        self.conn.execute('PRAGMA synchronous=OFF')
+        self.conn.execute('PRAGMA temp_store=MEMORY')
+        self.conn.execute('PRAGMA cache_size=-65536')
+        self.cur = self.conn.cursor()
+        if incremental and self.cur.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            print (db_filename, 'has an older schema, rebuilding it')
+            incremental = False
+        self.incremental = incremental
+        self.cur.execute('BEGIN')
+        self.counts = {
+            'movies': prepare_rows(self.cur, 'movies', create_movies, incremental),
+            'casts': prepare_rows(self.cur, 'casts', create_casts, incremental),
+            'person': prepare_rows(self.cur, 'person', create_person, incremental),
+        }
+        prepare_credit_tables(self.cur)
+        self.rows = {'movies': [], 'casts': [], 'person': [], 'credit': [], 'filmography': []}
+        self.batch = 0
+        self.write_seconds = time.perf_counter() - start
+
+    def add(self, item):
+        '''Adds a movie or a cast to the database, writing the batch once it is full
+
+        Parameters
+        ----------
+        item:
+            a movie instance, or a cast instance with the score attribute given
+
+        Returns
+        -------
+        None
+        '''
+        if isinstance(item, Movies):
+            self.rows['movies'].append(movie_row(item))
+            self.rows['credit'] += movie_credits(item)
+        else:
+            self.rows['casts'].append(cast_row(item))
+            self.rows['person'].append(person_row(item))
+            self.rows['filmography'] += cast_films(item)
+        self.batch += 1
+        if self.batch >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        '''Writes and commits the rows of the batch
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        start = time.perf_counter()
+        with pipeline_metrics.timer('db.write.batch'):
+            write_rows(self.cur, 'movies', upsert_movies, self.rows['movies'], self.counts['movies'])
+            write_rows(self.cur, 'casts', upsert_casts, self.rows['casts'], self.counts['casts'])
+            write_rows(self.cur, 'person', upsert_person, self.rows['person'], self.counts['person'])
+            write_credit_rows(self.cur, self.rows['credit'], self.rows['filmography'])
+            self.cur.execute('COMMIT')
+            self.cur.execute('BEGIN')
+        pipeline_metrics.incr('db.batches')
+        for rows in self.rows.values():
+            rows.clear()
+        self.write_seconds += time.perf_counter() - start
+        self.batch = 0
+
+    def finish(self):
+        '''Writes the last batch, deletes the rows no longer scraped, generates the credit and
+        filmography tables, the image table, the indexes and the summary tables, then swaps the
+        staging file into place
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            in the form of {'movies': counts, 'casts': counts, 'person': counts}, see load_rows
+        '''
+        image_seconds = 0
+        try:
+            self.flush()
+            start = time.perf_counter()
+            with pipeline_metrics.timer('db.write.deletes'):
+                for table, table_counts in self.counts.items():
+                    finish_rows(self.cur, table, table_counts)
+            with pipeline_metrics.timer('db.write.credits'):
+                finish_credit_tables(self.cur)
+            with pipeline_metrics.timer('db.write.images'):
+                images_start = time.perf_counter()
+                build_image_table(self.cur, self.max_workers)
+                image_seconds = time.perf_counter() - images_start
+            with pipeline_metrics.timer('db.write.indexes'):
+                for create_index in create_indexes:
+                    self.cur.execute(create_index)
+                build_search_indexes(self.cur, rebuild=not self.incremental)
+            with pipeline_metrics.timer('db.write.aggregates'):
+                build_aggregate_tables(self.cur, rebuild=not self.incremental)
+            self.cur.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+            with pipeline_metrics.timer('db.write.commit'):
+                self.cur.execute('COMMIT')
+        finally:
+            self.conn.close()
+
+        # the rename is atomic, but only once the new file is safely on disk
+        with pipeline_metrics.timer('db.write.swap'):
+            with open(self.staging_filename, 'rb') as staging_file:
+                os.fsync(staging_file.fileno())
+            os.replace(self.staging_filename, self.db_filename)
+        self.write_seconds += time.perf_counter() - start - image_seconds
+        elapsed = self.write_seconds
+
+        num_of_rows = 0
+        for table, table_counts in self.counts.items():
+            num_of_rows += table_counts['inserted'] + table_counts['updated'] + table_counts['unchanged']
+            for change in ['inserted', 'updated', 'deleted']:
+                pipeline_metrics.incr('db.%s.%s' % (table, change), table_counts[change])
+        print ('Loaded', num_of_rows, 'rows into', self.db_filename, 'in', round(elapsed, 3), 'seconds,',
+               round(num_of_rows / max(elapsed, 1e-9)), 'rows/sec')
+        return self.counts
+
+    def abort(self):
+        '''Throws the staging file away, leaving the database as it was
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.conn.close()
+        if os.path.exists(self.staging_filename):
+            os.remove(self.staging_filename)
 
+def stream_database(items, incremental=False, db_filename=DB_FILENAME, batch_size=BATCH_SIZE,
+                    max_workers=MAX_WORKERS):
+    '''Build the database from movies and casts given one at a time, eg: by crawl, writing
+    them while they are produced. See DatabaseWriter
 
+    Parameters
+    ----------
+    items: iterable
+        of movie instances and cast instances with the score attribute given
+    incremental: bool
+        start from a copy of the current database and only write the rows that changed
+    db_filename: string
+        the database to replace
+    batch_size: int
+        number of movies and casts written per transaction
+    max_workers: int
+        the maximum number of images downloaded at the same time
+
+    Returns
+    -------
+    dict
+        in the form of {'movies': counts, 'casts': counts, 'person': counts}, see load_rows
+    '''
+    writer = DatabaseWriter(incremental, db_filename, batch_size, max_workers)
+    try:
+        for item in items:
+            writer.add(item)
+        return writer.finish()
+    except BaseException:
+        # the database is left as it was, without the half-built staging file
+        writer.abort()
+        raise
+
+def build_database(movie_list, cast_list, incremental=False, db_filename=DB_FILENAME, max_workers=MAX_WORKERS):
+    '''Build the movies, casts, person, credit and filmography tables, the search indexes and
+    the summary and image tables from lists of movies and casts. See stream_database
+
+    Parameters
+    ----------
+    movie_list: list
+        a list of movie instances
+    cast_list: list
+        a list of cast instances
+    incremental: bool
+        start from a copy of the current database and only write the rows that changed
+    db_filename: string
+        the database to replace
+    max_workers: int
+        the maximum number of images downloaded at the same time
+
+    Returns
+    -------
+    dict
+        in the form of {'movies': counts, 'casts': counts, 'person': counts}, see load_rows
+    '''
+    return stream_database(movie_list + cast_list, incremental, db_filename, max_workers=max_workers)
+
+def migrate_database(db_filename=DB_FILENAME):
+    '''Convert a database built by an older version to the current schema: numeric scores,
+    ISO dates, person, credit and filmography tables, indexes, search indexes, summary tables and an empty image table. Like a build, the conversion is done on a staging copy that
+    is swapped into place, and the rows keep their Id
+
+    Parameters
+    ----------
+    db_filename: string
+        the database to migrate
+
+    Returns
+    -------
+    bool
+        whether the database had to be migrated
+    '''
+    live = sqlite3.connect(db_filename)
+    version = live.execute('PRAGMA user_version').fetchone()[0]
+    if version == SCHEMA_VERSION:
+        live.close()
+        return False
+    staging_filename = db_filename + '.staging'
+    if os.path.exists(staging_filename):
+        os.remove(staging_filename)
+    staging = sqlite3.connect(staging_filename, isolation_level=None)
+    live.backup(staging)
+    live.close()
+    staging.execute('PRAGMA journal_mode=OFF')
+    staging.execute('PRAGMA synchronous=OFF')
+    try:
+        cur = staging.cursor()
+        cur.execute('BEGIN')
+        for table, create_table, score_columns, date_columns in [
+                ('movies', create_movies, ['score'], ['releasing_date']),
+                ('casts', create_casts, ['score1', 'score2', 'score3', 'score4'], ['date1', 'date2', 'date3', 'date4'])]:
+            cur.execute('ALTER TABLE "%s" RENAME TO "%s_old"' % (table, table))
+            cur.execute(create_table)
+            cur.execute('SELECT * FROM "%s_old"' % table)
+            old_columns = [column[0] for column in cur.description]
+            new_columns = [column[1] for column in staging.execute('PRAGMA table_info("%s")' % table)]
+            columns = [column for column in old_columns if column in new_columns]
+            rows = []
+            for row in cur.fetchall():
+                row = dict(zip(old_columns, row))
+                for column in score_columns:
+                    row[column] = parse_score(row[column])
+                for column in date_columns:
+                    row[column] = parse_date(row[column])
+                rows.append([row[column] for column in columns])
+            cur.executemany('INSERT INTO "%s" (%s) VALUES (%s)' % (table, ','.join('"%s"' % column for column in columns),
+                                                                   ','.join('?' for column in columns)), rows)
+            cur.execute('DROP TABLE "%s_old"' % table)
+            print ('Migrated', len(rows), 'rows of', table)
+        migrate_credit_tables(cur)
+        # filled by the next build, the pages show the images of IMDb meanwhile
+        cur.execute(create_image)
+        for create_index in create_indexes:
+            cur.execute(create_index)
+        build_search_indexes(cur)
+        build_aggregate_tables(cur)
+        cur.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        cur.execute('COMMIT')
+        cur.execute('VACUUM')
+    finally:
+        staging.close()
+    with open(staging_filename, 'rb') as staging_file:
+        os.fsync(staging_file.fileno())
+    os.replace(staging_filename, db_filename)
+    return True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Scrape the upcoming movies on IMDb and build super_movie.sqlite')
+    parser.add_argument('--workers', type=int, default=MAX_WORKERS,
+                        help='number of pages, and of posters and photos, fetched at the same time (default: %(default)s)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='revalidate the cached pages and scrape again the ones that changed')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only write the movies and casts that changed instead of rebuilding the database')
+    parser.add_argument('--migrate', action='store_true',
+                        help='only convert super_movie.sqlite to the current schema, without scraping')
+    parser.add_argument('--parser', choices=PARSER_BACKENDS, default=PARSER,
+                        help='HTML parser backend (default: the fastest installed, %(default)s)')
+    parser.add_argument('--check-parsers', metavar='PAGE_DIR',
+                        help='only compare the fast extraction with a full html.parser parse over the saved pages')
+    parser.add_argument('--progress', type=float, default=PROGRESS_INTERVAL, metavar='SECONDS',
+                        help='seconds between two progress lines of the crawl, 0 for none (default: %(default)s)')
+    parser.add_argument('--metrics', metavar='FILE',
+                        help='also write the final counters and latencies to FILE as JSON')
+    parser.add_argument('--max-attempts', type=int, default=MAX_ATTEMPTS,
+                        help='number of failures after which a page is skipped (default: %(default)s)')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='try again the pages skipped after too many failures')
+    parser.add_argument('--queue-size', type=int, default=QUEUE_SIZE,
+                        help='number of pages scraped ahead of the database writes (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help='number of movies and casts written to the database per transaction (default: %(default)s)')
+    parser.add_argument('--from-archive', action='store_true',
+                        help='parse again every page from the page archive and rebuild the cache and the database, without network access')
+    parser.add_argument('--no-images', action='store_true',
+                        help='do not download the posters and photos, only serve the ones downloaded by earlier builds')
+    parser.add_argument('--parse-workers', type=int, default=PARSE_WORKERS,
+                        help='number of processes parsing the pages, 0 to parse them in the crawl threads (default: %(default)s)')
+    args = parser.parse_args()
+    PARSER = args.parser
+    if args.check_parsers:
+        mismatches = check_parser_parity(args.check_parsers)
+        raise SystemExit(1 if mismatches else 0)
+    if args.migrate:
+        migrate_database()
+        raise SystemExit(0)
 
+    if args.from_archive:
+        # every page is read from the archive and parsed again, including the pages skipped
+        # after too many failures, which may have failed in the extractors
+        FROM_ARCHIVE = True
+        args.refresh = args.retry_failed = True
+    if args.from_archive or args.no_images:
+        FETCH_IMAGES = False
+    items = crawl(args.workers, args.refresh, args.progress, args.max_attempts, args.retry_failed, args.queue_size,
+                  args.parse_workers)
+    stream_database(items, args.incremental, batch_size=args.batch_size, max_workers=args.workers)
+    print (pipeline_metrics.report())
+    if args.metrics:
+        with open(args.metrics, 'w') as metrics_file:
+            json.dump(pipeline_metrics.snapshot(), metrics_file, indent=2)
@@ -0,0 +1,153 @@
+import hashlib
+import io
+import os
+import re
+import threading
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    # without Pillow the images are kept but no thumbnail is made, the full images are served instead
+    Image = None
+
+# width and height of every thumbnail, the posters and photos of IMDb are about 2:3
+THUMBNAIL_SIZE = (128, 190)
+THUMBNAIL_QUALITY = 85
+# the name of an image in the store, the sha256 of its content
+DIGEST_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+
+class ImageStore:
+    '''instance keeps images in a directory, named after the sha256 of their content, with a
+    thumbnail of each when Pillow is installed. An image is only written once however many
+    urls it is downloaded from, and a file never changes once written, so the files can be
+    served with long-lived cache headers
+
+    The image of digest 'ab12...' is 'ab/ab12...' under the directory, its thumbnail
+    'thumbnails/ab/ab12....jpg'. Files are written under a temporary name then renamed, so
+    a crash never leaves a half-written image under its final name.
+
+    Instance Attributes
+    -------------------
+    directory: string
+        the directory holding the images
+    lock: threading.Lock
+        serializes the writes of the same image by several threads
+    '''
+    def __init__(self, directory):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def path(self, digest):
+        '''Path of an image
+
+        Parameters
+        ----------
+        digest: string
+            the sha256 of the image, in hexadecimal
+
+        Returns
+        -------
+        string
+            the path of the image, which may not exist
+        '''
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def thumbnail_path(self, digest):
+        '''Path of the thumbnail of an image
+
+        Parameters
+        ----------
+        digest: string
+            the sha256 of the image, in hexadecimal
+
+        Returns
+        -------
+        string
+            the path of the thumbnail, a JPEG, which may not exist
+        '''
+        return os.path.join(self.directory, 'thumbnails', digest[:2], digest + '.jpg')
+
+    def write(self, path, data):
+        '''Write a file under a temporary name then rename it
+
+        Parameters
+        ----------
+        path: string
+            the final path of the file
+        data: bytes
+            the content of the file
+
+        Returns
+        -------
+        None
+        '''
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temporary_path = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+        with open(temporary_path, 'wb') as image_file:
+            image_file.write(data)
+        os.replace(temporary_path, path)
+
+    def add(self, data):
+        '''Keep an image and make its thumbnail, unless the store already has it
+
+        Parameters
+        ----------
+        data: bytes
+            the content of the image
+
+        Returns
+        -------
+        string
+            the sha256 of the image, in hexadecimal
+        '''
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            if not os.path.exists(self.path(digest)):
+                self.write(self.path(digest), data)
+        self.make_thumbnail(digest)
+        return digest
+
+    def has(self, digest):
+        '''Whether the store has an image
+
+        Parameters
+        ----------
+        digest: string
+            the sha256 of the image, in hexadecimal
+
+        Returns
+        -------
+        bool
+            True if the image is in the store
+        '''
+        return DIGEST_PATTERN.match(digest) is not None and os.path.exists(self.path(digest))
+
+    def make_thumbnail(self, digest):
+        '''Make the thumbnail of an image of the store, unless it already has one: the image is
+        scaled and cropped to exactly THUMBNAIL_SIZE
+
+        Parameters
+        ----------
+        digest: string
+            the sha256 of the image, in hexadecimal
+
+        Returns
+        -------
+        bool
+            whether the image has a thumbnail, False without Pillow or when Pillow can't
+            read the image
+        '''
+        if os.path.exists(self.thumbnail_path(digest)):
+            return True
+        if Image is None:
+            return False
+        try:
+            with Image.open(self.path(digest)) as image:
+                thumbnail = ImageOps.fit(image.convert('RGB'), THUMBNAIL_SIZE, Image.LANCZOS)
+        except (OSError, ValueError, Image.DecompressionBombError):
+            return False
+        output = io.BytesIO()
+        thumbnail.save(output, 'JPEG', quality=THUMBNAIL_QUALITY, optimize=True)
+        with self.lock:
+            self.write(self.thumbnail_path(digest), output.getvalue())
+        return True
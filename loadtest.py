@@ -0,0 +1,192 @@
+from urllib.parse import urlencode, urlsplit
+import argparse
+import http.client
+import itertools
+import json
+import threading
+import time
+from benchmark import flask_requests, summarize
+import supermovie_flask
+
+BASE_URL = 'http://127.0.0.1:5000'
+# requests sent to every route, and how many are in flight at the same time
+REQUESTS = 500
+CONCURRENCY = 8
+REQUEST_TIMEOUT = 30
+RESULTS_FILENAME = 'loadtest_results.json'
+
+class Client:
+    '''instance sends requests over one keep-alive connection to the server, connecting again
+    when the server closed it
+
+    Instance Attributes
+    -------------------
+    host: string
+        host of the server
+    port: int
+        port of the server
+    conn: http.client.HTTPConnection
+        the connection, None until the first request
+    '''
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.conn = None
+
+    def send(self, method, path, values):
+        '''Send a request and read the whole response
+
+        Parameters
+        ----------
+        method: string
+            'GET' or 'POST'
+        path: string
+            path of the route
+        values: dict
+            the query parameters of a GET, the form of a POST, None for none
+
+        Returns
+        -------
+        int
+            the status of the response
+        '''
+        body = None
+        headers = {'Accept-Encoding': 'gzip'}
+        if values and method == 'GET':
+            path += '?' + urlencode(values)
+        elif values:
+            body = urlencode(values)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        for attempt in range(2):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=REQUEST_TIMEOUT)
+            try:
+                self.conn.request(method, path, body, headers)
+                response = self.conn.getresponse()
+                response.read()
+                if response.will_close:
+                    self.close()
+                return response.status
+            except (http.client.RemoteDisconnected, ConnectionError):
+                # the server closed the idle connection, once
+                self.close()
+                if attempt:
+                    raise
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+def load_route(base_url, make_request, num_of_requests, concurrency):
+    '''Send the requests of a route, concurrency at a time
+
+    Parameters
+    ----------
+    base_url: string
+        url of the server, eg: 'http://127.0.0.1:5000'
+    make_request: function
+        gives the i-th request of the route, see benchmark.flask_requests
+    num_of_requests: int
+        number of requests sent
+    concurrency: int
+        number of requests in flight at the same time, each sent by its own thread and connection
+
+    Returns
+    -------
+    dict
+        requests per second, number of errors and latency summary, see benchmark.summarize
+    '''
+    address = urlsplit(base_url)
+    indexes = itertools.count()
+    durations = []
+    errors = []
+    lock = threading.Lock()
+
+    def run():
+        client = Client(address.hostname, address.port or 80)
+        try:
+            while True:
+                i = next(indexes)
+                if i >= num_of_requests:
+                    return
+                method, path, values = make_request(i)
+                start = time.perf_counter()
+                try:
+                    status = client.send(method, path, values)
+                except (OSError, http.client.HTTPException):
+                    status = None
+                    client.close()
+                with lock:
+                    durations.append(time.perf_counter() - start)
+                    if status != 200:
+                        errors.append(status)
+        finally:
+            client.close()
+
+    threads = [threading.Thread(target=run) for i in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    results = {'requests_per_sec': round(num_of_requests / elapsed, 2), 'errors': len(errors)}
+    results.update(summarize(durations))
+    return results
+
+def run_loadtest(base_url=BASE_URL, db_filename=supermovie_flask.DB_FILENAME, num_of_requests=REQUESTS,
+                 concurrency=CONCURRENCY, routes=None):
+    '''Load every route of a running server in turn, eg: started by serve.py
+
+    Parameters
+    ----------
+    base_url: string
+        url of the server
+    db_filename: string
+        the database the server serves, the movies and casts requested are read from it
+    num_of_requests: int
+        number of requests sent to every route
+    concurrency: int
+        number of requests in flight at the same time
+    routes: list
+        the routes loaded, None for all of them
+
+    Returns
+    -------
+    dict
+        in the form of {route: results}, see load_route
+    '''
+    requests = flask_requests(db_filename)
+    for route in routes or []:
+        if route not in requests:
+            raise ValueError('unknown route %s, the routes are %s' % (route, ', '.join(requests)))
+    results = {}
+    for route in routes or requests:
+        results[route] = load_route(base_url, requests[route], num_of_requests, concurrency)
+        print ('%-30s %9.1f req/s  p50 %8.2f ms  p99 %8.2f ms  %d errors' % (
+            route, results[route]['requests_per_sec'], results[route]['p50_ms'], results[route]['p99_ms'],
+            results[route]['errors']), flush=True)
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Load a running server of the flask app, eg: started by serve.py')
+    parser.add_argument('--url', default=BASE_URL,
+                        help='url of the server (default: %(default)s)')
+    parser.add_argument('--db', default=supermovie_flask.DB_FILENAME,
+                        help='the database the server serves (default: %(default)s)')
+    parser.add_argument('--requests', type=int, default=REQUESTS,
+                        help='number of requests sent to every route (default: %(default)s)')
+    parser.add_argument('--concurrency', type=int, default=CONCURRENCY,
+                        help='number of requests in flight at the same time (default: %(default)s)')
+    parser.add_argument('--route', action='append', dest='routes', metavar='ROUTE',
+                        help='only load this route, eg: /movie_list, can be repeated (default: every route)')
+    parser.add_argument('--output', default=RESULTS_FILENAME,
+                        help='JSON file the results are written to (default: %(default)s)')
+    args = parser.parse_args()
+
+    results = run_loadtest(args.url, args.db, args.requests, args.concurrency, args.routes)
+    with open(args.output, 'w') as results_file:
+        json.dump({'url': args.url, 'requests': args.requests, 'concurrency': args.concurrency, 'routes': results},
+                  results_file, indent=2)
+    print ('Results written to', args.output)
@@ -0,0 +1,298 @@
+import bisect
+import contextlib
+import threading
+import time
+
+# upper bounds of the histogram buckets, in seconds: 20 buckets per power of ten from 10us to
+# 100s, so a percentile is estimated within 12%
+BUCKETS = [10 ** (exponent / 20) for exponent in range(-100, 41)] + [float('inf')]
+
+class Histogram:
+    '''instance counts durations in fixed buckets, so it takes the same memory whatever the
+    number of durations, and estimates their percentiles
+
+    Instance Attributes
+    -------------------
+    counts: list
+        number of durations in each of the BUCKETS
+    count: int
+        number of durations
+    total: float
+        sum of the durations, in seconds
+    max: float
+        the longest duration, in seconds
+    '''
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        '''Count a duration
+
+        Parameters
+        ----------
+        seconds: float
+            the duration
+
+        Returns
+        -------
+        None
+        '''
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, fraction):
+        '''Estimate a percentile of the durations, by the upper bound of its bucket
+
+        Parameters
+        ----------
+        fraction: float
+            eg: 0.99 for the 99th percentile
+
+        Returns
+        -------
+        float
+            the percentile in seconds, never more than the longest duration
+        '''
+        seen = 0
+        for i, bound in enumerate(BUCKETS):
+            seen += self.counts[i]
+            if seen >= fraction * self.count:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        '''Summarize the durations
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            count, mean, p50, p99 and max of the durations, in milliseconds
+        '''
+        return {
+            'count': self.count,
+            'mean_ms': round(self.total / self.count * 1000, 3) if self.count else 0.0,
+            'p50_ms': round(self.percentile(0.50) * 1000, 3),
+            'p99_ms': round(self.percentile(0.99) * 1000, 3),
+            'max_ms': round(self.max * 1000, 3),
+        }
+
+class Metrics:
+    '''instance collects the counters and the latency histograms of a process, shared by all
+    its threads. Names are dotted, eg: 'cache.movie.hit', 'fetch', 'parse.movie'
+
+    Instance Attributes
+    -------------------
+    counters: dict
+        in the form of {name: number}
+    histograms: dict
+        in the form of {name: Histogram}
+    started: float
+        time.perf_counter() when the metrics were created or reset
+    lock: threading.Lock
+        guards counters and histograms
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        '''Forget every counter and histogram
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            self.counters = {}
+            self.histograms = {}
+            self.started = time.perf_counter()
+
+    def incr(self, name, value=1):
+        '''Add to a counter
+
+        Parameters
+        ----------
+        name: string
+            name of the counter
+        value: int
+            added to the counter
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        '''Add a duration to a histogram
+
+        Parameters
+        ----------
+        name: string
+            name of the histogram
+        seconds: float
+            the duration
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+
+    @contextlib.contextmanager
+    def timer(self, name):
+        '''Context manager adding the time spent in its block to a histogram, even when the
+        block raises
+
+        Parameters
+        ----------
+        name: string
+            name of the histogram
+
+        Returns
+        -------
+        None
+        '''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def get(self, name):
+        '''Current value of a counter
+
+        Parameters
+        ----------
+        name: string
+            name of the counter
+
+        Returns
+        -------
+        int
+            the counter, 0 if it was never added to
+        '''
+        with self.lock:
+            return self.counters.get(name, 0)
+
+    def snapshot(self):
+        '''The counters, the summaries of the histograms and the hit ratio of every counter
+        pair named '<name>.hit' and '<name>.miss'
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            in the form of {'elapsed_s': seconds, 'counters': {name: number},
+            'hit_ratios': {name: ratio}, 'histograms': {name: summary}}
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: histogram.summary() for name, histogram in self.histograms.items()}
+            elapsed = time.perf_counter() - self.started
+        hit_ratios = {}
+        for name in counters:
+            if name.endswith('.hit') or name.endswith('.miss'):
+                prefix = name.rsplit('.', 1)[0]
+                hits = counters.get(prefix + '.hit', 0)
+                lookups = hits + counters.get(prefix + '.miss', 0)
+                if lookups:
+                    hit_ratios[prefix] = round(hits / lookups, 4)
+        return {
+            'elapsed_s': round(elapsed, 3),
+            'counters': dict(sorted(counters.items())),
+            'hit_ratios': dict(sorted(hit_ratios.items())),
+            'histograms': dict(sorted(histograms.items())),
+        }
+
+    def report(self):
+        '''The snapshot as lines of text, for printing
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        string
+            one line per counter, hit ratio and histogram
+        '''
+        snapshot = self.snapshot()
+        lines = ['Metrics after %.1f seconds' % snapshot['elapsed_s']]
+        for name, value in snapshot['counters'].items():
+            lines.append('  %-40s %12d' % (name, value))
+        for name, ratio in snapshot['hit_ratios'].items():
+            lines.append('  %-40s %11.1f%%' % (name + ' hit ratio', ratio * 100))
+        for name, summary in snapshot['histograms'].items():
+            lines.append('  %-40s %8d x  mean %9.3f ms  p50 %9.3f ms  p99 %9.3f ms  max %9.3f ms' % (
+                name, summary['count'], summary['mean_ms'], summary['p50_ms'], summary['p99_ms'], summary['max_ms']))
+        return '\n'.join(lines)
+
+class ProgressReporter:
+    '''instance prints a one-line summary of some metrics every few seconds, from a background
+    thread, until it is stopped. Used as a context manager around the work it reports on
+
+    Instance Attributes
+    -------------------
+    metrics: Metrics
+        the metrics summarized
+    summarize: function
+        turns the metrics into the line printed
+    interval: float
+        seconds between two lines, 0 or less to print nothing
+    stopped: threading.Event
+        set to stop the thread
+    thread: threading.Thread
+        the thread printing the lines, None when nothing is printed
+    '''
+    def __init__(self, metrics, summarize, interval):
+        self.metrics = metrics
+        self.summarize = summarize
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def run(self):
+        '''Body of the background thread
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        while not self.stopped.wait(self.interval):
+            print (self.summarize(self.metrics), flush=True)
+
+    def __enter__(self):
+        if self.interval > 0:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
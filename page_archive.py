@@ -0,0 +1,265 @@
+import hashlib
+import os
+import struct
+import threading
+import time
+import zlib
+
+# every record of the data file is this header, the url and the zlib-compressed page: a magic
+# number, the time the page was fetched, the crc32 of the compressed page, the length of the
+# url and the length of the compressed page
+RECORD_HEADER = struct.Struct('<4sdIII')
+RECORD_MAGIC = b'PAGE'
+# every entry of the index file is the sha1 of the url, the time the page was fetched and the
+# offset and length of its record in the data file
+INDEX_ENTRY = struct.Struct('<20sdQI')
+COMPRESSION_LEVEL = 6
+
+class ArchivedPage:
+    '''instance is a page read back from a PageArchive. It has the text attribute of the
+    requests.Response it was fetched as, so the extractors take either
+
+    Instance Attributes
+    -------------------
+    url: string
+        the url the page was fetched from
+    fetched_at: float
+        when the page was fetched, in seconds since the epoch
+    text: string
+        the page
+    '''
+    def __init__(self, url, fetched_at, text):
+        self.url = url
+        self.fetched_at = fetched_at
+        self.text = text
+
+class PageArchive:
+    '''instance is the append-only archive of every page fetched by the crawl, so the pages
+    can be parsed again without fetching them
+
+    The pages are compressed one at a time and appended to the data file, then an entry
+    pointing at the record is appended to the index file. The index file is read once when
+    the archive is opened, into a dict from the hash of every url to its last entry, which
+    every append updates, so a lookup costs the same however many pages are archived. A page
+    fetched again is appended again, a lookup finds the last one. A crash can at most leave
+    the last record without its index entry, or half written: the index is completed, and
+    the half record dropped, the next time the archive is opened.
+
+    Instance Attributes
+    -------------------
+    data_filename: string
+        path of the file holding the compressed pages
+    index_filename: string
+        path of the file holding the index entries
+    data_file: file
+        the data file, opened for appending
+    index_file: file
+        the index file, opened for appending
+    entries: dict
+        in the form of {sha1 of the url: (fetched_at, offset, length)}, the last entry of
+        every url of the index file
+    lock: threading.Lock
+        serializes the appends and the lookups
+    '''
+    def __init__(self, data_filename, index_filename):
+        self.data_filename = data_filename
+        self.index_filename = index_filename
+        self.data_file = open(data_filename, 'ab+')
+        self.index_file = open(index_filename, 'ab+')
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.recover()
+        self.load_index()
+
+    def recover(self):
+        '''Brings the index up to date with the data file after a crash: the entries pointing
+        past the end of the data file are dropped, the records appended after the last entry
+        are indexed, and a half-written record at the end of the data file is dropped
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        data_size = os.fstat(self.data_file.fileno()).st_size
+        index_size = os.fstat(self.index_file.fileno()).st_size
+        index_size -= index_size % INDEX_ENTRY.size
+        end = 0
+        while index_size:
+            self.index_file.seek(index_size - INDEX_ENTRY.size)
+            url_hash, fetched_at, offset, length = INDEX_ENTRY.unpack(self.index_file.read(INDEX_ENTRY.size))
+            if offset + length <= data_size:
+                end = offset + length
+                break
+            index_size -= INDEX_ENTRY.size
+        self.index_file.truncate(index_size)
+
+        entries = []
+        while end < data_size:
+            record = self.read_record(end, data_size - end, partial=True)
+            if record is None:
+                print ('Dropping', data_size - end, 'bytes of a half-written page at the end of', self.data_filename)
+                self.data_file.truncate(end)
+                break
+            page, length = record
+            entries.append(INDEX_ENTRY.pack(self.hash_url(page.url), page.fetched_at, end, length))
+            end += length
+        if entries:
+            self.index_file.write(b''.join(entries))
+            self.index_file.flush()
+            print ('Indexed', len(entries), 'pages missing from', self.index_filename)
+
+    def load_index(self):
+        '''Reads the index file into entries, a later entry of a url replacing an earlier one
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        self.index_file.seek(0)
+        index = self.index_file.read()
+        for url_hash, fetched_at, offset, length in INDEX_ENTRY.iter_unpack(index[:len(index) - len(index) % INDEX_ENTRY.size]):
+            self.entries[url_hash] = (fetched_at, offset, length)
+
+    @staticmethod
+    def hash_url(page_url):
+        '''The key of a url in the index
+
+        Parameters
+        ----------
+        page_url: string
+            the url of the page
+
+        Returns
+        -------
+        bytes
+            the 20 bytes sha1 digest of the url
+        '''
+        return hashlib.sha1(page_url.encode('utf-8')).digest()
+
+    def read_record(self, offset, length, partial=False):
+        '''Reads a page from the data file
+
+        Parameters
+        ----------
+        offset: int
+            where the record starts in the data file
+        length: int
+            the length of the record, or with partial the number of bytes left in the file
+        partial: bool
+            the record may be shorter than length, or half-written
+
+        Returns
+        -------
+        ArchivedPage
+            the page, or with partial a tuple of the page and the length of its record,
+            None if the record is half-written
+        '''
+        data = os.pread(self.data_file.fileno(), length if not partial else min(length, RECORD_HEADER.size), offset)
+        if len(data) < RECORD_HEADER.size:
+            return None
+        magic, fetched_at, checksum, url_length, body_length = RECORD_HEADER.unpack_from(data)
+        record_length = RECORD_HEADER.size + url_length + body_length
+        if magic != RECORD_MAGIC or record_length > length:
+            if partial:
+                return None
+            raise ValueError('corrupted page at offset %d of %s' % (offset, self.data_filename))
+        if partial:
+            data = os.pread(self.data_file.fileno(), record_length, offset)
+        page_url = data[RECORD_HEADER.size:RECORD_HEADER.size + url_length].decode('utf-8')
+        body = data[RECORD_HEADER.size + url_length:record_length]
+        if zlib.crc32(body) != checksum:
+            if partial:
+                return None
+            raise ValueError('corrupted page at offset %d of %s' % (offset, self.data_filename))
+        page = ArchivedPage(page_url, fetched_at, zlib.decompress(body).decode('utf-8'))
+        return (page, record_length) if partial else page
+
+    def append(self, page_url, text, fetched_at=None):
+        '''Archives a page
+
+        Parameters
+        ----------
+        page_url: string
+            the url the page was fetched from
+        text: string
+            the page
+        fetched_at: float
+            when the page was fetched, in seconds since the epoch, None for now
+
+        Returns
+        -------
+        None
+        '''
+        if fetched_at is None:
+            fetched_at = time.time()
+        url_bytes = page_url.encode('utf-8')
+        body = zlib.compress(text.encode('utf-8'), COMPRESSION_LEVEL)
+        record = RECORD_HEADER.pack(RECORD_MAGIC, fetched_at, zlib.crc32(body), len(url_bytes), len(body)) + url_bytes + body
+        url_hash = self.hash_url(page_url)
+        with self.lock:
+            offset = self.data_file.seek(0, os.SEEK_END)
+            self.data_file.write(record)
+            self.data_file.flush()
+            # the record is complete on disk before it is indexed
+            self.index_file.write(INDEX_ENTRY.pack(url_hash, fetched_at, offset, len(record)))
+            self.index_file.flush()
+            self.entries[url_hash] = (fetched_at, offset, len(record))
+
+    def find(self, page_url):
+        '''Looks a url up in the index
+
+        Parameters
+        ----------
+        page_url: string
+            the url of the page
+
+        Returns
+        -------
+        tuple
+            in the form of (fetched_at, offset, length) for the last time the page was
+            archived, None if it never was
+        '''
+        with self.lock:
+            return self.entries.get(self.hash_url(page_url))
+
+    def get(self, page_url):
+        '''Reads the last archived version of a page
+
+        Parameters
+        ----------
+        page_url: string
+            the url of the page
+
+        Returns
+        -------
+        ArchivedPage
+            the page, None if it was never archived
+        '''
+        entry = self.find(page_url)
+        if entry is None:
+            return None
+        fetched_at, offset, length = entry
+        return self.read_record(offset, length)
+
+    def close(self):
+        '''Closes the data and index files
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            self.data_file.close()
+            self.index_file.close()
@@ -0,0 +1,212 @@
+from werkzeug.serving import WSGIRequestHandler, make_server
+import argparse
+import os
+import signal
+import socket
+import sqlite3
+import time
+import traceback
+import supermovie_flask
+
+HOST = '127.0.0.1'
+PORT = 5000
+# one process per core, each answering its requests in threads
+WORKERS = os.cpu_count() or 1
+# connections waiting to be accepted while every worker is busy
+BACKLOG = 1024
+# a worker dying within MIN_UPTIME seconds of its start is started again after a delay, doubled
+# by every such death in a row up to RESTART_DELAY_MAX, and the server gives up after
+# MAX_QUICK_DEATHS of them in a row rather than starting workers that cannot run
+MIN_UPTIME = 5
+RESTART_DELAY = 0.1
+RESTART_DELAY_MAX = 5
+MAX_QUICK_DEATHS = 5
+
+class QuietRequestHandler(WSGIRequestHandler):
+    '''Answers the requests without writing a line per request to stderr, errors are still written'''
+    def log_request(self, code='-', size='-'):
+        pass
+
+def listen(host=HOST, port=PORT, backlog=BACKLOG):
+    '''Open the socket the workers accept the connections from
+
+    Parameters
+    ----------
+    host: string
+        the address to listen on
+    port: int
+        the port to listen on, 0 for any free port
+    backlog: int
+        connections waiting to be accepted
+
+    Returns
+    -------
+    socket.socket
+        the listening socket, inherited by the workers
+    '''
+    sock = socket.create_server((host, port), backlog=backlog)
+    sock.set_inheritable(True)
+    return sock
+
+def check_database():
+    '''Open the database the workers serve and read from it, so that a missing or unreadable
+    database stops the server before any worker is started
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    None
+    '''
+    try:
+        conn, version = supermovie_flask.pool.acquire()
+        try:
+            conn.execute('SELECT 1 FROM movies LIMIT 1').fetchall()
+        finally:
+            # not given back to the pool, the workers open their own connections
+            conn.close()
+    except (OSError, sqlite3.Error) as e:
+        raise SystemExit('Cannot serve %s: %s' % (supermovie_flask.pool.filename, e))
+
+def run_worker(sock, access_log=False):
+    '''Body of a worker: answers the requests of the connections it accepts from sock, each
+    in its own thread, until the process is stopped. The connections to the database are
+    opened by the worker itself, read-only, see supermovie_flask.ConnectionPool
+
+    Parameters
+    ----------
+    sock: socket.socket
+        the listening socket, shared by all the workers
+    access_log: bool
+        write a line per request to stderr
+
+    Returns
+    -------
+    None
+    '''
+    supermovie_flask.app.debug = False
+    # loaded before the first request rather than by it
+    supermovie_flask.get_name_indexes()
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, supermovie_flask.app, threaded=True, fd=sock.fileno(),
+                         request_handler=WSGIRequestHandler if access_log else QuietRequestHandler)
+    server.serve_forever()
+
+def start_worker(sock, access_log=False):
+    '''Fork a worker
+
+    Parameters
+    ----------
+    sock: socket.socket
+        the listening socket
+    access_log: bool
+        write a line per request to stderr
+
+    Returns
+    -------
+    int
+        pid of the worker
+    '''
+    pid = os.fork()
+    if pid == 0:
+        # the worker is stopped by the signals the server forwards it
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        try:
+            run_worker(sock, access_log)
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            # never back into the loop of the server
+            os._exit(1)
+    return pid
+
+def serve(host=HOST, port=PORT, workers=WORKERS, access_log=False):
+    '''Run the flask app with the debugger and the reloader off: workers processes share the
+    listening socket and each answers its requests in threads. A worker that dies is started
+    again, after a delay if it died right after its start; the server exits with an error when
+    workers keep dying right after their start. Runs until SIGINT (Ctrl-C) or SIGTERM, which
+    stop every worker
+
+    Without os.fork (Windows), the app is run by a single process
+
+    Parameters
+    ----------
+    host: string
+        the address to listen on
+    port: int
+        the port to listen on
+    workers: int
+        number of processes
+    access_log: bool
+        write a line per request to stderr
+
+    Returns
+    -------
+    None
+    '''
+    check_database()
+    sock = listen(host, port)
+    print ('Serving', supermovie_flask.app.name, 'on http://%s:%d' % sock.getsockname()[:2], 'with', workers, 'workers', flush=True)
+    if workers <= 1 or not hasattr(os, 'fork'):
+        run_worker(sock, access_log)
+        return
+
+    # pid of every worker: the time it was started
+    pids = {}
+    stopping = []
+    def stop(signum, frame):
+        stopping.append(signum)
+        for pid in list(pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+    # set before the workers exist, so none can be left behind
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    for i in range(workers):
+        pids[start_worker(sock, access_log)] = time.monotonic()
+    quick_deaths = 0
+    while pids:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        started = pids.pop(pid, None)
+        if stopping or started is None:
+            continue
+        exitcode = os.waitstatus_to_exitcode(status)
+        if time.monotonic() - started < MIN_UPTIME:
+            quick_deaths += 1
+        else:
+            quick_deaths = 0
+        if quick_deaths >= MAX_QUICK_DEATHS:
+            print ('Worker', pid, 'exited with status', exitcode, 'and', quick_deaths,
+                   'workers in a row died right after their start, stopping the server', flush=True)
+            stop(signal.SIGTERM, None)
+            continue
+        delay = min(RESTART_DELAY * 2 ** (quick_deaths - 1), RESTART_DELAY_MAX) if quick_deaths else 0
+        print ('Worker', pid, 'exited with status', exitcode, 'starting another one in %.1f seconds' % delay, flush=True)
+        time.sleep(delay)
+        if not stopping:
+            pids[start_worker(sock, access_log)] = time.monotonic()
+    sock.close()
+    if quick_deaths >= MAX_QUICK_DEATHS:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve the flask app with several worker processes, debug off')
+    parser.add_argument('--host', default=HOST,
+                        help='address to listen on (default: %(default)s)')
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='port to listen on (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=WORKERS,
+                        help='number of processes answering the requests, each with its threads (default: %(default)s)')
+    parser.add_argument('--access-log', action='store_true',
+                        help='write a line per request to stderr')
+    args = parser.parse_args()
+    serve(args.host, args.port, args.workers, args.access_log)
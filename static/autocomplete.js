@@ -0,0 +1,22 @@
+// suggests names for every input with a data-autocomplete attribute ('movie', 'cast' or 'all'),
+// from the /autocomplete endpoint of supermovie_flask.py
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+    var list = document.getElementById(input.getAttribute('list'));
+    input.addEventListener('input', function () {
+        var query = input.value;
+        fetch('/autocomplete?type=' + input.dataset.autocomplete + '&q=' + encodeURIComponent(query))
+            .then(function (response) { return response.json(); })
+            .then(function (names) {
+                if (input.value !== query) {
+                    // the user kept typing, the answer to the newer query will fill the list
+                    return;
+                }
+                list.innerHTML = '';
+                names.forEach(function (name) {
+                    var option = document.createElement('option');
+                    option.value = name.name;
+                    list.appendChild(option);
+                });
+            });
+    });
+});
@@ -1,54 +1,776 @@
-from flask import Flask, render_template, request
-import sqlite3 
-import plotly.graph_objs as go
+from collections import OrderedDict
+from image_store import ImageStore
+from metrics import Metrics
+from flask import Flask, Response, abort, g, jsonify, render_template, request, send_file
+from urllib.parse import urlencode
+from urllib.request import pathname2url
+import bisect
+import functools
+import gzip
+import hashlib
+import heapq
+import json
+import os
 import re
+import sqlite3 
+import threading
+import time
+import zlib
+import plotly
+from plotly.offline import get_plotlyjs
+
+DB_FILENAME = 'super_movie.sqlite'
+# the database is mapped into memory instead of being read through the page cache
+MMAP_SIZE = 256 * 1024 * 1024
+
+# number of rendered pages kept by the response cache
+RESPONSE_CACHE_SIZE = 1024
+
+# plotly.js is served once, under a url that changes with its version, so browsers can keep it
+PLOTLY_JS_MAX_AGE = 365 * 24 * 3600
+# the posters and photos downloaded by final_proj.py. An image is served under the sha256 of
+# its content, so browsers can keep it as long as plotly.js
+IMAGE_DIRECTORY = 'images'
+IMAGE_MAX_AGE = PLOTLY_JS_MAX_AGE
+
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+# for every sort of the movie list: the column shown, the sort key and its order, and the type
+# of the key. The keys are the expressions indexed by final_proj.py, movies without a score or
+# a date come last
+SORTS = {
+    'score': ('score', 'IFNULL(score, -1)', 'DESC', float),
+    'date': ('releasing_date', "IFNULL(releasing_date, '9999')", 'ASC', str),
+}
+
+# the full-text searches rank a match in the name this many times higher than one in the
+# description or bio
+SEARCH_NAME_WEIGHT = 10.0
+SEARCH_RESULTS = 20
+
+# the completions of the prefixes up to this length are computed when the names are loaded,
+# longer prefixes match few enough names to be ranked on the fly
+AUTOCOMPLETE_PREFIX_LENGTH = 2
+AUTOCOMPLETE_RESULTS = 10
+
+# the columns served by the JSON API, the films of a cast are served as a list instead
+MOVIE_COLUMNS = ['Id', 'name', 'director', 'star1', 'star2', 'star3', 'releasing_date', 'score',
+                 'classification', 'description', 'poster_url', 'imdb_id']
+CAST_COLUMNS = ['Id', 'name', 'position', 'bio', 'photo', 'imdb_id']
+# the casts are read from the person table, one row per person, the position being the roles
+# of its credits, eg: 'director,star'
+CAST_POSITION = '(SELECT group_concat(DISTINCT credit.role) FROM credit WHERE credit.person_id = person.Id)'
+CAST_SELECT = ['person.Id', 'person.name', CAST_POSITION, 'person.bio', 'person.photo', 'person.imdb_id']
+# smaller JSON responses are not worth compressing
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+# rows read from the cursor at a time by the NDJSON export
+EXPORT_BATCH_SIZE = 500
+# the statistics are read from the summary tables final_proj.py keeps, in the form of
+# {name: query}. Only the directors with the best average score are listed
+STATS_DIRECTORS = 20
+STATS_QUERIES = {
+    'classifications': 'SELECT classification, movies, scored, score_tenths FROM classification_stats ORDER BY movies DESC, classification',
+    'months': 'SELECT month, movies, scored, score_tenths FROM release_month_stats ORDER BY month',
+    'directors': '''SELECT director, movies, scored, score_tenths FROM director_stats WHERE scored > 0
+                    ORDER BY score_tenths * 1.0 / scored DESC LIMIT %d''' % STATS_DIRECTORS,
+}
+
+class ConnectionPool:
+    '''instance hands out read-only connections to the database, reused across requests
+
+    final_proj.py never writes to the database in place, it swaps a new file in.
+    The connections can therefore open it immutable, without locking or change
+    detection, and a connection is only reused while the file it was opened on is
+    still the current one.
+
+    Instance Attributes
+    -------------------
+    filename: str
+        path of the database
+    idle: list
+        in the form of [(connection, identity)], the connections not used by a request
+    lock: threading.Lock
+        guards idle
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def identity(self):
+        '''Identity of the database file, which changes when a new database is swapped in
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        tuple
+            device, inode, modification time and size of the file
+        '''
+        stat = os.stat(self.filename)
+        return (stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def acquire(self):
+        '''Take an idle connection to the current database, or open a new one
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        tuple
+            in the form of (connection, identity)
+        '''
+        identity = self.identity()
+        with self.lock:
+            while self.idle:
+                conn, conn_identity = self.idle.pop()
+                if conn_identity == identity:
+                    return conn, identity
+                # opened on a database that has been swapped out since
+                conn.close()
+        uri = 'file:%s?mode=ro&immutable=1' % pathname2url(os.path.abspath(self.filename))
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        conn.execute('PRAGMA mmap_size = %d' % MMAP_SIZE)
+        return conn, identity
+
+    def release(self, conn, identity):
+        '''Give a connection back once the request is done with it
+
+        Parameters
+        ----------
+        conn: sqlite3.Connection
+            a connection returned by acquire
+        identity: tuple
+            the identity returned along with the connection
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            self.idle.append((conn, identity))
+
+@functools.lru_cache(maxsize=RESPONSE_CACHE_SIZE)
+def score_chart(films):
+    '''The points of the score chart of a cast, memoized on the filmography of the cast
+
+    Parameters
+    ----------
+    films: tuple
+        rows of the filmography table, in the form of ((film, score, release_date), ...)
+
+    Returns
+    -------
+    dict
+        in the form of {'x': [release dates], 'y': [scores]}, sorted by date. The films
+        without a release date are left out
+    '''
+    points = sorted((release_date, score) for film, score, release_date in films if release_date is not None)
+    return {'x': [point[0] for point in points], 'y': [point[1] for point in points]}
+
+class ResponseCache:
+    '''instance keeps the most recently used rendered pages of one version of the database
+
+    Instance Attributes
+    -------------------
+    max_entries: int
+        the least recently used page is dropped beyond this number of pages
+    entries: OrderedDict
+        in the form of {(path, parameters): page}, the least recently used first
+    version: tuple
+        identity of the database the pages were rendered from, see ConnectionPool.identity
+    hits: int
+        number of pages served from the cache
+    misses: int
+        number of pages that had to be rendered
+    lock: threading.Lock
+        guards all of the above
+    '''
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        '''Look up a page, dropping every page when the database has changed
+
+        Parameters
+        ----------
+        key: tuple
+            in the form of (path, parameters)
+        version: tuple
+            identity of the database the request reads
+
+        Returns
+        -------
+        string
+            the rendered page, None if it is not cached
+        '''
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+            page = self.entries.get(key)
+            if page is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return page
+
+    def put(self, key, version, page):
+        '''Keep a rendered page
+
+        Parameters
+        ----------
+        key: tuple
+            in the form of (path, parameters)
+        version: tuple
+            identity of the database the page was rendered from
+        page: string
+            the rendered page
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            if version != self.version:
+                # rendered from a database that has been swapped out meanwhile
+                return
+            self.entries[key] = page
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        '''Drop every page
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        '''
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        '''Counters of the cache
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            hits, misses, hit ratio and number of pages kept
+        '''
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'entries': len(self.entries),
+                'max_entries': self.max_entries,
+            }
+
+class TimedCursor:
+    '''instance wraps a cursor of the database and adds the time spent executing queries and
+    fetching their rows to g.db_time, the database time of the current request
+
+    Instance Attributes
+    -------------------
+    cursor: sqlite3.Cursor
+        the cursor wrapped
+    '''
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def timed(self, method, *args):
+        '''Call a method of the cursor, timing it
+
+        Parameters
+        ----------
+        method: function
+            a method of the cursor
+        args: tuple
+            the arguments of the method
+
+        Returns
+        -------
+        object
+            what the method returns
+        '''
+        start = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            g.db_time = g.get('db_time', 0.0) + time.perf_counter() - start
+
+    def execute(self, query, parameters=()):
+        self.timed(self.cursor.execute, query, parameters)
+        return self
+
+    def fetchone(self):
+        return self.timed(self.cursor.fetchone)
+
+    def fetchmany(self, size):
+        return self.timed(self.cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self.timed(self.cursor.fetchall)
+
+class TimedConnection:
+    '''instance wraps a connection to the database so that its cursors are TimedCursor
+
+    Instance Attributes
+    -------------------
+    conn: sqlite3.Connection
+        the connection wrapped
+    '''
+    def __init__(self, conn):
+        self.conn = conn
+
+    def cursor(self):
+        return TimedCursor(self.conn.cursor())
+
+    def execute(self, query, parameters=()):
+        return self.cursor().execute(query, parameters)
+
+def normalize_name(name):
+    '''Normalize a name or what the user typed for comparing them
+
+    Parameters
+    ----------
+    name: string
+        eg: '  Tom  HANKS'
+
+    Returns
+    -------
+    string
+        lower case, words separated by a single space, eg: 'tom hanks'
+    '''
+    return ' '.join(name.casefold().split())
+
+class NameIndex:
+    '''instance completes the beginning of a name from memory, best scores first
+
+    Every name is kept under each of its words, so 'han' completes 'Tom Hanks'. The keys
+    are sorted, so the names starting with a prefix are a range found with bisect. The
+    names are numbered by rank, best score first, so the best names of a range are the
+    smallest numbers in it.
+
+    Instance Attributes
+    -------------------
+    names: list
+        in the form of [(name, type, score)], sorted by score, the best first
+    keys: list
+        the sorted names normalized and cut at the start of each word, eg: 'tom hanks', 'hanks'
+    ranks: list
+        the position in names of the name of each key
+    top: dict
+        in the form of {prefix: [rank]}, the completions of the short prefixes
+    '''
+    def __init__(self, names):
+        best = {}
+        for name, name_type, score in names:
+            if name and ((name, name_type) not in best or (score or -1) > (best[(name, name_type)] or -1)):
+                best[(name, name_type)] = score
+        self.names = sorted(((name, name_type, score) for (name, name_type), score in best.items()),
+                            key=lambda entry: (-(entry[2] if entry[2] is not None else -1), entry[0]))
+        keyed = []
+        for rank, (name, name_type, score) in enumerate(self.names):
+            words = normalize_name(name).split(' ')
+            for i in range(len(words)):
+                keyed.append((' '.join(words[i:]), rank))
+        keyed.sort()
+        self.keys = [key for key, rank in keyed]
+        self.ranks = [rank for key, rank in keyed]
+        buckets = {}
+        for key, rank in keyed:
+            for length in range(1, min(len(key), AUTOCOMPLETE_PREFIX_LENGTH) + 1):
+                buckets.setdefault(key[:length], set()).add(rank)
+        self.top = {prefix: heapq.nsmallest(AUTOCOMPLETE_RESULTS, ranks) for prefix, ranks in buckets.items()}
+
+    def complete(self, prefix, limit=AUTOCOMPLETE_RESULTS):
+        '''Names with a word starting with the prefix
+
+        Parameters
+        ----------
+        prefix: string
+            what the user typed
+        limit: int
+            maximum number of names, at most AUTOCOMPLETE_RESULTS
+
+        Returns
+        -------
+        list
+            in the form of [(name, type, score)], best score first
+        '''
+        prefix = normalize_name(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= AUTOCOMPLETE_PREFIX_LENGTH:
+            ranks = self.top.get(prefix, [])[:limit]
+        else:
+            start = bisect.bisect_left(self.keys, prefix)
+            end = bisect.bisect_left(self.keys, prefix + '\U0010ffff', start)
+            matches = self.ranks[start:end]
+            # a name is under several keys of the range when several of its words start with
+            # the prefix, the smallest ranks are taken again, more of them, until enough names
+            wanted = limit
+            while True:
+                smallest = heapq.nsmallest(wanted, matches)
+                ranks = list(dict.fromkeys(smallest))[:limit]
+                if len(ranks) == limit or len(smallest) < wanted:
+                    break
+                wanted *= 2
+        return [self.names[rank] for rank in ranks]
+
+def load_name_indexes(conn):
+    '''Read the names of the movies and casts into a NameIndex for each type and one for both.
+    A movie ranks by its score, a cast by the average score of the films it is known for
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to the database
+
+    Returns
+    -------
+    dict
+        in the form of {'movie': NameIndex, 'cast': NameIndex, 'all': NameIndex}
+    '''
+    movies = [(name, 'movie', score) for name, score in conn.execute('SELECT name, score FROM movies')]
+    casts = [(name, 'cast', score) for name, score in conn.execute('''
+        SELECT person.name, ROUND(AVG(filmography.score), 2) FROM person
+        LEFT JOIN filmography ON filmography.person_id = person.Id
+        GROUP BY person.Id
+    ''')]
+    return {'movie': NameIndex(movies), 'cast': NameIndex(casts), 'all': NameIndex(movies + casts)}
+
+def movie_list_query(sort, classification, page_size, after=None, after_id=None, columns=None):
+    '''Build the query for a page of the movie list. The pages are keyset paginated: a page
+    starts right after the sort key and Id of the last movie of the previous page, so every
+    page is a range scan of the index whatever its position in the list
+    
+    Parameters
+    ----------
+    sort: string
+        'score' or 'date'
+    classification: string
+        type of the movies, 'All' for every type
+    page_size: int
+        number of movies in the page
+    after: string
+        sort key of the last movie of the previous page, None for the first page
+    after_id: string
+        Id of the last movie of the previous page, None for the first page
+    columns: list
+        the columns of the movies selected, None for name, classification and the column sorted by
+    
+    Returns
+    -------
+    tuple
+        in the form of (query, parameters), the rows are the columns followed by the Id and
+        the sort key, and there is one more row than page_size when there is a next page
+    '''
+    column, key, order, key_type = SORTS[sort]
+    if columns is None:
+        columns = ['name', 'classification', column]
+    conditions = []
+    parameters = []
+    if classification != 'All':
+        conditions.append('classification = ?')
+        parameters.append(classification)
+    if after is not None and after_id is not None:
+        # the first condition alone lets sqlite seek to the start of the page in the index
+        conditions.append('%s %s ?' % (key, '<=' if order == 'DESC' else '>='))
+        conditions.append('(%s, Id) %s (?, ?)' % (key, '<' if order == 'DESC' else '>'))
+        parameters += [key_type(after), key_type(after), int(after_id)]
+    query = 'SELECT %s, Id, %s FROM movies' % (', '.join(columns), key)
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' ORDER BY %s %s, Id %s LIMIT ?' % (key, order, order)
+    parameters.append(page_size + 1)
+    return query, parameters
+
+def cast_records(conn, rows):
+    '''Convert rows of the person table into the records served by the JSON API, with the
+    films each person is known for, read for all the rows at once
+
+    Parameters
+    ----------
+    conn: sqlite3.Connection
+        connection to the database
+    rows: list
+        the CAST_SELECT of the people
+
+    Returns
+    -------
+    list
+        the records, the CAST_COLUMNS with the films known for in a 'filmography' list of
+        {'film', 'score', 'date'}
+    '''
+    records = [dict(zip(CAST_COLUMNS, row), filmography=[]) for row in rows]
+    if not records:
+        return records
+    by_id = {record['Id']: record for record in records}
+    films = conn.execute('''
+        SELECT person_id, film, score, release_date FROM filmography
+        WHERE person_id IN (%s) ORDER BY person_id, position
+    ''' % ', '.join('?' for record in records), list(by_id)).fetchall()
+    for person_id, film, score, date in films:
+        by_id[person_id]['filmography'].append({'film': film, 'score': score, 'date': date})
+    return records
 
-def convert_month(date):
-    '''Convert the input date into the format of yyyy/mm/dd
-    
-    Parameters
-    ----------
-    date: string
-        date in the format of <dd> <month in text> <yyyy>
-    
-    Returns
-    -------
-    date_int: string
-        input date converted to the format of yyyy/mm/dd
-    '''
-    date_int = '0000/00/00'
-    if date != None and date != '-':
-        first_seg = re.search('\s{1}\d{4}$',date).group().strip()
-        second_seg = re.search('[a-zA-Z]+',date).group().strip()
-        if second_seg == 'January':
-            second_seg = '01'
-        if second_seg == 'February':
-            second_seg = '02'
-        if second_seg == 'March':
-            second_seg = '03'
-        if second_seg == 'April':
-            second_seg = '04'
-        if second_seg == 'May':
-            second_seg = '05'
-        if second_seg == 'June':
-            second_seg = '06'
-        if second_seg == 'July':
-            second_seg = '07'
-        if second_seg == 'August':
-            second_seg = '08'
-        if second_seg == 'September':
-            second_seg = '09'
-        if second_seg == 'October':
-            second_seg = '10'
-        if second_seg == 'November':
-            second_seg = '11'
-        if second_seg == 'December':
-            second_seg = '12' 
-        third_seg = re.search('^\d+\s{1}',date).group().strip()
-        date_int = first_seg+'/'+second_seg+'/'+third_seg
-    return date_int
+def search_expression(text):
+    '''Convert what the user typed into a full-text search expression. Every word must
+    appear, the last one may be the beginning of a word
+    
+    Parameters
+    ----------
+    text: string
+        the words searched, eg: 'tom hank'
+    
+    Returns
+    -------
+    string
+        the expression for the MATCH operator, eg: '"tom" "hank"*', None if there is no word
+    '''
+    words = re.findall(r'\w+', text)
+    if not words:
+        return None
+    # quoted, so that words like AND or NEAR are not read as operators
+    terms = ['"%s"' % word for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
 
 app = Flask(__name__)
+pool = ConnectionPool(DB_FILENAME)
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE)
+image_store = ImageStore(IMAGE_DIRECTORY)
+# latency and database time of every route, served at /metrics
+app_metrics = Metrics()
+# in the form of (identity of the database, name indexes), see load_name_indexes
+name_indexes = (None, None)
+name_indexes_lock = threading.Lock()
+
+def get_db():
+    '''Connection to the database for the current request, returned to the pool when the request ends
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    TimedConnection
+        a read-only connection, timing the queries of the request
+    '''
+    if 'db' not in g:
+        g.db = pool.acquire()
+    return TimedConnection(g.db[0])
+
+def get_name_indexes():
+    '''The name indexes of the current database, loaded again after the database is rebuilt
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    dict
+        see load_name_indexes
+    '''
+    global name_indexes
+    version, indexes = name_indexes
+    if version != pool.identity():
+        with name_indexes_lock:
+            version, indexes = name_indexes
+            if version != pool.identity():
+                conn, version = pool.acquire()
+                try:
+                    indexes = load_name_indexes(conn)
+                finally:
+                    pool.release(conn, version)
+                name_indexes = (version, indexes)
+    return indexes
+
+def cached_page(view):
+    '''Decorator serving the page of a view from the response cache. A page is identified by
+    the path and the form/query parameters of the request, and is only reused while the
+    database it was rendered from is the current one
+    
+    Parameters
+    ----------
+    view: function
+        a view returning the rendered page
+    
+    Returns
+    -------
+    function
+        the view with caching
+    '''
+    @functools.wraps(view)
+    def cached_view(*args, **kwargs):
+        key = (request.path, tuple(sorted(request.values.items(multi=True))))
+        get_db()
+        # the version of the connection the view will read from
+        version = g.db[1]
+        page = response_cache.get(key, version)
+        if page is None:
+            page = view(*args, **kwargs)
+            response_cache.put(key, version, page)
+        return page
+    return cached_view
+
+def api_view(view):
+    '''Decorator serving the object returned by a view of the JSON API. The response carries an
+    ETag made of the version of the database and the request, so a client revalidating it gets
+    a 304 until the database is rebuilt, and it is compressed with gzip when the client accepts it
+    
+    Parameters
+    ----------
+    view: function
+        a view returning an object that can be converted into JSON
+    
+    Returns
+    -------
+    function
+        the view returning the JSON response
+    '''
+    @functools.wraps(view)
+    def api_response(*args, **kwargs):
+        get_db()
+        etag = api_etag(g.db[1])
+        if request.if_none_match.contains_weak(etag):
+            response = Response(status=304)
+        else:
+            body = json.dumps(view(*args, **kwargs)).encode('utf-8')
+            response = Response(body, mimetype='application/json')
+            if len(body) >= GZIP_MIN_SIZE and request.accept_encodings['gzip']:
+                response.set_data(gzip.compress(body, GZIP_LEVEL))
+                response.content_encoding = 'gzip'
+        # the same ETag for the gzip and plain responses, hence weak
+        response.set_etag(etag, weak=True)
+        response.vary.add('Accept-Encoding')
+        return response
+    return api_response
+
+def api_etag(version):
+    '''ETag of the response of the JSON API to the request
+
+    Parameters
+    ----------
+    version: tuple
+        identity of the database the response is read from
+
+    Returns
+    -------
+    string
+        the ETag
+    '''
+    request_key = (version, request.path, sorted(request.args.items(multi=True)))
+    return hashlib.sha1(repr(request_key).encode('utf-8')).hexdigest()
+
+def route_name():
+    '''Name of the route of the current request in the metrics
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    string
+        the rule of the route, eg: '/api/movies/<int:movie_id>', 'unmatched' when no route matched
+    '''
+    if request.url_rule is None:
+        return 'unmatched'
+    return request.url_rule.rule
+
+@app.before_request
+def start_timer():
+    '''Record when the request started
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    none
+    '''
+    g.request_start = time.perf_counter()
+    g.db_time = 0.0
+
+@app.after_request
+def count_response(response):
+    '''Count the responses of every route by status code
+    
+    Parameters
+    ----------
+    response: flask.Response
+        the response of the request
+    
+    Returns
+    -------
+    flask.Response
+        the same response
+    '''
+    app_metrics.incr('responses.%s.%d' % (route_name(), response.status_code))
+    return response
+
+@app.teardown_request
+def record_latency(exception):
+    '''Add the latency and the database time of the request to the metrics of its route. A
+    streamed response is only timed until it starts streaming
+    
+    Parameters
+    ----------
+    exception: Exception
+        the error that ended the request, if any
+    
+    Returns
+    -------
+    none
+    '''
+    if 'request_start' in g:
+        app_metrics.observe('request.' + route_name(), time.perf_counter() - g.request_start)
+        app_metrics.observe('db.' + route_name(), g.db_time)
+
+@app.teardown_appcontext
+def release_db(exception):
+    '''Give the connection of the request back to the pool
+    
+    Parameters
+    ----------
+    exception: Exception
+        the error that ended the request, if any
+    
+    Returns
+    -------
+    none
+    '''
+    db = g.pop('db', None)
+    if db is not None:
+        pool.release(*db)
 
 @app.route('/')
 def home():
@@ -65,9 +787,48 @@ def home():
     name = 'supermovie'
     return render_template('home.html',name=name)
 
-@app.route('/movie_list', methods=['POST'])
+def movie_list_page(columns=None, sort='score', classification='All'):
+    '''One page of the movie list, filtered, sorted and positioned by the parameters of the request
+
+    Parameters
+    ----------
+    columns: list
+        the columns of the movies selected, see movie_list_query
+    sort: string
+        the sort when the request has none
+    classification: string
+        the type of the movies when the request has none
+
+    Returns
+    -------
+    tuple
+        in the form of (sort, rows, next_page), the rows as returned by movie_list_query and
+        next_page the parameters of the next page, None on the last page
+    '''
+    sort = request.values.get('sort', sort)
+    classification = request.values.get('classification', classification)
+    page_size = min(max(request.values.get('page_size', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    if sort not in SORTS:
+        abort(400)
+    try:
+        query, parameters = movie_list_query(sort, classification, page_size,
+                                             request.values.get('after'), request.values.get('after_id'), columns)
+    except ValueError:
+        # after/after_id that are not a sort key and an Id
+        abort(400)
+    result = get_db().execute(query, parameters).fetchall()
+
+    next_page = None
+    if len(result) > page_size:
+        result = result[:page_size]
+        next_page = {'sort': sort, 'classification': classification, 'page_size': page_size,
+                     'after': result[-1][-1], 'after_id': result[-1][-2]}
+    return sort, result, next_page
+
+@app.route('/movie_list', methods=['GET', 'POST'])
+@cached_page
 def movies():
-    '''the movie list page of the flask app
+    '''the movie list page of the flask app, one page of movies at a time
     
     Parameters
     ----------
@@ -77,40 +838,16 @@ def movies():
     -------
     none
     '''
-    conn = sqlite3.connect('super_movie.sqlite')
-    cur = conn.cursor()
-    get_movie_by_date = '''
-        SELECT name, classification, releasing_date FROM movies
-    '''
-    get_movie_by_score = '''
-        SELECT name, classification, score FROM movies ORDER BY score DESC
-    '''
-    sort = request.form['sort']
-    classification = request.form['classification']
-    if sort == 'date':
-        pre_result = cur.execute(get_movie_by_date).fetchall()
-        conn.close()
-        result = []
-        if classification == 'All':
-            result = pre_result
-        else:
-            for movie in pre_result:
-                if movie[1] == classification:
-                    result.append(movie)
-    elif sort == 'score':
-        pre_result = cur.execute(get_movie_by_score).fetchall()
-        conn.close()
-        result = []
-        if classification == 'All':
-            result = pre_result
-        else:
-            for movie in pre_result:
-                if movie[1] == classification:
-                    result.append(movie)
-
-    return render_template('movie_lists.html', sort=sort, result=result)
+    # the form always sends the sort and the type, unlike the JSON API
+    if 'sort' not in request.values or 'classification' not in request.values:
+        abort(400)
+    sort, result, next_page = movie_list_page()
+    if next_page is not None:
+        next_page = urlencode(next_page)
+    return render_template('movie_lists.html', sort=sort, result=result, next_page=next_page)
 
 @app.route('/movie_info', methods=['POST'])
+@cached_page
 def movie_info():
     '''the detailed information of a single movie of the flask app
     
@@ -123,20 +860,37 @@ def movie_info():
     none
     '''
     name = request.form['name'].strip()
-    conn = sqlite3.connect('super_movie.sqlite')
-    cur = conn.cursor()
+    cur = get_db().cursor()
     get_movie_info = '''
-        SELECT * FROM movies
+        SELECT * FROM movies WHERE name = ? ORDER BY Id DESC LIMIT 1
     '''
-    movies = cur.execute(get_movie_info).fetchall()
-    for movie in movies:
-        if movie[1] == name:
-            result = movie
-    conn.close()
+    result = cur.execute(get_movie_info, (name,)).fetchone()
+    if result is None:
+        abort(404)
+    credits = cur.execute('''
+        SELECT credit.role, person.name FROM credit
+        JOIN person ON person.Id = credit.person_id
+        WHERE credit.movie_id = ? ORDER BY credit.billing
+    ''', (result[0],)).fetchall()
+    other_movies = cur.execute('''
+        SELECT DISTINCT movies.name, movies.releasing_date FROM credit AS directed
+        JOIN credit AS other ON other.person_id = directed.person_id AND other.role = 'director'
+        JOIN movies ON movies.Id = other.movie_id
+        WHERE directed.movie_id = ? AND directed.role = 'director' AND other.movie_id != directed.movie_id
+        ORDER BY movies.releasing_date
+    ''', (result[0],)).fetchall()
+    director_films = cur.execute('''
+        SELECT filmography.film, filmography.score, filmography.release_date FROM credit
+        JOIN filmography ON filmography.person_id = credit.person_id
+        WHERE credit.movie_id = ? AND credit.role = 'director' ORDER BY filmography.position
+    ''', (result[0],)).fetchall()
 
-    return render_template('movie_info.html', result=result)
+    poster = local_image(result[10])
+    return render_template('movie_info.html', result=result, credits=credits, poster=poster,
+                           other_movies=other_movies, director_films=director_films)
 
 @app.route('/cast_info', methods=['POST'])
+@cached_page
 def cast_info():
     '''the detailed information of a single cast of the flask app
     
@@ -149,48 +903,461 @@ def cast_info():
     none
     '''
     name = request.form['name'].strip()
-    conn = sqlite3.connect('super_movie.sqlite')
-    cur = conn.cursor()
+    cur = get_db().cursor()
     get_cast_info = '''
-        SELECT * FROM casts
-    '''
-    casts = cur.execute(get_cast_info).fetchall()
-    result = None
-    for cast in casts:
-        if cast[1] == name:
-            result = cast
-    conn.close()
-    score_dict = {}
-    score_dict[convert_month(result[6])] = result[5]
-    score_dict[convert_month(result[9])] = result[8]
-    score_dict[convert_month(result[12])] = result[11]
-    score_dict[convert_month(result[15])] = result[14]
-    x_vals = []
-    if convert_month(result[6]) != '00000000':
-        x_vals.append(convert_month(result[6]))
-    if convert_month(result[9]) != '00000000':
-        x_vals.append(convert_month(result[9]))
-    if convert_month(result[12]) != '00000000':
-        x_vals.append(convert_month(result[12]))
-    if convert_month(result[15]) != '00000000':
-        x_vals.append(convert_month(result[15]))
-    x_vals.sort()
-    print (x_vals)
-    y_vals = []
-    for x in x_vals:
-        if (x == '0000/00/00'):
-            y_vals.append(0)
-        else:
-            y_vals.append(score_dict[x])
-    bars_data = go.Scatter(
-        x=x_vals,
-        y=y_vals
-    )
-    fig = go.Figure(data=bars_data)
-    div = fig.to_html(full_html=False)
-    return render_template('cast_info.html', result=result, plot_div = div)
+        SELECT Id, name, bio, photo FROM person WHERE name = ? ORDER BY Id DESC LIMIT 1
+    '''
+    result = cur.execute(get_cast_info, (name,)).fetchone()
+    if result is None:
+        abort(404)
+    movies = cur.execute('''
+        SELECT credit.role, movies.name FROM credit
+        JOIN movies ON movies.Id = credit.movie_id
+        WHERE credit.person_id = ? ORDER BY IFNULL(movies.releasing_date, '9999')
+    ''', (result[0],)).fetchall()
+    films = cur.execute('''
+        SELECT film, score, release_date FROM filmography WHERE person_id = ? ORDER BY position
+    ''', (result[0],)).fetchall()
+    co_stars = cur.execute('''
+        SELECT DISTINCT person.name FROM credit AS own
+        JOIN credit AS other ON other.movie_id = own.movie_id AND other.person_id != own.person_id
+        JOIN person ON person.Id = other.person_id
+        WHERE own.person_id = ? ORDER BY person.name
+    ''', (result[0],)).fetchall()
+    positions = sorted(set(movie[0] for movie in movies))
+    chart = score_chart(tuple(films))
+    return render_template('cast_info.html', result=result, positions=positions, movies=movies,
+                           films=films, co_stars=co_stars, chart=chart, photo=local_image(result[3]),
+                           plotly_version=plotly.__version__)
+
+@app.route('/search')
+@cached_page
+def search():
+    '''the search page of the flask app: the movies and casts whose name, description or
+    biography match the words searched, best match first
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    none
+    '''
+    text = request.args.get('q', '').strip()
+    expression = search_expression(text)
+    movies = []
+    casts = []
+    if expression is not None:
+        db = get_db()
+        movies = db.execute('''
+            SELECT movies.name, movies.classification FROM movies_fts
+            JOIN movies ON movies.Id = movies_fts.rowid
+            WHERE movies_fts MATCH ? ORDER BY bm25(movies_fts, ?, 1.0) LIMIT ?
+        ''', (expression, SEARCH_NAME_WEIGHT, SEARCH_RESULTS)).fetchall()
+        casts = db.execute('''
+            SELECT person.name, %s FROM person_fts
+            JOIN person ON person.Id = person_fts.rowid
+            WHERE person_fts MATCH ? ORDER BY bm25(person_fts, ?, 1.0) LIMIT ?
+        ''' % CAST_POSITION, (expression, SEARCH_NAME_WEIGHT, SEARCH_RESULTS)).fetchall()
+    return render_template('search.html', text=text, movies=movies, casts=casts)
+
+@app.route('/autocomplete')
+def autocomplete():
+    '''completions of a movie or cast name, as JSON
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    none
+    '''
+    name_type = request.args.get('type', 'all')
+    indexes = get_name_indexes()
+    if name_type not in indexes:
+        abort(400)
+    limit = min(max(request.args.get('limit', AUTOCOMPLETE_RESULTS, type=int), 1), AUTOCOMPLETE_RESULTS)
+    names = indexes[name_type].complete(request.args.get('q', ''), limit)
+    return jsonify([{'name': name, 'type': name_type, 'score': score} for name, name_type, score in names])
+
+def load_stats():
+    '''The statistics of the movies, read from the summary tables: a query reads at most a row
+    per classification, month or listed director, whatever the number of movies
+
+    Parameters
+    ----------
+    none
+
+    Returns
+    -------
+    dict
+        in the form of {'classifications': [group], 'months': [group], 'directors': [group]},
+        a group in the form of {'name', 'movies', 'scored', 'average'}, average being the
+        average score of the movies rated, None if none is
+    '''
+    db = get_db()
+    stats = {}
+    for name, query in STATS_QUERIES.items():
+        stats[name] = [{'name': group, 'movies': movies, 'scored': scored,
+                        'average': round(score_tenths / scored / 10, 2) if scored else None}
+                       for group, movies, scored, score_tenths in db.execute(query).fetchall()]
+    return stats
+
+@app.route('/stats')
+@cached_page
+def stats():
+    '''the statistics page of the flask app: movies and average score per type, release month
+    and director, as charts
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    none
+    '''
+    return render_template('stats.html', stats=load_stats(), plotly_version=plotly.__version__)
+
+@app.route('/api/stats')
+@api_view
+def api_stats():
+    '''the statistics of the movies as JSON, see load_stats
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    dict
+        in the form of {'classifications': [group], 'months': [group], 'directors': [group]}
+    '''
+    return load_stats()
+
+def local_image(image_url):
+    '''The urls a page shows a poster or a photo with: the thumbnail, linking to the full
+    image, when final_proj.py downloaded it, the image of IMDb otherwise
+
+    Parameters
+    ----------
+    image_url: string
+        the url of the image on IMDb, None if there is none
+
+    Returns
+    -------
+    dict
+        in the form of {'src': url shown, 'full': url of the full image}, None without image_url
+    '''
+    if image_url is None:
+        return None
+    row = get_db().execute('SELECT sha256, thumbnail FROM image WHERE url = ?', (image_url,)).fetchone()
+    if row is None:
+        return {'src': image_url, 'full': image_url}
+    full = '/images/' + row[0]
+    return {'src': full + '/thumbnail' if row[1] else full, 'full': full}
+
+def image_response(digest, path, mimetype):
+    '''Serve a file of the image store with long-lived cache headers, answering 404 when the
+    database has no such image
+
+    Parameters
+    ----------
+    digest: string
+        the sha256 of the image
+    path: string
+        the file served, the image or its thumbnail
+    mimetype: string
+        the type of the file, None to read it from the database
+
+    Returns
+    -------
+    flask.Response
+        the file
+    '''
+    row = None
+    if image_store.has(digest):
+        row = get_db().execute('SELECT content_type FROM image WHERE sha256 = ? LIMIT 1', (digest,)).fetchone()
+    if row is None or not os.path.exists(path):
+        abort(404)
+    response = send_file(os.path.abspath(path), mimetype=mimetype or row[0] or 'application/octet-stream',
+                         etag=digest, max_age=IMAGE_MAX_AGE, conditional=True)
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/images/<digest>')
+def image(digest):
+    '''a poster or a photo downloaded by final_proj.py
+    
+    Parameters
+    ----------
+    digest: string
+        the sha256 of the image
+    
+    Returns
+    -------
+    none
+    '''
+    return image_response(digest, image_store.path(digest), None)
+
+@app.route('/images/<digest>/thumbnail')
+def image_thumbnail(digest):
+    '''the thumbnail of a poster or a photo, the full image when it has no thumbnail
+    
+    Parameters
+    ----------
+    digest: string
+        the sha256 of the image
+    
+    Returns
+    -------
+    none
+    '''
+    if image_store.has(digest) and os.path.exists(image_store.thumbnail_path(digest)):
+        return image_response(digest, image_store.thumbnail_path(digest), 'image/jpeg')
+    return image_response(digest, image_store.path(digest), None)
+
+def select_by_id(table, columns, row_id):
+    '''Read a single row of a table, answering 404 when there is no such row
+
+    Parameters
+    ----------
+    table: string
+        'movies' or 'person'
+    columns: list
+        the columns selected
+    row_id: int
+        Id of the row
+
+    Returns
+    -------
+    tuple
+        the row
+    '''
+    row = get_db().execute('SELECT %s FROM "%s" WHERE Id = ?' % (', '.join(columns), table), (row_id,)).fetchone()
+    if row is None:
+        abort(404)
+    return row
+
+@app.route('/api/movies')
+@api_view
+def api_movies():
+    '''a page of the movies as JSON, with the parameters of /movie_list (sort, classification,
+    page_size, after and after_id), sorted by score and of every type by default
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    dict
+        in the form of {'movies': [movie], 'next': url of the next page or None}
+    '''
+    sort, result, next_page = movie_list_page(MOVIE_COLUMNS)
+    return {
+        'movies': [dict(zip(MOVIE_COLUMNS, row)) for row in result],
+        'next': '/api/movies?' + urlencode(next_page) if next_page is not None else None,
+    }
+
+@app.route('/api/movies/<int:movie_id>')
+@api_view
+def api_movie(movie_id):
+    '''a single movie as JSON
+    
+    Parameters
+    ----------
+    movie_id: int
+        Id of the movie
+    
+    Returns
+    -------
+    dict
+        the movie
+    '''
+    return dict(zip(MOVIE_COLUMNS, select_by_id('movies', MOVIE_COLUMNS, movie_id)))
+
+@app.route('/api/casts')
+@api_view
+def api_casts():
+    '''a page of the casts as JSON, one per person, in the order of their Id. A page starts
+    after the Id given by after_id, name only keeps the casts of that name
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    dict
+        in the form of {'casts': [cast], 'next': url of the next page or None}
+    '''
+    page_size = min(max(request.args.get('page_size', PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    conditions = ['person.Id > ?']
+    parameters = [request.args.get('after_id', 0, type=int)]
+    if 'name' in request.args:
+        conditions.append('person.name = ?')
+        parameters.append(request.args['name'].strip())
+    query = 'SELECT %s FROM person WHERE %s ORDER BY person.Id LIMIT ?' % (', '.join(CAST_SELECT), ' AND '.join(conditions))
+    result = get_db().execute(query, parameters + [page_size + 1]).fetchall()
+
+    next_page = None
+    if len(result) > page_size:
+        result = result[:page_size]
+        next_args = {'page_size': page_size, 'after_id': result[-1][0]}
+        if 'name' in request.args:
+            next_args['name'] = request.args['name']
+        next_page = '/api/casts?' + urlencode(next_args)
+    return {'casts': cast_records(get_db(), result), 'next': next_page}
+
+@app.route('/api/casts/<int:cast_id>')
+@api_view
+def api_cast(cast_id):
+    '''a single cast as JSON
+    
+    Parameters
+    ----------
+    cast_id: int
+        Id of the cast
+    
+    Returns
+    -------
+    dict
+        the cast
+    '''
+    return cast_records(get_db(), [select_by_id('person', CAST_SELECT, cast_id)])[0]
+
+@app.route('/api/casts/<int:cast_id>/filmography')
+@api_view
+def api_filmography(cast_id):
+    '''the films a cast is known for, as JSON
+    
+    Parameters
+    ----------
+    cast_id: int
+        Id of the cast
+    
+    Returns
+    -------
+    list
+        in the form of [{'film', 'score', 'date'}]
+    '''
+    return cast_records(get_db(), [select_by_id('person', CAST_SELECT, cast_id)])[0]['filmography']
+
+@app.route('/api/export/<table>.ndjson')
+def api_export(table):
+    '''every movie or cast, one JSON record per line. The rows are streamed from the cursor,
+    so the export runs in constant memory whatever the size of the database
+    
+    Parameters
+    ----------
+    table: string
+        'movies' or 'casts'
+    
+    Returns
+    -------
+    none
+    '''
+    if table == 'movies':
+        query = 'SELECT %s FROM movies ORDER BY Id' % ', '.join(MOVIE_COLUMNS)
+        records = lambda conn, rows: [dict(zip(MOVIE_COLUMNS, row)) for row in rows]
+    elif table == 'casts':
+        query = 'SELECT %s FROM person ORDER BY person.Id' % ', '.join(CAST_SELECT)
+        records = cast_records
+    else:
+        abort(404)
+    # held until the whole export is sent, after the request context is gone: released when
+    # the server closes the response, whether or not it was sent
+    conn, version = pool.acquire()
+    try:
+        etag = api_etag(version)
+        if request.if_none_match.contains_weak(etag):
+            pool.release(conn, version)
+            response = Response(status=304)
+            response.set_etag(etag, weak=True)
+            return response
+        compress = bool(request.accept_encodings['gzip'])
+
+        def generate():
+            compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if compress else None
+            cursor = conn.execute(query)
+            while True:
+                rows = cursor.fetchmany(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+                chunk = ''.join(json.dumps(record) + '\n' for record in records(conn, rows)).encode('utf-8')
+                yield compressor.compress(chunk) if compress else chunk
+            if compress:
+                yield compressor.flush()
+
+        response = Response(generate(), mimetype='application/x-ndjson')
+    except BaseException:
+        pool.release(conn, version)
+        raise
+    response.call_on_close(lambda: pool.release(conn, version))
+    if compress:
+        response.content_encoding = 'gzip'
+    response.set_etag(etag, weak=True)
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/plotly-<version>.min.js')
+def plotly_js(version):
+    '''the plotly.js library used by the charts, served with long-lived cache headers
+    
+    Parameters
+    ----------
+    version: string
+        version of plotly, part of the url so that an upgrade is never served from a stale cache
+    
+    Returns
+    -------
+    none
+    '''
+    if version != plotly.__version__:
+        abort(404)
+    response = Response(get_plotlyjs(), mimetype='application/javascript')
+    response.set_etag(plotly.__version__)
+    response.cache_control.public = True
+    response.cache_control.max_age = PLOTLY_JS_MAX_AGE
+    response.cache_control.immutable = True
+    return response.make_conditional(request)
+
+@app.route('/cache_stats')
+def cache_stats():
+    '''hit/miss counters of the response cache, as JSON
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    none
+    '''
+    return jsonify(response_cache.stats())
+
+@app.route('/metrics')
+def metrics():
+    '''latency and database time of every route, response counts and response cache counters, as JSON
+    
+    Parameters
+    ----------
+    none
+    
+    Returns
+    -------
+    none
+    '''
+    snapshot = app_metrics.snapshot()
+    snapshot['response_cache'] = response_cache.stats()
+    return jsonify(snapshot)
 
 if __name__ == '__main__':
     print ('starting Flask app', app.name)
+    get_name_indexes()
     app.run(debug=True)
 
@@ -0,0 +1,64 @@
+import os
+import sys
+import pytest
+
+# the modules of the project are at the top of the repository
+REPOSITORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPOSITORY)
+
+import supermovie_flask
+
+# the database shipped with the repository
+DB_FILENAME = os.path.join(REPOSITORY, supermovie_flask.DB_FILENAME)
+
+@pytest.fixture
+def client():
+    '''test client of the flask app, serving the database of the repository'''
+    supermovie_flask.pool.filename = DB_FILENAME
+    supermovie_flask.response_cache.clear()
+    return supermovie_flask.app.test_client()
+
+import final_proj
+
+def make_movie(i, **changes):
+    '''a movie instance as scraped by the crawl, directed by person i and starring person i + 1000'''
+    fields = {
+        'name': 'Movie %d' % i,
+        'director': 'Person %d' % i,
+        'director_url': 'https://www.imdb.com/name/nm%07d/?ref_=tt_ov_dr' % i,
+        'stars': ['Person %d' % (i + 1000)],
+        'stars_url_dict': {'Person %d' % (i + 1000): 'https://www.imdb.com/name/nm%07d/?ref_=tt_ov_st' % (i + 1000)},
+        'releasing_date': '%02d March 2021' % (i % 28 + 1),
+        'score': '%.1f' % (5 + i % 50 / 10),
+        'classification': ['Drama', 'Action', 'Comedy'][i % 3],
+        'description': 'The story of movie %d' % i,
+        'poster_url': None,
+        'url': 'https://www.imdb.com/title/tt%07d/?ref_=rlm' % i,
+    }
+    fields.update(changes)
+    return final_proj.Movies(**fields)
+
+def make_cast(i, **changes):
+    '''a cast instance with its score attribute, person i known for movie i'''
+    fields = {
+        'position': 'director' if i < 1000 else 'star',
+        'name': 'Person %d' % i,
+        'bio': 'The life of person %d' % i,
+        'films': {'Movie %d' % (i % 1000): 'https://www.imdb.com/title/tt%07d/' % (i % 1000)},
+        'score': {'Movie %d' % (i % 1000): ['7.5', '01 March 2021']},
+        'photo': None,
+        'url': 'https://www.imdb.com/name/nm%07d/' % i,
+    }
+    fields.update(changes)
+    return final_proj.Cast(**fields)
+
+@pytest.fixture
+def build_dir(tmp_path, monkeypatch):
+    '''runs the builds in tmp_path, with their own crawl cache and without downloading images'''
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(final_proj, 'cache_store', None)
+    monkeypatch.setattr(final_proj, 'page_archive', None)
+    monkeypatch.setattr(final_proj, 'FETCH_IMAGES', False)
+    yield tmp_path
+    if final_proj.cache_store is not None:
+        final_proj.cache_store.close()
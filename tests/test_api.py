@@ -0,0 +1,81 @@
+import html
+import json
+import sqlite3
+from urllib.parse import urlencode
+import pytest
+import supermovie_flask
+from conftest import DB_FILENAME
+
+@pytest.mark.parametrize('sort', ['score', 'date'])
+def test_api_movies_match_api_movie(client, sort):
+    '''every field of a movie of /api/movies is the one of /api/movies/<id>, on every page'''
+    url = '/api/movies?sort=%s&page_size=7' % sort
+    pages = 0
+    while url is not None and pages < 3:
+        response = client.get(url)
+        assert response.status_code == 200
+        page = response.get_json()
+        assert page['movies']
+        for movie in page['movies']:
+            assert list(movie) == supermovie_flask.MOVIE_COLUMNS
+            assert movie == client.get('/api/movies/%d' % movie['Id']).get_json()
+        url = page['next']
+        pages += 1
+
+def test_api_casts_are_the_people(client):
+    '''/api/casts lists every person once, under the Id of the person table'''
+    conn = sqlite3.connect(DB_FILENAME)
+    people = dict(conn.execute('SELECT Id, name FROM person'))
+    casts = []
+    url = '/api/casts?page_size=100'
+    while url is not None:
+        page = client.get(url).get_json()
+        casts.extend(page['casts'])
+        url = page['next']
+    assert {cast['Id']: cast['name'] for cast in casts} == people
+    assert len(casts) == len(people)
+
+    cast = casts[0]
+    assert list(cast) == supermovie_flask.CAST_COLUMNS + ['filmography']
+    assert client.get('/api/casts/%d' % cast['Id']).get_json() == cast
+    films = conn.execute('SELECT film FROM filmography WHERE person_id = ? ORDER BY position', (cast['Id'],)).fetchall()
+    filmography = client.get('/api/casts/%d/filmography' % cast['Id']).get_json()
+    assert [film['film'] for film in filmography] == [film for (film,) in films]
+
+    lines = client.get('/api/export/casts.ndjson').get_data(as_text=True).splitlines()
+    assert [json.loads(line) for line in lines] == casts
+
+def test_search_finds_a_person_once(client):
+    '''a person matched by /search is listed once, whatever the number of their credits'''
+    name = sqlite3.connect(DB_FILENAME).execute('''
+        SELECT person.name FROM person JOIN credit ON credit.person_id = person.Id
+        GROUP BY person.Id HAVING COUNT(*) > 1 LIMIT 1''').fetchone()[0]
+    page = client.get('/search', query_string={'q': name}).get_data(as_text=True)
+    casts = page[page.index('/cast_info'):]
+    assert casts.count('type="hidden" value="%s"' % html.escape(name)) == 1
+
+def expected_order(conn, sort, classification):
+    '''the Ids of the movies in the order of the movie list, sorted in python'''
+    column = {'score': 'score', 'date': 'releasing_date'}[sort]
+    rows = conn.execute('SELECT Id, %s, classification FROM movies' % column).fetchall()
+    rows = [row for row in rows if classification in ('All', row[2])]
+    if sort == 'score':
+        rows.sort(key=lambda row: (-1 if row[1] is None else row[1], row[0]), reverse=True)
+    else:
+        rows.sort(key=lambda row: ('9999' if row[1] is None else row[1], row[0]))
+    return [row[0] for row in rows]
+
+@pytest.mark.parametrize('sort', ['score', 'date'])
+def test_api_movies_pages_follow_each_other(client, sort):
+    '''walking the pages lists every movie of the classification once, in order'''
+    conn = sqlite3.connect(DB_FILENAME)
+    classifications = [row[0] for row in conn.execute('SELECT DISTINCT classification FROM movies')]
+    for classification in ['All'] + classifications:
+        ids = []
+        url = '/api/movies?' + urlencode({'sort': sort, 'classification': classification, 'page_size': 3})
+        while url is not None:
+            page = client.get(url).get_json()
+            assert len(page['movies']) <= 3
+            ids.extend(movie['Id'] for movie in page['movies'])
+            url = page['next']
+        assert ids == expected_order(conn, sort, classification), classification
@@ -0,0 +1,69 @@
+import tarfile
+import pytest
+import benchmark
+import final_proj
+from page_archive import PageArchive
+
+@pytest.fixture
+def page_server(tmp_path):
+    '''serves a movie page of the benchmark corpus from a local server'''
+    served = tmp_path / 'served'
+    with tarfile.open(benchmark.CORPUS_FILENAME) as corpus:
+        corpus.extract(corpus.getmember('./title/tt0000001/index.html'), served)
+    server = benchmark.serve_corpus(str(served))
+    yield 'http://127.0.0.1:%d' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+def test_fetch_from_archive_whatever_the_query_string(build_dir, monkeypatch, page_server):
+    '''a page archived when reached from one link is read back when reached from another'''
+    page_url = page_server + '/title/tt0000001/'
+    response = final_proj.fetch_page(page_url + '?ref_=nm_knf_t1')
+    monkeypatch.setattr(final_proj, 'FROM_ARCHIVE', True)
+    page = final_proj.fetch_page(page_url + '?ref_=tt_ov_dr')
+    assert page.text == response.text
+    with pytest.raises(LookupError):
+        final_proj.fetch_page(page_server + '/title/tt0000002/?ref_=tt_ov_dr')
+    final_proj.get_page_archive().close()
+
+def test_movie_score_cached_whatever_the_query_string(build_dir, page_server):
+    page_url = page_server + '/title/tt0000001/'
+    before = benchmark.CorpusHandler.pages
+    first = final_proj.get_movie_score(page_url + '?ref_=nm_knf_t1')
+    second = final_proj.get_movie_score(page_url + '?ref_=nm_knf_t2')
+    assert first == second
+    assert first[0]
+    assert benchmark.CorpusHandler.pages - before == 1
+    final_proj.get_page_archive().close()
+
+def test_archive_keeps_the_last_version(tmp_path):
+    archive = PageArchive(str(tmp_path / 'pages.dat'), str(tmp_path / 'pages.idx'))
+    archive.append('https://www.imdb.com/title/tt0000001/', 'first', fetched_at=1.0)
+    archive.append('https://www.imdb.com/title/tt0000002/', 'other', fetched_at=2.0)
+    archive.append('https://www.imdb.com/title/tt0000001/', 'second', fetched_at=3.0)
+    assert archive.get('https://www.imdb.com/title/tt0000001/').text == 'second'
+    assert archive.get('https://www.imdb.com/title/tt0000003/') is None
+    archive.close()
+    archive = PageArchive(str(tmp_path / 'pages.dat'), str(tmp_path / 'pages.idx'))
+    page = archive.get('https://www.imdb.com/title/tt0000001/')
+    assert (page.text, page.fetched_at) == ('second', 3.0)
+    assert archive.get('https://www.imdb.com/title/tt0000002/').text == 'other'
+    archive.close()
+
+def test_archive_recovers_after_a_crash(tmp_path):
+    '''a record without its index entry is indexed, a half-written one is dropped'''
+    data_filename, index_filename = str(tmp_path / 'pages.dat'), str(tmp_path / 'pages.idx')
+    archive = PageArchive(data_filename, index_filename)
+    archive.append('https://www.imdb.com/title/tt0000001/', 'first')
+    archive.append('https://www.imdb.com/title/tt0000002/', 'second')
+    archive.close()
+    with open(index_filename, 'r+b') as index_file:
+        index_file.truncate(index_file.seek(0, 2) - 10)
+    with open(data_filename, 'ab') as data_file:
+        data_file.write(b'PAGE and half a record')
+    archive = PageArchive(data_filename, index_filename)
+    assert archive.get('https://www.imdb.com/title/tt0000001/').text == 'first'
+    assert archive.get('https://www.imdb.com/title/tt0000002/').text == 'second'
+    archive.append('https://www.imdb.com/title/tt0000003/', 'third')
+    assert archive.get('https://www.imdb.com/title/tt0000003/').text == 'third'
+    archive.close()
@@ -0,0 +1,42 @@
+import random
+import pytest
+from supermovie_flask import AUTOCOMPLETE_RESULTS, NameIndex, normalize_name
+
+def brute_force(index, prefix):
+    '''the names of the index with a word starting with the prefix, best first'''
+    prefix = normalize_name(prefix)
+    matches = []
+    for entry in index.names:
+        words = normalize_name(entry[0]).split(' ')
+        if any(' '.join(words[i:]).startswith(prefix) for i in range(len(words))):
+            matches.append(entry)
+    return matches[:AUTOCOMPLETE_RESULTS]
+
+def test_complete_best_first():
+    index = NameIndex([('Tom Hanks', 'cast', 9.0), ('Tom Tomkins', 'cast', 5.0), ('Tomas Tomas', 'movie', 8.0),
+                       ('Tom Hanks', 'cast', 7.0), ('Nobody', 'movie', None)])
+    assert index.complete('tom') == [('Tom Hanks', 'cast', 9.0), ('Tomas Tomas', 'movie', 8.0), ('Tom Tomkins', 'cast', 5.0)]
+    assert index.complete('  HAN') == [('Tom Hanks', 'cast', 9.0)]
+    assert index.complete('tomas') == [('Tomas Tomas', 'movie', 8.0)]
+    assert index.complete('tom', limit=1) == [('Tom Hanks', 'cast', 9.0)]
+    assert index.complete('') == []
+    assert index.complete('zzzz') == []
+
+@pytest.mark.parametrize('prefix', ['a', 'al', 'alp', 'alpa', 'alph', 'alpine', 'bet', 'beta al', 'x'])
+def test_complete_matches_brute_force(prefix):
+    '''short prefixes are answered from the precomputed completions, longer ones from the
+    sorted keys, with names listed under several keys of the range counted once'''
+    rnd = random.Random(prefix)
+    words = ['alpha', 'alpine', 'alps', 'alpaca', 'alpal', 'beta', 'bet']
+    names = [(' '.join(rnd.choice(words) for j in range(rnd.randint(1, 3))) + ' %d' % i, 'movie', rnd.random() * 10)
+             for i in range(2000)]
+    index = NameIndex(names)
+    assert index.complete(prefix) == brute_force(index, prefix)
+
+def test_autocomplete_route(client):
+    response = client.get('/autocomplete', query_string={'q': 'the', 'type': 'movie', 'limit': 3})
+    assert response.status_code == 200
+    names = response.get_json()
+    assert 0 < len(names) <= 3
+    assert all(name['type'] == 'movie' for name in names)
+    assert client.get('/autocomplete', query_string={'q': 'the', 'type': 'nothing'}).status_code == 400
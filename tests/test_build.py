@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import time
+import pytest
+import final_proj
+from conftest import make_cast, make_movie
+
+def items(num_of_movies=20):
+    movies = [make_movie(i) for i in range(num_of_movies)]
+    casts = [make_cast(i) for i in range(num_of_movies)] + [make_cast(i + 1000) for i in range(num_of_movies)]
+    return movies + casts
+
+def movie_names(db_filename):
+    conn = sqlite3.connect(db_filename)
+    names = [row[0] for row in conn.execute('SELECT name FROM movies ORDER BY name')]
+    conn.close()
+    return names
+
+def test_build_swaps_in_the_database(build_dir):
+    counts = final_proj.stream_database(items(), db_filename='movies.sqlite', batch_size=7)
+    assert counts['movies']['inserted'] == 20
+    assert counts['casts']['inserted'] == 40
+    assert len(movie_names('movies.sqlite')) == 20
+    assert not os.path.exists('movies.sqlite.staging')
+    conn = sqlite3.connect('movies.sqlite')
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == final_proj.SCHEMA_VERSION
+    assert conn.execute('SELECT COUNT(*) FROM credit').fetchone()[0] == 40
+    conn.close()
+
+def failing(items):
+    yield from items[:10]
+    raise RuntimeError('the crawl failed')
+
+def test_failed_crawl_keeps_the_database(build_dir):
+    final_proj.stream_database(items(5), db_filename='movies.sqlite')
+    before = movie_names('movies.sqlite')
+    with pytest.raises(RuntimeError):
+        final_proj.stream_database(failing(items()), db_filename='movies.sqlite', batch_size=3)
+    assert movie_names('movies.sqlite') == before
+    assert not os.path.exists('movies.sqlite.staging')
+
+def test_failed_finish_keeps_the_database(build_dir, monkeypatch):
+    final_proj.stream_database(items(5), db_filename='movies.sqlite')
+    before = movie_names('movies.sqlite')
+    def fail(cur, rebuild):
+        raise sqlite3.OperationalError('the summary tables failed')
+    monkeypatch.setattr(final_proj, 'build_aggregate_tables', fail)
+    with pytest.raises(sqlite3.OperationalError):
+        final_proj.stream_database(items(), db_filename='movies.sqlite')
+    assert movie_names('movies.sqlite') == before
+    assert not os.path.exists('movies.sqlite.staging')
+
+def test_load_time_leaves_out_the_crawl(build_dir):
+    '''the time spent waiting for the movies and casts is not counted as load time'''
+    writer = final_proj.DatabaseWriter(db_filename='movies.sqlite', batch_size=4)
+    for item in items(4):
+        time.sleep(0.05)
+        writer.add(item)
+    writer.finish()
+    assert writer.write_seconds < 0.05 * 12 / 2
+
+def test_incremental_build_writes_only_the_changes(build_dir):
+    final_proj.stream_database(items(), db_filename='movies.sqlite')
+    conn = sqlite3.connect('movies.sqlite')
+    ids = dict(conn.execute('SELECT name, Id FROM movies'))
+    conn.close()
+
+    movies = [make_movie(i, score='9.9') if i == 3 else make_movie(i) for i in range(1, 21)]
+    casts = [make_cast(i) for i in range(20)] + [make_cast(i + 1000) for i in range(20)]
+    counts = final_proj.stream_database(movies + casts, incremental=True, db_filename='movies.sqlite', batch_size=7)
+    assert counts['movies'] == {'inserted': 1, 'updated': 1, 'unchanged': 18, 'deleted': 1}
+    assert counts['casts'] == {'inserted': 0, 'updated': 0, 'unchanged': 40, 'deleted': 0}
+
+    conn = sqlite3.connect('movies.sqlite')
+    assert conn.execute('SELECT score FROM movies WHERE name = ?', ('Movie 3',)).fetchone()[0] == 9.9
+    after = dict(conn.execute('SELECT name, Id FROM movies'))
+    conn.close()
+    assert 'Movie 0' not in after and 'Movie 20' in after
+    assert all(after[name] == ids[name] for name in ids if name in after)
+
+def incremental_changes():
+    '''the items of a second crawl: movie 0 and its people gone, movie 20 and its people new,
+    the description of movie 3 and the bio of person 5 changed'''
+    movies = [make_movie(i, description='A heist in Lisbon') if i == 3 else make_movie(i) for i in range(1, 21)]
+    casts = [make_cast(i, bio='Born in Lisbon') if i == 5 else make_cast(i) for i in range(1, 21)]
+    return movies + casts + [make_cast(i + 1000) for i in range(1, 21)]
+
+def search(conn, table, words):
+    return [row[0] for row in conn.execute('''
+        SELECT {0}.name FROM {0}_fts JOIN {0} ON {0}.Id = {0}_fts.rowid
+        WHERE {0}_fts MATCH ? ORDER BY {0}.name'''.format(table), (words,))]
+
+def test_search_indexes_follow_an_incremental_build(build_dir):
+    final_proj.stream_database(items(), db_filename='movies.sqlite')
+    final_proj.stream_database(incremental_changes(), incremental=True, db_filename='movies.sqlite', batch_size=7)
+    conn = sqlite3.connect('movies.sqlite')
+    for table in ['movies', 'person']:
+        conn.execute("INSERT INTO {0}_fts ({0}_fts) VALUES ('integrity-check')".format(table))
+        assert (conn.execute('SELECT COUNT(*) FROM %s_fts_docsize' % table).fetchone()[0] ==
+                conn.execute('SELECT COUNT(*) FROM %s' % table).fetchone()[0])
+    assert search(conn, 'movies', 'lisbon') == ['Movie 3']
+    assert search(conn, 'movies', 'story 3') == []
+    assert search(conn, 'movies', 'story 20') == ['Movie 20']
+    assert search(conn, 'movies', 'story 0') == []
+    assert search(conn, 'person', 'lisbon') == ['Person 5']
+    assert search(conn, 'person', 'life 0') == []
+    conn.close()
+
+def summarize(conn, expression):
+    '''the rows of a summary table, computed from the movies'''
+    groups = {}
+    for group, score in conn.execute('SELECT %s, score FROM movies' % expression.format('movies')):
+        if group is not None:
+            movies, scored, score_tenths = groups.get(group, (0, 0, 0))
+            score = score or 0
+            groups[group] = (movies + 1, scored + (score > 0), score_tenths + round(score * 10))
+    return sorted((group,) + counts for group, counts in groups.items())
+
+def test_summary_tables_follow_an_incremental_build(build_dir):
+    final_proj.stream_database(items(), db_filename='movies.sqlite')
+    changes = {3: {'score': '9.9'}, 4: {'classification': 'Horror'}, 5: {'releasing_date': '02 April 2021'},
+               6: {'score': ''}, 7: {'director': 'Person 8'}}
+    movies = [make_movie(i, **changes.get(i, {})) for i in range(1, 21)]
+    casts = [make_cast(i) for i in range(1, 21)] + [make_cast(i + 1000) for i in range(1, 21)]
+    final_proj.stream_database(movies + casts, incremental=True, db_filename='movies.sqlite', batch_size=7)
+    conn = sqlite3.connect('movies.sqlite')
+    for table, key, expression in final_proj.AGGREGATE_TABLES:
+        assert conn.execute('SELECT * FROM %s ORDER BY 1' % table).fetchall() == summarize(conn, expression), table
+    assert conn.execute("SELECT movies FROM director_stats WHERE director = 'Person 8'").fetchone()[0] == 2
+    assert conn.execute("SELECT * FROM director_stats WHERE director = 'Person 0'").fetchall() == []
+    conn.close()
@@ -0,0 +1,55 @@
+import json
+import cache_store
+from cache_store import CacheStore
+
+def test_entries_are_kept_in_the_order_first_written(tmp_path, monkeypatch):
+    '''scan reads the namespace a chunk at a time, in the order the entries were first written'''
+    monkeypatch.setattr(cache_store, 'SCAN_CHUNK_SIZE', 3)
+    store = CacheStore(str(tmp_path / 'cache.sqlite'))
+    for i in range(7):
+        store.set('movie.json', 'url%d' % i, [i])
+    store.update('movie.json', {'url2': ['changed'], 'url7': [7]})
+    store.set('cast.json', 'url0', {'name': 'someone'})
+    store.close()
+
+    store = CacheStore(str(tmp_path / 'cache.sqlite'))
+    movies = store.open('movie.json')
+    assert list(movies.items()) == [('url%d' % i, ['changed'] if i == 2 else [i]) for i in range(8)]
+    assert movies['url3'] == [3]
+    assert 'url8' not in movies
+    assert movies.get('url8', []) == []
+    assert store.open('cast.json').get('url0') == {'name': 'someone'}
+
+    store.replace('movie.json', {'url9': [9]})
+    assert list(movies.items()) == [('url9', [9])]
+    assert store.get('cast.json', 'url0') == {'name': 'someone'}
+    store.close()
+
+def test_json_cache_file_migrated_once(tmp_path, monkeypatch, capsys):
+    '''the JSON file of a namespace is imported the first time the empty namespace is opened'''
+    monkeypatch.chdir(tmp_path)
+    with open('movie.json', 'w') as cache_file:
+        json.dump({'url1': [1], 'url2': [2]}, cache_file)
+    store = CacheStore('cache.sqlite')
+    assert dict(store.open('movie.json').items()) == {'url1': [1], 'url2': [2]}
+    assert 'Migrated 2 entries from movie.json' in capsys.readouterr().out
+    store.close()
+
+    with open('movie.json', 'w') as cache_file:
+        json.dump({'url3': [3]}, cache_file)
+    store = CacheStore('cache.sqlite')
+    assert dict(store.open('movie.json').items()) == {'url1': [1], 'url2': [2]}
+    store.close()
+
+def test_json_cache_file_skipped_when_not_a_readable_file(tmp_path, monkeypatch, capsys):
+    '''a directory, or a file that is not JSON, of the name of a namespace leaves it empty'''
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'movie.json').mkdir()
+    (tmp_path / 'cast.json').write_text('{"url1": [1')
+    store = CacheStore('cache.sqlite')
+    assert not store.open('movie.json')
+    assert not store.open('cast.json')
+    assert 'Ignoring unreadable cache file cast.json' in capsys.readouterr().out
+    store.set('cast.json', 'url1', [1])
+    assert store.open('cast.json')
+    store.close()
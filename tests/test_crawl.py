@@ -0,0 +1,87 @@
+import re
+import threading
+import time
+import tarfile
+import pytest
+import benchmark
+import final_proj
+
+@pytest.fixture
+def corpus_dir(tmp_path):
+    corpus_dir = tmp_path / 'corpus'
+    with tarfile.open(benchmark.CORPUS_FILENAME) as corpus:
+        corpus.extractall(corpus_dir)
+    return corpus_dir
+
+@pytest.fixture
+def crawl_in(tmp_path, monkeypatch):
+    '''runs the crawl against a local server of a corpus, with its cache and archive in tmp_path'''
+    servers = {}
+    def crawl_in(corpus_dir, workers=4, directory='.'):
+        if corpus_dir not in servers:
+            servers[corpus_dir] = benchmark.serve_corpus(str(corpus_dir))
+        server = servers[corpus_dir]
+        base_url = 'http://127.0.0.1:%d' % server.server_address[1]
+        (tmp_path / directory).mkdir(exist_ok=True)
+        monkeypatch.chdir(tmp_path / directory)
+        monkeypatch.setattr(final_proj, 'base_url', base_url)
+        monkeypatch.setattr(final_proj, 'url', base_url + '/calendar/')
+        monkeypatch.setattr(final_proj, 'cache_store', None)
+        monkeypatch.setattr(final_proj, 'page_archive', None)
+        try:
+            return final_proj.scrape_info(workers, progress_interval=0)
+        finally:
+            final_proj.get_cache_store().close()
+            final_proj.get_page_archive().close()
+    yield crawl_in
+    for server in servers.values():
+        server.shutdown()
+        server.server_close()
+
+def test_crawl_movie_without_director(corpus_dir, crawl_in):
+    '''a movie page without a director link is scraped, and the rest of the crawl goes on'''
+    movie_page = corpus_dir / 'title' / 'tt0000001' / 'index.html'
+    text = movie_page.read_text()
+    text, replaced = re.subn(r'(<h4>Director:</h4>)<a href="[^"]*">([^<]*)</a>', r'\1\2', text, count=1)
+    assert replaced == 1
+    movie_page.write_text(text)
+
+    movie_list, cast_list = crawl_in(corpus_dir)
+    movie = [movie for movie in movie_list if '/title/tt0000001/' in movie.url]
+    assert len(movie) == 1
+    assert movie[0].director_url is None
+    assert len(movie_list) > 1
+    assert cast_list
+
+def test_concurrent_crawl_matches_sequential_crawl(corpus_dir, crawl_in, monkeypatch):
+    '''the crawl fetches every page once, at most workers at a time, and scrapes the same
+    movies and casts as a crawl fetching one page after another'''
+    in_flight = [0, 0]
+    lock = threading.Lock()
+    do_get = benchmark.CorpusHandler.do_GET
+    def counting_do_get(handler):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight)
+        try:
+            # long enough for the other workers to send their requests meanwhile
+            time.sleep(0.002)
+            do_get(handler)
+        finally:
+            with lock:
+                in_flight[0] -= 1
+    monkeypatch.setattr(benchmark.CorpusHandler, 'do_GET', counting_do_get)
+
+    before = benchmark.CorpusHandler.pages
+    sequential = crawl_in(corpus_dir, 1, 'sequential')
+    pages = benchmark.CorpusHandler.pages - before
+    assert in_flight[1] == 1
+    in_flight[1] = 0
+    before = benchmark.CorpusHandler.pages
+    concurrent = crawl_in(corpus_dir, 4, 'concurrent')
+    assert benchmark.CorpusHandler.pages - before == pages
+    assert 1 < in_flight[1] <= 4
+
+    for sequential_list, concurrent_list in zip(sequential, concurrent):
+        assert [vars(item) for item in concurrent_list] == [vars(item) for item in sequential_list]
+    assert len(sequential[0]) > 1 and sequential[1]
@@ -0,0 +1,75 @@
+import io
+import sqlite3
+import pytest
+import benchmark
+import final_proj
+import supermovie_flask
+from image_store import ImageStore
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+def image_bytes(color):
+    if Image is None:
+        return ('not an image ' + color).encode('utf-8')
+    output = io.BytesIO()
+    Image.new('RGB', (300, 450), color).save(output, 'PNG')
+    return output.getvalue()
+
+@pytest.fixture
+def image_server(tmp_path):
+    '''serves two posters, one under two urls, from a local server'''
+    served = tmp_path / 'served'
+    served.mkdir()
+    (served / 'red.png').write_bytes(image_bytes('red'))
+    (served / 'red_again.png').write_bytes(image_bytes('red'))
+    (served / 'blue.png').write_bytes(image_bytes('blue'))
+    server = benchmark.serve_corpus(str(served))
+    yield 'http://127.0.0.1:%d/' % server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+def test_build_image_table(tmp_path, monkeypatch, image_server):
+    '''the images are downloaded once, kept once per content and served by the flask app, with
+    the images directory already there, as an earlier build leaves it'''
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / final_proj.IMAGE_DIRECTORY).mkdir()
+    store = ImageStore(final_proj.IMAGE_DIRECTORY)
+    monkeypatch.setattr(final_proj, 'cache_store', None)
+    monkeypatch.setattr(final_proj, 'image_store', store)
+    monkeypatch.setattr(final_proj, 'FETCH_IMAGES', True)
+    urls = [image_server + name for name in ['red.png', 'red_again.png', 'blue.png', 'missing.png']]
+
+    conn = sqlite3.connect('movies.sqlite')
+    cur = conn.cursor()
+    cur.execute('CREATE TABLE movies (poster_url TEXT)')
+    cur.execute('CREATE TABLE person (photo TEXT)')
+    cur.executemany('INSERT INTO movies VALUES (?)', [(url,) for url in urls[:2]])
+    cur.executemany('INSERT INTO person VALUES (?)', [(url,) for url in urls[2:]])
+    final_proj.build_image_table(cur, 2)
+    # the second build finds every image in the cache
+    final_proj.build_image_table(cur, 2)
+    conn.commit()
+    rows = dict((row[0], row[1:]) for row in cur.execute('SELECT url, sha256, thumbnail FROM image'))
+    conn.close()
+    final_proj.get_cache_store().close()
+
+    assert sorted(rows) == sorted(urls[:3])
+    assert rows[urls[0]] == rows[urls[1]] != rows[urls[2]]
+    assert all(thumbnail == (Image is not None) for digest, thumbnail in rows.values())
+
+    monkeypatch.setattr(supermovie_flask.pool, 'filename', str(tmp_path / 'movies.sqlite'))
+    monkeypatch.setattr(supermovie_flask, 'image_store', store)
+    client = supermovie_flask.app.test_client()
+    digest = rows[urls[0]][0]
+    response = client.get('/images/' + digest)
+    assert response.status_code == 200
+    assert response.get_data() == image_bytes('red')
+    assert response.cache_control.immutable
+    response = client.get('/images/%s/thumbnail' % digest)
+    assert response.status_code == 200
+    if Image is not None:
+        assert response.mimetype == 'image/jpeg'
+    assert client.get('/images/' + '0' * 64).status_code == 404
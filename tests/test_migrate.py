@@ -0,0 +1,62 @@
+import sqlite3
+import final_proj
+
+# the tables as the first version of final_proj.py created them
+create_old_movies = '''
+    CREATE TABLE "movies" (
+        "Id" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, "name" TEXT, "director" TEXT, "star1" TEXT,
+        "star2" TEXT, "star3" TEXT, "releasing_date" TEXT, "score" TEXT, "classification" TEXT,
+        "description" TEXT, "poster_url" TEXT
+    );
+'''
+
+create_old_casts = '''
+    CREATE TABLE "casts" (
+        "Id" INTEGER PRIMARY KEY AUTOINCREMENT UNIQUE, "name" TEXT, "position" TEXT, "bio" TEXT,
+        "film1" TEXT, "score1" TEXT, "date1" TEXT, "film2" TEXT, "score2" TEXT, "date2" TEXT,
+        "film3" TEXT, "score3" TEXT, "date3" TEXT, "film4" TEXT, "score4" TEXT, "date4" TEXT, "photo" TEXT
+    );
+'''
+
+def make_old_database(db_filename):
+    conn = sqlite3.connect(db_filename)
+    conn.execute(create_old_movies)
+    conn.execute(create_old_casts)
+    conn.executemany('INSERT INTO movies VALUES (?,?,?,?,?,?,?,?,?,?,?)', [
+        (3, 'Movie A', 'Jane Doe', 'John Roe', None, None, '05 March 2021', '7.5', 'Drama', 'a drama', None),
+        (8, 'Movie B', 'Jane Doe', 'John Roe', None, None, '12 April 2021', '', 'Action', 'no score yet', None),
+    ])
+    old_film = ['Old Film', '6.5', '01 May 2019']
+    no_film = ['-', '-', '-']
+    conn.executemany('INSERT INTO casts VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)', [
+        # a row per credit: Jane Doe directed both movies
+        (1, 'Jane Doe', 'director', 'a director', *old_film, *no_film * 3, None),
+        (2, 'Jane Doe', 'director', 'a director', *old_film, *no_film * 3, None),
+        (3, 'John Roe', 'star', 'an actor', *no_film * 4, None),
+    ])
+    conn.commit()
+    conn.close()
+
+def test_migrate_old_database(tmp_path):
+    db_filename = str(tmp_path / 'old.sqlite')
+    make_old_database(db_filename)
+    assert final_proj.migrate_database(db_filename)
+    assert not final_proj.migrate_database(db_filename)
+
+    conn = sqlite3.connect(db_filename)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == final_proj.SCHEMA_VERSION
+    assert conn.execute('SELECT Id, releasing_date, score FROM movies ORDER BY Id').fetchall() == [
+        (3, '2021-03-05', 7.5), (8, '2021-04-12', None)]
+    assert conn.execute('SELECT name FROM person ORDER BY name').fetchall() == [('Jane Doe',), ('John Roe',)]
+    assert conn.execute('''
+        SELECT movies.name, person.name, credit.role FROM credit
+        JOIN movies ON movies.Id = credit.movie_id JOIN person ON person.Id = credit.person_id
+        ORDER BY movies.name, credit.billing''').fetchall() == [
+        ('Movie A', 'Jane Doe', 'director'), ('Movie A', 'John Roe', 'star'),
+        ('Movie B', 'Jane Doe', 'director'), ('Movie B', 'John Roe', 'star')]
+    assert conn.execute('SELECT film, score, release_date FROM filmography').fetchall() == [
+        ('Old Film', 6.5, '2019-05-01')]
+    assert conn.execute("SELECT person.name FROM person JOIN person_fts ON person.Id = person_fts.rowid WHERE person_fts MATCH 'director'").fetchall() == [
+        ('Jane Doe',)]
+    assert conn.execute('SELECT director, movies, scored FROM director_stats').fetchall() == [('Jane Doe', 2, 1)]
+    conn.close()
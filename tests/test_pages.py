@@ -0,0 +1,52 @@
+import os
+import shutil
+import sqlite3
+import pytest
+import supermovie_flask
+from conftest import DB_FILENAME
+
+def test_movie_info(client):
+    name = sqlite3.connect(DB_FILENAME).execute('SELECT name FROM movies ORDER BY Id LIMIT 1').fetchone()[0]
+    response = client.post('/movie_info', data={'name': name})
+    assert response.status_code == 200
+    assert name in response.get_data(as_text=True)
+
+@pytest.mark.parametrize('route', ['/movie_info', '/cast_info'])
+def test_unknown_name(client, route):
+    assert client.post(route, data={'name': 'No Such Name At All'}).status_code == 404
+
+def test_cached_pages_dropped_when_the_database_is_swapped(client, tmp_path):
+    '''a page is served from the cache until a new database is swapped in'''
+    db_filename = str(tmp_path / 'super_movie.sqlite')
+    shutil.copyfile(DB_FILENAME, db_filename)
+    supermovie_flask.pool.filename = db_filename
+    name = sqlite3.connect(db_filename).execute('SELECT name FROM movies ORDER BY Id LIMIT 1').fetchone()[0]
+    hits = supermovie_flask.response_cache.stats()['hits']
+    first = client.post('/movie_info', data={'name': name}).get_data(as_text=True)
+    assert client.post('/movie_info', data={'name': name}).get_data(as_text=True) == first
+    assert supermovie_flask.response_cache.stats()['hits'] == hits + 1
+
+    staging_filename = db_filename + '.staging'
+    shutil.copyfile(db_filename, staging_filename)
+    conn = sqlite3.connect(staging_filename)
+    conn.execute("UPDATE movies SET description = 'A new description.' WHERE name = ?", (name,))
+    conn.commit()
+    conn.close()
+    os.replace(staging_filename, db_filename)
+    page = client.post('/movie_info', data={'name': name}).get_data(as_text=True)
+    assert page != first
+    assert 'A new description.' in page
+
+def test_response_cache_keeps_the_most_recently_used_pages():
+    cache = supermovie_flask.ResponseCache(2)
+    assert cache.get('a', 1) is None
+    for page in ['a', 'b']:
+        cache.put(page, 1, page)
+    assert cache.get('a', 1) == 'a'
+    cache.put('c', 1, 'c')
+    assert cache.get('b', 1) is None
+    assert cache.get('a', 1) == 'a'
+    # a page rendered from the old database while the new one was swapped in is not kept
+    assert cache.get('a', 2) is None
+    cache.put('c', 1, 'c')
+    assert cache.get('c', 2) is None
@@ -0,0 +1,42 @@
+import tarfile
+import pytest
+import benchmark
+import final_proj
+
+@pytest.fixture(scope='module')
+def corpus_pages():
+    '''the html of every page of the benchmark corpus, by the directory of its kind'''
+    pages = {}
+    with tarfile.open(benchmark.CORPUS_FILENAME) as corpus:
+        for member in corpus.getmembers():
+            if member.isfile() and member.name.endswith('.html'):
+                kind = member.name.split('/')[1]
+                pages.setdefault(kind, []).append((member.name, corpus.extractfile(member).read().decode('utf-8')))
+    return pages
+
+@pytest.mark.parametrize('extractor, kind', [
+    (final_proj.extract_calendar, 'calendar'),
+    (final_proj.extract_movie, 'title'),
+    (final_proj.extract_movie_score, 'title'),
+    (final_proj.extract_cast, 'name'),
+])
+def test_strained_parse_matches_full_parse(corpus_pages, extractor, kind):
+    '''the strained PARSER extracts what a full html.parser parse of the page extracts'''
+    assert corpus_pages[kind]
+    for name, html in corpus_pages[kind]:
+        assert extractor(html, final_proj.PARSER, True) == extractor(html, 'html.parser', False), name
+
+def test_parse_pool_matches_parsing_in_the_thread(corpus_pages, monkeypatch):
+    '''the parse processes extract what the calling thread extracts, with its base_url'''
+    monkeypatch.setattr(final_proj, 'base_url', 'http://127.0.0.1:8000')
+    pages = [(final_proj.extract_calendar, html) for name, html in corpus_pages['calendar']]
+    pages += [(final_proj.extract_movie, html) for name, html in corpus_pages['title'][:10]]
+    pages += [(final_proj.extract_movie_score, html) for name, html in corpus_pages['title'][:10]]
+    pages += [(final_proj.extract_cast, html) for name, html in corpus_pages['name'][:10]]
+    expected = [final_proj.parse_page(extract, html) for extract, html in pages]
+    final_proj.start_parse_pool(2)
+    try:
+        assert [final_proj.parse_page(extract, html) for extract, html in pages] == expected
+    finally:
+        final_proj.stop_parse_pool()
+    assert 'http://127.0.0.1:8000/title/' in str(expected[0])
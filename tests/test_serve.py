@@ -0,0 +1,89 @@
+import os
+import re
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+import pytest
+import serve
+import supermovie_flask
+from conftest import REPOSITORY
+
+def workers_of(pid):
+    with open('/proc/%d/task/%d/children' % (pid, pid)) as children:
+        return [int(child) for child in children.read().split()]
+
+@pytest.fixture
+def server():
+    '''serve.py with 2 workers on a free port, stopped at the end of the test'''
+    if not hasattr(os, 'fork') or not os.path.exists('/proc/self/task'):
+        pytest.skip('needs os.fork and /proc to find the workers')
+    process = subprocess.Popen([sys.executable, '-u', 'serve.py', '--port', '0', '--workers', '2'],
+                               cwd=REPOSITORY, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    url = re.search(r'http://\S+', line).group(0)
+    yield process, url
+    if process.poll() is None:
+        process.terminate()
+        process.wait(10)
+    process.stdout.close()
+
+def get(url):
+    # the workers may still be loading the name indexes
+    for attempt in range(50):
+        try:
+            with urllib.request.urlopen(url, timeout=5) as response:
+                return response.status
+        except OSError:
+            time.sleep(0.1)
+    raise AssertionError('%s never answered' % url)
+
+def test_dead_worker_is_started_again(server):
+    process, url = server
+    assert get(url + '/') == 200
+    workers = workers_of(process.pid)
+    assert len(workers) == 2
+    os.kill(workers[0], signal.SIGKILL)
+    line = process.stdout.readline()
+    assert line.startswith('Worker %d exited' % workers[0])
+    for attempt in range(50):
+        if len(workers_of(process.pid)) == 2:
+            break
+        time.sleep(0.1)
+    assert workers[0] not in workers_of(process.pid)
+    assert len(workers_of(process.pid)) == 2
+    assert get(url + '/') == 200
+
+    workers = workers_of(process.pid)
+    process.terminate()
+    assert process.wait(10) == 0
+    # stopped and reaped by the server before it exits
+    assert not any(os.path.exists('/proc/%d' % worker) for worker in workers)
+
+def test_missing_database_stops_the_server(tmp_path, monkeypatch):
+    monkeypatch.setattr(supermovie_flask.pool, 'filename', str(tmp_path / 'missing.sqlite'))
+    with pytest.raises(SystemExit, match='Cannot serve'):
+        serve.check_database()
+
+def test_workers_dying_at_start_stop_the_server(monkeypatch, capsys):
+    '''a worker that cannot run is started again a few times, with a growing delay, then the
+    server exits with an error'''
+    if not hasattr(os, 'fork'):
+        pytest.skip('needs os.fork')
+    def fail(sock, access_log=False):
+        raise RuntimeError('the worker cannot run')
+    monkeypatch.setattr(serve, 'run_worker', fail)
+    monkeypatch.setattr(serve, 'check_database', lambda: None)
+    monkeypatch.setattr(serve, 'RESTART_DELAY', 0.01)
+    handlers = {signum: signal.getsignal(signum) for signum in [signal.SIGINT, signal.SIGTERM]}
+    try:
+        with pytest.raises(SystemExit) as exit_info:
+            serve.serve(port=0, workers=2)
+    finally:
+        for signum, handler in handlers.items():
+            signal.signal(signum, handler)
+    assert exit_info.value.code == 1
+    out = capsys.readouterr().out
+    assert out.count('starting another one') == serve.MAX_QUICK_DEATHS - 1
+    assert 'stopping the server' in out